@@ -0,0 +1,253 @@
+import asyncio
+import ipaddress
+import json
+import struct
+import time
+from typing import List
+
+from core.loop import BackgroundLoop
+
+HTTP_RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n\r\nok"
+HTTP_HEAD_RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n\r\n"
+
+DNS_TTL = 60
+
+
+def loopback_addresses(count: int) -> List[str]:
+    """
+    Distinct loopback addresses (127.0.0.1, 127.0.0.2, ...), all answered by the
+    local kernel, so ICMP can be measured against as many targets as needed.
+    """
+    first = ipaddress.IPv4Address("127.0.0.1")
+    return [str(first + index) for index in range(count)]
+
+
+def build_dns_answer(query: bytes, address: str = "127.0.0.1") -> bytes:
+    """
+    Answer a DNS query: one A record for A queries, an empty NOERROR answer otherwise.
+
+    Args:
+        query (bytes): Query packet
+        address (str): IPv4 address returned
+
+    Returns:
+        bytes: Response packet
+    """
+    end = 12
+    while query[end]:
+        end += query[end] + 1
+    question = query[12:end + 5]
+    record_type = struct.unpack("!H", question[-4:-2])[0]
+    answers = 1 if record_type == 1 else 0
+    header = query[:2] + struct.pack("!HHHHH", 0x8180, 1, answers, 0, 0)
+    packet = header + question
+    if answers:
+        # Name compressed as a pointer to the question, type A, class IN
+        packet += struct.pack("!HHHIH", 0xC00C, 1, 1, DNS_TTL, 4) + ipaddress.IPv4Address(address).packed
+    return packet
+
+
+class _StubDNSProtocol(asyncio.DatagramProtocol):
+    def __init__(self, stand_ins: "StandIns"):
+        self.stand_ins = stand_ins
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.stand_ins.dns_queries += 1
+        try:
+            self.transport.sendto(build_dns_answer(data), addr)
+        except (IndexError, struct.error):
+            pass  # Not a query, nothing to answer
+
+
+class StandIns:
+    """
+    Local targets for every protocol, so probes can be benchmarked without the network.
+
+    An HTTP/1.1 server answering every request with a keep-alive 200, a TCP
+    listener accepting connections, and a stub DNS server answering A queries,
+    all served by an event loop of their own so they do not compete with the
+    loop of the probers. ICMP needs no server: loopback addresses are answered
+    by the kernel, see loopback_addresses. The TCP listener accepts on every
+    IPv4 address for the same reason, so each loopback address is a distinct
+    port target.
+    """
+
+    def __init__(self, host: str = "127.0.0.1"):
+        """
+        Args:
+            host (str): Address the stand-ins listen on, each on a free port
+        """
+        self.host = host
+        self.http_port = None
+        self.tcp_port = None
+        self.dns_port = None
+        self.http_requests = 0
+        self.tcp_connections = 0
+        self.dns_queries = 0
+        self._loop = BackgroundLoop()
+        self._servers = []
+        self._dns_transport = None
+        self._connections = {}  # Handler task -> writer of the open HTTP connections
+
+    def start(self) -> "StandIns":
+        self._loop.run(self._start())
+        return self
+
+    async def _start(self) -> None:
+        http = await asyncio.start_server(self._serve_http, self.host, 0, backlog=4096)
+        tcp = await asyncio.start_server(self._serve_tcp, "0.0.0.0", 0, backlog=4096)
+        self._dns_transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _StubDNSProtocol(self), local_addr=(self.host, 0)
+        )
+        self._servers = [http, tcp]
+        self.http_port = http.sockets[0].getsockname()[1]
+        self.tcp_port = tcp.sockets[0].getsockname()[1]
+        self.dns_port = self._dns_transport.get_extra_info("sockname")[1]
+
+    async def _serve_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                self.http_requests += 1
+                request = head.decode("latin-1").lower()
+                writer.write(HTTP_HEAD_RESPONSE if request.startswith("head ") else HTTP_RESPONSE)
+                await writer.drain()
+                if "connection: close" in request:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+    async def _serve_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.tcp_connections += 1
+        writer.close()
+
+    def stop(self) -> None:
+        if self._servers or self._dns_transport is not None:
+            self._loop.run(self._stop())
+        self._loop.stop()
+
+    async def _stop(self) -> None:
+        for server in self._servers:
+            server.close()
+        if self._dns_transport is not None:
+            self._dns_transport.close()
+        self._servers = []
+        self._dns_transport = None
+        # Keep-alive connections outlive their server, end them before the loop stops
+        handlers = list(self._connections)
+        for writer in self._connections.values():
+            writer.close()
+        if handlers:
+            await asyncio.wait(handlers, timeout=1)
+
+    def __enter__(self) -> "StandIns":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+class BotAPIStandIn:
+    """
+    Local Telegram Bot API answering sendMessage, to exercise the alert dispatcher.
+
+    Every request is recorded with its arrival time (time.monotonic). The
+    first `rate_limited` requests are refused with a 429 asking to retry
+    after `retry_after` seconds, like the real API does when flooded.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", rate_limited: int = 0, retry_after: int = 1):
+        """
+        Args:
+            host (str): Address the stand-in listens on, on a free port
+            rate_limited (int): Requests answered with a 429 before the others succeed
+            retry_after (int): Seconds the 429 answers ask to wait
+        """
+        self.host = host
+        self.port = None
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.requests = []  # (arrival time, path, JSON body, HTTP status)
+        self._loop = BackgroundLoop()
+        self._server = None
+        self._connections = {}  # Handler task -> writer of the open connections
+
+    @property
+    def api_url(self) -> str:
+        """Base URL to configure as the `api_url` of a reporter."""
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def messages(self) -> list:
+        """Bodies of the sendMessage requests that were accepted."""
+        return [body for _, _, body, status in self.requests if status == 200]
+
+    def start(self) -> "BotAPIStandIn":
+        self._loop.run(self._start())
+        return self
+
+    async def _start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+                arrival = time.monotonic()
+                length = 0
+                for line in head.split("\r\n")[1:]:
+                    name, _, value = line.partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                body = json.loads(await reader.readexactly(length)) if length else {}
+
+                if len(self.requests) < self.rate_limited:
+                    status, answer = 429, {
+                        "ok": False, "error_code": 429,
+                        "description": f"Too Many Requests: retry after {self.retry_after}",
+                        "parameters": {"retry_after": self.retry_after},
+                    }
+                else:
+                    status, answer = 200, {"ok": True, "result": {"message_id": len(self.requests) + 1}}
+                self.requests.append((arrival, head.split(" ")[1], body, status))
+
+                payload = json.dumps(answer).encode()
+                reason = "OK" if status == 200 else "Too Many Requests"
+                writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._loop.run(self._stop())
+        self._loop.stop()
+
+    async def _stop(self) -> None:
+        self._server.close()
+        self._server = None
+        handlers = list(self._connections)
+        for writer in self._connections.values():
+            writer.close()
+        if handlers:
+            await asyncio.wait(handlers, timeout=1)
+
+    def __enter__(self) -> "BotAPIStandIn":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
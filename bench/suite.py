@@ -0,0 +1,388 @@
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from bench.standins import StandIns, loopback_addresses
+from core.protocols import protocols
+from core.result import ProbeBatch, ProbeResult
+from core.scheduler import sweep
+
+DEFAULT_TARGETS = (1, 100, 10000)
+DEFAULT_PROTOCOLS = ("http", "port", "dns", "icmp")
+DEFAULT_ROWS = 1000000
+
+# Small target counts are probed again until this many probes were timed, so the
+# figures for a single target are not a single noisy sample
+MIN_PROBES = 200
+
+HISTORY_FILE = os.path.join("data", "benchmarks", "bench.jsonl")
+
+# Figures compared between two runs, with whether a higher value is better
+COMPARED = {
+    "probes_per_sec": True,
+    "overhead_ms_p50": False,
+    "rows_per_sec": True,
+    "ms_p50": False,
+}
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of the values, None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)], 3)
+
+
+def target_configs(protocol: str, count: int, stand_ins: StandIns) -> List[Dict[str, str]]:
+    """
+    Site configurations of `count` distinct targets served by the stand-ins.
+
+    Args:
+        protocol (str): http, port, dns or icmp
+        count (int): Number of targets
+        stand_ins (StandIns): Running stand-ins
+
+    Returns:
+        list: One configuration per target, as read from a site file
+    """
+    host = stand_ins.host
+    if protocol == "http":
+        return [{"site": host, "url": f"http://{host}:{stand_ins.http_port}/target/{index}", "timeout": "5"}
+                for index in range(count)]
+    if protocol == "port":
+        return [{"site": address, "ports": str(stand_ins.tcp_port), "timeout": "5"}
+                for address in loopback_addresses(count)]
+    if protocol == "dns":
+        return [{"site": f"target{index}.bench.test", "dns_server": host, "dns_port": str(stand_ins.dns_port),
+                 "record_type": "A", "timeout": "5"} for index in range(count)]
+    if protocol == "icmp":
+        return [{"site": address, "timeout": "5"} for address in loopback_addresses(count)]
+    raise ValueError(f"No stand-in for protocol '{protocol}'")
+
+
+def icmp_unavailable() -> Optional[str]:
+    """Why ICMP cannot be benchmarked here, None if it can."""
+    from utils.icmp import ICMPBatch
+
+    try:
+        sock, _ = ICMPBatch()._open_socket()
+    except OSError as e:
+        return f"no ICMP socket: {e}"
+    sock.close()
+    return None
+
+
+def run_probes(protocol: str, configs: List[Dict[str, str]], concurrency: int):
+    """
+    Probe every configuration the way `ping --all` does: with the batch engine
+    of the protocol when it has one, otherwise one check per worker thread.
+
+    Returns:
+        tuple: (results, durations) where durations are the seconds each check
+               took once a worker ran it, None for batch engines which do not
+               time probes one by one
+    """
+    prober = protocols.get(protocol)
+    if hasattr(prober, "ping_many"):
+        return prober.ping_many(configs), None
+
+    results = {}
+    durations = {}
+
+    def check(index: str) -> None:
+        started = time.perf_counter()
+        results[index] = prober(configs[int(index)]).ping()
+        durations[index] = time.perf_counter() - started
+
+    names = [str(index) for index in range(len(configs))]
+    asyncio.run(sweep(check, names, concurrency))
+    return [results.get(name) for name in names], [durations.get(name, 0.0) for name in names]
+
+
+def bench_protocol(protocol: str, count: int, stand_ins: StandIns, concurrency: int) -> dict:
+    """
+    Measure the throughput and overhead of a prober against `count` targets.
+
+    The overhead is the time a check takes beyond the response time the prober
+    reports: threads, event loop hand-offs and building the result. Batch
+    engines do not time probes one by one, their overhead is the time a batch
+    takes beyond its slowest response, once per round.
+
+    Returns:
+        dict: Probes per second, response time and overhead percentiles in ms,
+              and the failures by error class
+    """
+    configs = target_configs(protocol, count, stand_ins)
+    rounds = max(1, math.ceil(MIN_PROBES / count))
+    results = []
+    overheads = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        round_started = time.perf_counter()
+        replies, timings = run_probes(protocol, configs, concurrency)
+        round_ms = (time.perf_counter() - round_started) * 1000
+        results.extend(replies)
+        if timings is not None:
+            overheads.extend(seconds * 1000 - result.response_time_ms for result, seconds in zip(replies, timings)
+                             if result is not None and result.success and result.response_time_ms is not None)
+        else:
+            slowest = max((result.response_time_ms for result in replies
+                           if result is not None and result.success and result.response_time_ms is not None),
+                          default=0.0)
+            overheads.append(round_ms - slowest)
+    wall = time.perf_counter() - started
+
+    latencies = [result.response_time_ms for result in results
+                 if result is not None and result.success and result.response_time_ms is not None]
+    errors = {}
+    for result in results:
+        if result is None or not result.success:
+            error_class = result.error_class if result is not None else "exception"
+            errors[error_class] = errors.get(error_class, 0) + 1
+
+    return {
+        "targets": count,
+        "rounds": rounds,
+        "probes": len(results),
+        "wall_s": round(wall, 3),
+        "probes_per_sec": round(len(results) / wall, 1) if wall else None,
+        "response_ms_p50": percentile(latencies, 0.5),
+        "response_ms_p95": percentile(latencies, 0.95),
+        "overhead_ms_p50": percentile(overheads, 0.5),
+        "overhead_ms_p95": percentile(overheads, 0.95),
+        "failures": errors,
+    }
+
+
+def bench_probes(targets=DEFAULT_TARGETS, protocol_names=DEFAULT_PROTOCOLS, concurrency: int = 64) -> dict:
+    """
+    Benchmark each prober against local stand-ins at each target count.
+
+    Returns:
+        dict: Results per protocol and target count, or the reason a protocol was skipped
+    """
+    report = {}
+    with StandIns() as stand_ins:
+        for protocol in protocol_names:
+            if protocol == "icmp":
+                reason = icmp_unavailable()
+                if reason:
+                    report[protocol] = {"skipped": reason}
+                    print(f"{protocol}: skipped, {reason}")
+                    continue
+            # Warm up: imports, the background loop and pooled connections are not measured
+            run_probes(protocol, target_configs(protocol, 1, stand_ins), concurrency)
+            report[protocol] = {}
+            for count in targets:
+                result = bench_protocol(protocol, count, stand_ins, concurrency)
+                report[protocol][str(count)] = result
+                print(f"{protocol:>5} x {count:<6} {result['probes_per_sec']:>10} probes/s  "
+                      f"overhead p50 {result['overhead_ms_p50']} ms  failures {sum(result['failures'].values())}")
+    return report
+
+
+def synthetic_batches(rows: int, batch_size: int, sites: int, interval: float = 60, seed: int = 0):
+    """
+    Yield ProbeBatch objects of made-up results, in time order up to now, as if
+    each site had been checked every `interval` seconds.
+
+    Sites cycle through every protocol and one result in 50 is a timeout, so the
+    rollups and the dimension tables see a realistic mix.
+    """
+    rng = random.Random(seed)
+    protocol_names = DEFAULT_PROTOCOLS
+    start = time.time() - math.ceil(rows / sites) * interval
+    for first in range(0, rows, batch_size):
+        batch = ProbeBatch()
+        for index in range(first, min(first + batch_size, rows)):
+            site = index % sites
+            timestamp = start + (index // sites) * interval + site * interval / sites
+            if index % 50:
+                result = ProbeResult(True, round(rng.lognormvariate(3, 0.5), 3), 200,
+                                     output=f"HTTP 200 OK from https://site{site}.bench.test/ (1256 bytes read)",
+                                     timestamp=timestamp)
+            else:
+                result = ProbeResult(False, None, error_class="timeout", error="Timeout after 10s",
+                                     output="Error: Timeout after 10s", timestamp=timestamp)
+            result.hostname = "bench"
+            batch.append(f"site{site}.bench.test", protocol_names[site % len(protocol_names)], result)
+        yield batch
+
+
+def _timed(function, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"repeat": repeat, "ms_p50": percentile(timings, 0.5), "ms_p95": percentile(timings, 0.95)}
+
+
+def bench_storage(rows: int = DEFAULT_ROWS, batch_size: int = 500, sites: int = 100, schema: str = "v2",
+                  directory: Optional[str] = None) -> dict:
+    """
+    Measure PingMonitorDB insert throughput and query latency on a fresh file.
+
+    Rows are inserted with insert_batch in batches of `batch_size`, as the
+    writer does, then the queries behind history, summaries, graphs and
+    rollup rebuilds are timed on the full table.
+
+    Args:
+        rows (int): Results inserted
+        batch_size (int): Results per transaction
+        sites (int): Distinct sites the results are spread over
+        schema (str): v2 (compact layout of new files) or v1 (legacy layout)
+        directory (str, optional): Where the database is created, a temporary directory by default
+
+    Returns:
+        dict: Insert rate, file size and timings of each query
+    """
+    from data.models.db import PingMonitorDB
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        if schema == "v1":
+            # A file already at user_version 1 keeps the legacy layout
+            with sqlite3.connect(path) as connection:
+                connection.execute("PRAGMA user_version = 1")
+        db = PingMonitorDB(path)
+
+        insert_seconds = 0.0
+        for batch in synthetic_batches(rows, batch_size, sites):
+            started = time.perf_counter()
+            db.insert_batch(batch)
+            insert_seconds += time.perf_counter() - started
+        db.db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        size = db.storage_size()
+
+        site, protocol = "site1.bench.test", DEFAULT_PROTOCOLS[1]
+        end = datetime.now()
+        queries = {
+            "history_100": _timed(lambda: list(db.get_ping_history(site, protocol, limit=100)), 50),
+            "summarize_30d": _timed(lambda: db.summarize(site, protocol, end - timedelta(days=30), end), 20),
+            "summarize_1d": _timed(lambda: db.summarize(site, protocol, end - timedelta(days=1), end), 20),
+            "rollups_7d": _timed(lambda: db.get_rollups(site, protocol, end - timedelta(days=7), end), 20),
+        }
+        started = time.perf_counter()
+        scanned = sum(len(chunk) for chunk in db.iter_rows())
+        scan_seconds = time.perf_counter() - started
+        db.close()
+
+    result = {
+        "schema": schema,
+        "rows": rows,
+        "batch_size": batch_size,
+        "sites": sites,
+        "insert_s": round(insert_seconds, 3),
+        "rows_per_sec": round(rows / insert_seconds, 1) if insert_seconds else None,
+        "bytes": size,
+        "bytes_per_row": round(size / rows, 1) if rows else None,
+        "queries": queries,
+        "scan": {"rows": scanned, "rows_per_sec": round(scanned / scan_seconds, 1) if scan_seconds else None},
+    }
+    print(f"storage ({schema}): {result['rows_per_sec']} rows/s inserted, {result['bytes_per_row']} bytes/row, "
+          f"{result['scan']['rows_per_sec']} rows/s scanned")
+    for name, timing in queries.items():
+        print(f"  {name:<14} p50 {timing['ms_p50']} ms  p95 {timing['ms_p95']} ms")
+    return result
+
+
+def environment() -> dict:
+    """Where and on what code the benchmark ran, so runs can be told apart."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        # Loopback echo replies count against it, ICMP at many targets is capped by it
+        with open("/proc/sys/net/ipv4/icmp_msgs_per_sec", "r", encoding="utf-8") as f:
+            icmp_msgs_per_sec = int(f.read())
+    except (OSError, ValueError):
+        icmp_msgs_per_sec = None
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "icmp_msgs_per_sec": icmp_msgs_per_sec,
+    }
+
+
+def _figures(report: dict, prefix: str = ""):
+    """Flatten the compared figures of a report into {path: value}."""
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _figures(value, path + ".")
+        elif key in COMPARED and isinstance(value, (int, float)):
+            yield path, value
+
+
+def compare(report: dict, previous: dict) -> List[str]:
+    """
+    Describe how the figures of a run changed since a previous one.
+
+    Returns:
+        list: One line per figure found in both runs, e.g. "http.100.probes_per_sec: 950 -> 1020 (+7.4%, better)"
+    """
+    before = dict(_figures(previous.get("results", {})))
+    lines = []
+    for path, value in _figures(report.get("results", {})):
+        old = before.get(path)
+        if not old:
+            continue
+        change = (value - old) / old * 100
+        better = (change > 0) == COMPARED[path.rsplit(".", 1)[-1]]
+        verdict = "same" if abs(change) < 5 else ("better" if better else "worse")
+        lines.append(f"{path}: {old} -> {value} ({change:+.1f}%, {verdict})")
+    return lines
+
+
+def run_suite(targets=DEFAULT_TARGETS, protocol_names=DEFAULT_PROTOCOLS, concurrency: int = 64,
+              rows: int = DEFAULT_ROWS, batch_size: int = 500, schema: str = "v2") -> dict:
+    """
+    Run the probe and storage benchmarks.
+
+    Args:
+        targets (tuple): Target counts each prober is measured at
+        protocol_names (tuple): Protocols to benchmark, none to skip probes
+        concurrency (int): Checks in flight, as `ping --concurrency`
+        rows (int): Results inserted in the storage benchmark, 0 to skip it
+        batch_size (int): Results per insert transaction
+        schema (str): Database layout, v2 or v1
+
+    Returns:
+        dict: The environment, the parameters and the results, ready for JSON
+    """
+    results = {}
+    if protocol_names:
+        results["probes"] = bench_probes(targets, protocol_names, concurrency)
+    if rows:
+        results["storage"] = bench_storage(rows, batch_size, schema=schema)
+    return {
+        "environment": environment(),
+        "parameters": {"targets": list(targets), "protocols": list(protocol_names), "concurrency": concurrency,
+                       "rows": rows, "batch_size": batch_size, "schema": schema},
+        "results": results,
+    }
+
+
+def last_record(history_file: str) -> Optional[dict]:
+    if not os.path.exists(history_file):
+        return None
+    with open(history_file, "r", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
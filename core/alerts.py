@@ -0,0 +1,183 @@
+import json
+from typing import Dict, Optional
+
+from core.result import ProbeResult
+
+STATE_UNKNOWN = "unknown"
+STATE_UP = "up"
+STATE_DOWN = "down"
+
+# Kinds of state changes notified
+CHANGE_DOWN = "down"          # UP (or unknown) -> DOWN
+CHANGE_UP = "up"              # DOWN -> UP, with the outage duration
+CHANGE_FLAPPING = "flapping"  # Too many transitions, notifications are suppressed
+CHANGE_STABLE = "stable"      # Flapping is over, with the current state
+CHANGE_SLOW = "slow"          # Latency above the baseline for several checks, see core.anomaly
+CHANGE_FAST = "fast"          # Latency back to the baseline, with the degradation duration
+
+
+class AlertPolicy:
+    """
+    When a site changes state and when its notifications are suppressed.
+    """
+    __slots__ = ("down_after", "up_after", "flap_window", "flap_threshold", "flap_suppress")
+
+    DEFAULTS = {"down_after": 3, "up_after": 2, "flap_window": 3600, "flap_threshold": 4, "flap_suppress": 1800}
+
+    def __init__(self, down_after: int = 3, up_after: int = 2, flap_window: float = 3600,
+                 flap_threshold: int = 4, flap_suppress: float = 1800):
+        """
+        Args:
+            down_after (int): Consecutive failures before a site is DOWN
+            up_after (int): Consecutive successes before a site is UP again
+            flap_window (float): Seconds over which transitions are counted
+            flap_threshold (int): Transitions within the window that make a site flapping
+            flap_suppress (float): Minimum seconds notifications stay suppressed once flapping
+        """
+        self.down_after = down_after
+        self.up_after = up_after
+        self.flap_window = flap_window
+        self.flap_threshold = flap_threshold
+        self.flap_suppress = flap_suppress
+
+    @classmethod
+    def from_config(cls, reporter_config: Dict[str, str]) -> "AlertPolicy":
+        """
+        Read the policy from the [reporter] section of a site.
+
+        Raises:
+            ValueError: If a value is not a positive number
+        """
+        values = {}
+        for key, default in cls.DEFAULTS.items():
+            value = type(default)(reporter_config.get(key, default))
+            if value <= 0:
+                raise ValueError(f"{key} must be positive")
+            values[key] = value
+        return cls(**values)
+
+
+class StateChange:
+    """
+    A state change of a site worth notifying.
+    """
+    __slots__ = ("kind", "site", "protocol", "state", "since", "duration", "transitions", "suppressed", "result",
+                 "baseline")
+
+    def __init__(self, kind: str, site: str, protocol: str, state: str, since: float,
+                 result: ProbeResult, duration: Optional[float] = None, transitions: int = 0,
+                 suppressed: int = 0, baseline: Optional[float] = None):
+        """
+        Args:
+            kind (str): CHANGE_DOWN, CHANGE_UP, CHANGE_FLAPPING, CHANGE_STABLE, CHANGE_SLOW or CHANGE_FAST
+            site (str): The site that was pinged
+            protocol (str): The protocol used
+            state (str): State of the site after the change
+            since (float): Epoch seconds the site has been in that state
+            result (ProbeResult): Result that confirmed the change
+            duration (float, optional): Outage duration in seconds, for CHANGE_UP and CHANGE_FAST
+            transitions (int): Transitions within the flap window, for CHANGE_FLAPPING
+            suppressed (int): Changes not notified while flapping, for CHANGE_STABLE
+            baseline (float, optional): Usual latency of the site in ms, for CHANGE_SLOW and CHANGE_FAST
+        """
+        self.kind = kind
+        self.site = site
+        self.protocol = protocol
+        self.state = state
+        self.since = since
+        self.duration = duration
+        self.transitions = transitions
+        self.suppressed = suppressed
+        self.result = result
+        self.baseline = baseline
+
+
+class SiteState:
+    """
+    Persisted state of one site, see PingMonitorDB.get_site_state.
+    """
+    __slots__ = ("state", "changed_at", "streak_success", "streak", "streak_started", "down_since",
+                 "transitions", "flapping", "suppressed_until", "suppressed")
+
+    def __init__(self, state: str = STATE_UNKNOWN, changed_at: float = 0.0, streak_success: bool = True,
+                 streak: int = 0, streak_started: float = 0.0, down_since: Optional[float] = None,
+                 transitions: str = "[]", flapping: bool = False, suppressed_until: float = 0.0,
+                 suppressed: int = 0):
+        self.state = state
+        self.changed_at = changed_at  # Epoch seconds of the first result of the current state
+        self.streak_success = streak_success
+        self.streak = streak
+        self.streak_started = streak_started
+        self.down_since = down_since
+        self.transitions = json.loads(transitions) if isinstance(transitions, str) else list(transitions)
+        self.flapping = flapping
+        self.suppressed_until = suppressed_until
+        self.suppressed = suppressed  # Changes not notified while flapping
+
+    def to_row(self) -> dict:
+        row = {name: getattr(self, name) for name in self.__slots__}
+        row["transitions"] = json.dumps(self.transitions)
+        return row
+
+
+def advance(state: SiteState, policy: AlertPolicy, site: str, protocol: str,
+            result: ProbeResult) -> Optional[StateChange]:
+    """
+    Feed a result to the state machine of a site.
+
+    A site turns DOWN after `down_after` consecutive failures and UP after
+    `up_after` consecutive successes. When it changes state `flap_threshold`
+    times within `flap_window` seconds it is flapping: a single notification
+    is sent, later changes are suppressed for at least `flap_suppress` seconds,
+    and a last notification tells the state once it is stable again.
+
+    Args:
+        state (SiteState): State of the site, updated in place
+        policy (AlertPolicy): Thresholds of the site
+        site (str): The site that was pinged
+        protocol (str): The protocol used
+        result (ProbeResult): The new result
+
+    Returns:
+        StateChange: The change to notify, None if there is nothing to say. For
+                     CHANGE_UP the duration is left to the caller, which knows the history.
+    """
+    now = result.timestamp
+    if state.streak and state.streak_success == bool(result.success):
+        state.streak += 1
+    else:
+        state.streak_success = bool(result.success)
+        state.streak = 1
+        state.streak_started = now
+    state.transitions = [t for t in state.transitions if t > now - policy.flap_window]
+
+    target = STATE_UP if result.success else STATE_DOWN
+    needed = policy.up_after if result.success else policy.down_after
+    change = None
+    if state.state != target and state.streak >= needed:
+        previous, state.state = state.state, target
+        state.changed_at = state.streak_started
+        if target == STATE_DOWN:
+            state.down_since = state.streak_started
+        # The first state of a new site is only worth telling when it is DOWN
+        if previous != STATE_UNKNOWN:
+            state.transitions.append(now)
+        if previous != STATE_UNKNOWN or target == STATE_DOWN:
+            kind = CHANGE_DOWN if target == STATE_DOWN else CHANGE_UP
+            change = StateChange(kind, site, protocol, target, state.streak_started, result)
+
+    flaps = len(state.transitions)
+    if change is not None and not state.flapping and flaps >= policy.flap_threshold:
+        state.flapping = True
+        state.suppressed_until = now + policy.flap_suppress
+        state.suppressed = 0
+        return StateChange(CHANGE_FLAPPING, site, protocol, state.state, now, result, transitions=flaps)
+    if state.flapping:
+        if change is not None:
+            state.suppressed += 1
+        if now < state.suppressed_until or flaps >= policy.flap_threshold:
+            return None
+        state.flapping = False
+        return StateChange(CHANGE_STABLE, site, protocol, state.state, state.changed_at, result,
+                           suppressed=state.suppressed)
+    return change
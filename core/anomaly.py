@@ -0,0 +1,256 @@
+import json
+import math
+from bisect import insort
+from typing import Dict, List, Optional
+
+from core.alerts import CHANGE_FAST, CHANGE_SLOW, StateChange
+from core.metrics import LATENCY_SLOW_CHECKS
+from core.result import ProbeResult
+
+LATENCY_NORMAL = "normal"
+LATENCY_SLOW = "slow"
+
+# Weight of a slow latency in the baseline mean, relative to a normal one: a degradation
+# barely moves the baseline, a lasting change of level is still learned after about 150 checks
+ANOMALY_WEIGHT = 0.1
+
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P² algorithm (Jain and Chlamtac, 1985).
+
+    Five markers are kept whatever the number of values seen: the minimum, the
+    maximum, the quantile and two points halfway to them. Their heights are
+    adjusted with a parabolic interpolation as values arrive.
+    """
+    __slots__ = ("p", "heights", "positions")
+
+    def __init__(self, p: float, heights: Optional[List[float]] = None, positions: Optional[List[int]] = None):
+        """
+        Args:
+            p (float): Quantile between 0 and 1, e.g. 0.95
+            heights (list, optional): Marker heights of a saved sketch, the first values until there are five
+            positions (list, optional): Marker positions of a saved sketch
+        """
+        if not 0 < p < 1:
+            raise ValueError(f"Invalid quantile: {p}")
+        self.p = p
+        self.heights = list(heights or [])
+        self.positions = list(positions or [])
+
+    @property
+    def count(self) -> int:
+        """Number of values seen."""
+        return self.positions[4] if self.positions else len(self.heights)
+
+    def add(self, value: float) -> None:
+        heights, positions = self.heights, self.positions
+        if len(heights) < 5:
+            insort(heights, value)
+            if len(heights) == 5:
+                positions.extend(range(1, 6))
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = next(index for index in range(4) if value < heights[index + 1])
+        for index in range(cell + 1, 5):
+            positions[index] += 1
+
+        count, p = positions[4], self.p
+        desired = (1 + (count - 1) * p / 2, 1 + (count - 1) * p, 1 + (count - 1) * (1 + p) / 2)
+        for index in (1, 2, 3):
+            offset = desired[index - 1] - positions[index]
+            if (offset >= 1 and positions[index + 1] - positions[index] > 1) or \
+                    (offset <= -1 and positions[index - 1] - positions[index] < -1):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(index, step)
+                if not heights[index - 1] < height < heights[index + 1]:
+                    height = heights[index] + step * (heights[index + step] - heights[index]) / (
+                        positions[index + step] - positions[index])
+                heights[index] = height
+                positions[index] += step
+
+    def _parabolic(self, index: int, step: int) -> float:
+        q, n = self.heights, self.positions
+        return q[index] + step / (n[index + 1] - n[index - 1]) * (
+            (n[index] - n[index - 1] + step) * (q[index + 1] - q[index]) / (n[index + 1] - n[index])
+            + (n[index + 1] - n[index] - step) * (q[index] - q[index - 1]) / (n[index] - n[index - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        """The estimated quantile, None before the first value."""
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            return self.heights[min(int(self.p * len(self.heights)), len(self.heights) - 1)]
+        return self.heights[2]
+
+    def to_json(self) -> str:
+        return json.dumps([self.heights, self.positions])
+
+    @classmethod
+    def from_json(cls, p: float, text: str) -> "P2Quantile":
+        heights, positions = json.loads(text) if text else ([], [])
+        return cls(p, heights, positions)
+
+
+class LatencyPolicy:
+    """
+    When the latency of a site is degraded.
+    """
+    __slots__ = ("enabled", "quantile", "sigma", "factor", "min_delta", "slow_after", "fast_after", "warmup",
+                 "alpha")
+
+    DEFAULTS = {"latency_quantile": 0.95, "latency_sigma": 3.0, "latency_factor": 1.5, "latency_min_delta": 20.0,
+                "slow_after": 5, "fast_after": 5, "latency_warmup": 30, "latency_alpha": 0.05}
+
+    def __init__(self, enabled: bool = True, quantile: float = 0.95, sigma: float = 3.0, factor: float = 1.5,
+                 min_delta: float = 20.0, slow_after: int = 5, fast_after: int = 5, warmup: int = 30,
+                 alpha: float = 0.05):
+        """
+        Args:
+            enabled (bool): Whether latency changes are notified
+            quantile (float): Quantile of the normal latencies a slow check must exceed
+            sigma (float): Standard deviations above the baseline a slow check must exceed
+            factor (float): Ratio to the baseline a slow check must exceed
+            min_delta (float): Milliseconds above the baseline a slow check must exceed
+            slow_after (int): Consecutive slow checks before a site is SLOW
+            fast_after (int): Consecutive normal checks before it is back to normal
+            warmup (int): Checks learned before any is judged
+            alpha (float): Weight of a new latency in the moving baseline
+        """
+        self.enabled = enabled
+        self.quantile = quantile
+        self.sigma = sigma
+        self.factor = factor
+        self.min_delta = min_delta
+        self.slow_after = slow_after
+        self.fast_after = fast_after
+        self.warmup = warmup
+        self.alpha = alpha
+
+    @classmethod
+    def from_config(cls, reporter_config: Dict[str, str]) -> "LatencyPolicy":
+        """
+        Read the policy from the [reporter] section of a site.
+
+        Raises:
+            ValueError: If a value is not a positive number, or a quantile or weight not below 1
+        """
+        values = {}
+        for key, default in cls.DEFAULTS.items():
+            value = type(default)(reporter_config.get(key, default))
+            if value <= 0:
+                raise ValueError(f"{key} must be positive")
+            if key in ("latency_quantile", "latency_alpha") and value >= 1:
+                raise ValueError(f"{key} must be below 1")
+            values[key.replace("latency_", "")] = value
+        enabled = reporter_config.get("latency_alerts", "true").strip().lower() not in ("false", "no", "off", "0")
+        return cls(enabled, **values)
+
+
+class LatencyState:
+    """
+    Persisted latency baseline of one site, see PingMonitorDB.get_latency_state.
+
+    The baseline is an exponentially weighted mean and variance and a P²
+    sketch of the normal latencies, so it takes the same few bytes whatever
+    the history of the site.
+    """
+    __slots__ = ("state", "changed_at", "samples", "mean", "variance", "sketch", "streak_slow", "streak",
+                 "streak_started")
+
+    def __init__(self, state: str = LATENCY_NORMAL, changed_at: float = 0.0, samples: int = 0, mean: float = 0.0,
+                 variance: float = 0.0, sketch: str = "", streak_slow: bool = False, streak: int = 0,
+                 streak_started: float = 0.0):
+        self.state = state
+        self.changed_at = changed_at  # Epoch seconds of the first check of the current state
+        self.samples = samples  # Latencies learned
+        self.mean = mean
+        self.variance = variance
+        self.sketch = sketch  # P2Quantile.to_json of the normal latencies
+        self.streak_slow = streak_slow
+        self.streak = streak
+        self.streak_started = streak_started
+
+    def to_row(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def threshold(self, policy: LatencyPolicy, sketch: P2Quantile) -> float:
+        """Latency in ms above which a check is slow."""
+        quantile = sketch.value()
+        return max(
+            self.mean * policy.factor,
+            self.mean + policy.min_delta,
+            self.mean + policy.sigma * math.sqrt(self.variance),
+            quantile if quantile is not None else 0.0,
+        )
+
+
+def observe(state: LatencyState, policy: LatencyPolicy, site: str, protocol: str,
+            result: ProbeResult) -> Optional[StateChange]:
+    """
+    Feed the latency of a result to the baseline of a site.
+
+    A check is slow when its latency is above the `quantile` of the normal
+    latencies and well above the moving mean (by `factor`, `min_delta` and
+    `sigma` standard deviations). A site is SLOW after `slow_after` slow
+    checks in a row, and back to normal after `fast_after` normal ones. Failed
+    checks carry no latency and are left to the UP/DOWN state machine.
+
+    Args:
+        state (LatencyState): Baseline of the site, updated in place
+        policy (LatencyPolicy): Thresholds of the site
+        site (str): The site that was pinged
+        protocol (str): The protocol used
+        result (ProbeResult): The new result
+
+    Returns:
+        StateChange: CHANGE_SLOW or CHANGE_FAST to notify, None if there is nothing to say
+    """
+    if not result.success or result.response_time_ms is None:
+        return None
+    latency = float(result.response_time_ms)
+    now = result.timestamp
+    sketch = P2Quantile.from_json(policy.quantile, state.sketch)
+    slow = state.samples >= policy.warmup and latency > state.threshold(policy, sketch)
+
+    # Plain average while warming up, exponentially weighted afterwards
+    weight = max(policy.alpha, 1.0 / (state.samples + 1))
+    difference = latency - state.mean
+    if slow:
+        # Only the mean moves, widening the spread would soon hide the degradation
+        LATENCY_SLOW_CHECKS.inc(protocol)
+        state.mean += weight * ANOMALY_WEIGHT * difference
+    else:
+        state.mean += weight * difference
+        state.variance = (1 - weight) * (state.variance + weight * difference * difference)
+        sketch.add(latency)
+        state.sketch = sketch.to_json()
+    state.samples += 1
+
+    if state.streak and state.streak_slow == slow:
+        state.streak += 1
+    else:
+        state.streak_slow = slow
+        state.streak = 1
+        state.streak_started = now
+    if not policy.enabled:
+        return None
+
+    if slow and state.state != LATENCY_SLOW and state.streak >= policy.slow_after:
+        state.state, state.changed_at = LATENCY_SLOW, state.streak_started
+        return StateChange(CHANGE_SLOW, site, protocol, LATENCY_SLOW, state.streak_started, result,
+                           baseline=state.mean)
+    if not slow and state.state == LATENCY_SLOW and state.streak >= policy.fast_after:
+        duration = state.streak_started - state.changed_at
+        state.state, state.changed_at = LATENCY_NORMAL, state.streak_started
+        return StateChange(CHANGE_FAST, site, protocol, LATENCY_NORMAL, state.streak_started, result,
+                           duration=duration, baseline=state.mean)
+    return None
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect
+from typing import Callable, Iterable, List, Optional
+
+# Seconds a node lease lasts without a heartbeat before its sites fail over
+DEFAULT_TTL = 30
+# Points of each node on the ring; more points spread the sites more evenly
+VIRTUAL_NODES = 64
+# Expired leases are kept this many TTLs, so `members` can still show departed nodes
+FORGET_AFTER_TTLS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cluster_nodes (
+    node TEXT PRIMARY KEY,
+    hostname TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started REAL NOT NULL,
+    heartbeat REAL NOT NULL,
+    expires REAL NOT NULL
+)
+"""
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of site names onto nodes.
+
+    When a node joins or leaves, only the sites it gains or loses move; the
+    other sites keep their owner.
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = VIRTUAL_NODES):
+        """
+        Args:
+            nodes (iterable): Node names
+            replicas (int): Virtual points placed on the ring for each node
+        """
+        self.nodes = sorted(set(nodes))
+        points = sorted((_point(f"{node}#{index}"), node) for node in self.nodes for index in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        """
+        Node owning a key: the first node point clockwise from the key.
+
+        Returns:
+            str: Node name, or None if the ring is empty
+        """
+        if not self._points:
+            return None
+        return self._owners[bisect(self._points, _point(key)) % len(self._points)]
+
+
+class Cluster:
+    """
+    Membership of the monitoring nodes sharing a set of sites.
+
+    Every node holds a lease in a shared SQLite file and renews it with a
+    heartbeat. The sites are spread over the nodes whose lease is live with
+    a consistent hash ring, so each site is probed by one node; when a node
+    stops renewing its lease, its sites fail over to the others at their next
+    heartbeat. Leases use the wall clock, so the clocks of the nodes must be
+    kept in sync (NTP) to well within the TTL.
+    """
+
+    def __init__(self, path: str, node: str, ttl: float = DEFAULT_TTL, hostname: Optional[str] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            path (str): Shared SQLite file holding the leases
+            node (str): Name of this node, unique in the cluster and stable across restarts
+            ttl (float): Seconds the lease of this node lasts without a heartbeat
+            hostname (str, optional): Host name recorded with the lease
+            clock (callable): Wall clock returning seconds
+        """
+        if ttl <= 0:
+            raise ValueError(f"Invalid cluster TTL: {ttl}")
+        self.path = path
+        self.node = node
+        self.ttl = ttl
+        self.hostname = hostname or node
+        self.clock = clock
+        self.ring: Optional[HashRing] = None
+        self._started = clock()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        connection.execute(SCHEMA)
+        return connection
+
+    def heartbeat(self) -> HashRing:
+        """
+        Renew the lease of this node and rebuild the ring from the live nodes.
+
+        Returns:
+            HashRing: The ring now in use
+        """
+        now = self.clock()
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute(
+                    "INSERT INTO cluster_nodes (node, hostname, pid, started, heartbeat, expires) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(node) DO UPDATE SET hostname = excluded.hostname, pid = excluded.pid, "
+                    "started = excluded.started, heartbeat = excluded.heartbeat, expires = excluded.expires",
+                    (self.node, self.hostname, os.getpid(), self._started, now, now + self.ttl),
+                )
+                connection.execute("DELETE FROM cluster_nodes WHERE expires < ?", (now - FORGET_AFTER_TTLS * self.ttl,))
+                rows = connection.execute("SELECT node FROM cluster_nodes WHERE expires > ?", (now,))
+                live = [row[0] for row in rows]
+        finally:
+            connection.close()
+
+        ring = HashRing(live)
+        with self._lock:
+            previous, self.ring = self.ring, ring
+        if previous is not None and previous.nodes != ring.nodes:
+            print(f"Cluster members changed: {', '.join(previous.nodes)} -> {', '.join(ring.nodes)}")
+        return ring
+
+    def owns(self, site: str) -> bool:
+        """
+        Whether this node should probe a site, according to the last heartbeat.
+        """
+        ring = self.ring
+        if ring is None:
+            ring = self.heartbeat()
+        return ring.owner(site) == self.node
+
+    def select(self, sites: Iterable[str]) -> List[str]:
+        """The sites of a list owned by this node."""
+        return [site for site in sites if self.owns(site)]
+
+    def members(self) -> List[dict]:
+        """
+        Every node known to the lease table, live or recently expired.
+
+        Returns:
+            list: Node, hostname, pid, last heartbeat and whether the lease is live, per node
+        """
+        now = self.clock()
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT node, hostname, pid, heartbeat, expires FROM cluster_nodes ORDER BY node"
+            ).fetchall()
+        finally:
+            connection.close()
+        return [
+            {"node": node, "hostname": hostname, "pid": pid, "heartbeat": heartbeat, "live": expires > now}
+            for node, hostname, pid, heartbeat, expires in rows
+        ]
+
+    def _run(self) -> None:
+        # Three heartbeats per TTL, so one slow write does not expire the lease
+        while not self._stopping.wait(self.ttl / 3):
+            try:
+                self.heartbeat()
+            except sqlite3.Error as e:
+                # The last ring stays in use: if the lease expires meanwhile, the other
+                # nodes take over its sites and they are probed twice rather than not at all
+                print(f"Error renewing the cluster lease of '{self.node}': {e}")
+
+    def start(self) -> "Cluster":
+        """Join the cluster and keep the lease alive from a daemon thread."""
+        self.heartbeat()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="pingmonitor-cluster", daemon=True)
+        self._thread.start()
+        return self
+
+    def leave(self) -> None:
+        """
+        Stop the heartbeats and drop the lease, so the sites fail over right away.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute("DELETE FROM cluster_nodes WHERE node = ?", (self.node,))
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            print(f"Error leaving the cluster: {e}")
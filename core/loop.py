@@ -0,0 +1,71 @@
+import asyncio
+import threading
+from typing import Any, Coroutine, Optional
+
+
+class BackgroundLoop:
+    """
+    Event loop running in a daemon thread.
+
+    Blocking code (cron pings, scheduler worker threads) submits coroutines to
+    it so that async resources such as pooled connections outlive a single call.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="pingmonitor-loop", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Run a coroutine on the background loop and wait for its result.
+
+        Args:
+            coro (coroutine): Coroutine to run
+            timeout (float, optional): Maximum seconds to wait for the result
+
+        Returns:
+            The value returned by the coroutine
+        """
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def stop(self) -> None:
+        """
+        Stop the background loop and wait for its thread to finish.
+        """
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+
+_background_loop = BackgroundLoop()
+
+
+def run_coroutine(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine on the shared background loop from blocking code.
+
+    Args:
+        coro (coroutine): Coroutine to run
+        timeout (float, optional): Maximum seconds to wait for the result
+
+    Returns:
+        The value returned by the coroutine
+    """
+    return _background_loop.run(coro, timeout)
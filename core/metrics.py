@@ -0,0 +1,340 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Seconds, from a loopback probe to a timeout
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Rows written per flush, up to the writer's max_pending
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 250, 500, 1000, 5000, 10000, 100000)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return labels
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    Monotonic count, e.g. of probe outcomes.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Gauge(_Metric):
+    """
+    Value read when the metrics are rendered, e.g. a queue depth.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._callbacks: List[Callable[[], Dict[Tuple[str, ...], float]]] = []
+
+    def collect_with(self, callback: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """
+        Register a function returning the current values, {label values tuple: value}.
+        Nothing is computed on the hot path, only when the metrics are read.
+        """
+        self._callbacks.append(callback)
+
+    def samples(self) -> List[str]:
+        values = {}
+        for callback in self._callbacks:
+            try:
+                values.update(callback())
+            except Exception as e:
+                print(f"Error collecting {self.name}: {e}")
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in fixed cumulative buckets.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: a count per bucket plus one for +Inf, the sum and the count
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            snapshot = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self._series.items())
+        lines = []
+        for key, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of the process, rendered in the Prometheus text format.
+
+    Recording is a lock and a few integer additions, so it is always on; the
+    metrics are only exported when an endpoint or a textfile is configured.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """
+        Write the metrics for the node_exporter textfile collector, e.g. at the end
+        of a cron run. The file is replaced atomically so it is never read half written.
+
+        Args:
+            path (str): Target file, conventionally ending in .prom
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temporary, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> None:
+        """
+        Serve the metrics on http://host:port/metrics from a daemon thread.
+
+        Args:
+            port (int): Port to listen on
+            host (str): Address to listen on, local only by default
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="pingmonitor-metrics", daemon=True).start()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics = MetricsRegistry()
+
+PROBES = metrics.counter("pingmonitor_probes_total", "Probes performed by outcome (success or error class)",
+                         ("protocol", "outcome"))
+PROBE_DURATION = metrics.histogram("pingmonitor_probe_duration_seconds", "Probe latency", ("protocol",))
+SCHEDULER_LAG = metrics.histogram("pingmonitor_scheduler_lag_seconds",
+                                  "Delay between the planned and the real start of a check")
+SCHEDULER_MISSED = metrics.counter("pingmonitor_scheduler_missed_ticks_total",
+                                   "Planned checks skipped because the previous one overran")
+DB_FLUSH_DURATION = metrics.histogram("pingmonitor_db_flush_duration_seconds",
+                                      "Duration of a writer flush transaction")
+DB_FLUSH_ROWS = metrics.histogram("pingmonitor_db_flush_rows", "Results written per flush", buckets=SIZE_BUCKETS)
+DB_FLUSH_ERRORS = metrics.counter("pingmonitor_db_flush_errors_total", "Writer flushes that failed")
+DB_ROWS_DROPPED = metrics.counter("pingmonitor_db_rows_dropped_total",
+                                  "Results dropped by the writers, rejected by the database or over the memory limit")
+DB_PENDING = metrics.gauge("pingmonitor_db_pending_rows", "Results buffered by the writers", ("database",))
+ALERT_QUEUE = metrics.gauge("pingmonitor_alert_queue_depth", "Alerts and messages waiting to be sent")
+ALERT_SEND_DURATION = metrics.histogram("pingmonitor_alert_send_duration_seconds", "Duration of a reporter send")
+ALERT_MESSAGES = metrics.counter("pingmonitor_alert_messages_total",
+                                 "Reporter messages by outcome (sent, failed, retried)", ("outcome",))
+ALERTS_DROPPED = metrics.counter("pingmonitor_alerts_dropped_total", "Alerts dropped because the queue was full")
+LATENCY_SLOW_CHECKS = metrics.counter("pingmonitor_latency_slow_checks_total",
+                                      "Successful checks slower than the latency baseline of their site", ("protocol",))
+SCHEDULER_INTERVAL_CHANGES = metrics.counter("pingmonitor_scheduler_interval_changes_total",
+                                             "Adaptive interval changes (tighten or relax)", ("direction",))
+SCHEDULER_SITES = metrics.gauge("pingmonitor_scheduler_sites",
+                                "Scheduled sites by interval mode (tightened, base, relaxed)", ("mode",))
+SCHEDULER_PLANNED_RATE = metrics.gauge("pingmonitor_scheduler_planned_probes_per_second",
+                                       "Probe rate the current intervals ask for")
+SCHEDULER_RATE_BUDGET = metrics.gauge("pingmonitor_scheduler_rate_budget_probes_per_second",
+                                      "Global probe rate budget, absent when unlimited")
+SCHEDULER_BUDGET_WAIT = metrics.histogram("pingmonitor_scheduler_budget_wait_seconds",
+                                          "Time checks waited for the global rate budget", ("priority",))
+SCHEDULER_POLITENESS_DELAYS = metrics.counter("pingmonitor_scheduler_politeness_delays_total",
+                                              "Checks delayed to keep the minimum gap between probes of a host")
+STAGE_DURATION = metrics.histogram("pingmonitor_stage_duration_seconds",
+                                   "Time spent in each stage of a check (parse, import, probe, open, store, report)",
+                                   ("stage",))
+
+
+def observe_probe(protocol: str, result, seconds: Optional[float] = None) -> None:
+    """
+    Record the outcome and latency of a probe.
+
+    Args:
+        protocol (str): The protocol used
+        result (ProbeResult): The probe result
+        seconds (float, optional): Measured probe duration, the reported response time by default
+    """
+    PROBES.inc(protocol, "success" if result.success else (result.error_class or "error"))
+    if seconds is None and result.response_time_ms is not None:
+        seconds = result.response_time_ms / 1000
+    if seconds is not None:
+        PROBE_DURATION.observe(seconds, protocol)
+
+
+class _Stage:
+    __slots__ = ("timer", "name", "started")
+
+    def __init__(self, timer: "StageTimer", name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class StageTimer:
+    """
+    Split a check into stages, e.g. parse, import, probe, open, store and report.
+
+    Each stage is added to pingmonitor_stage_duration_seconds as it ends, and
+    the durations of the check are kept for verbose output.
+    """
+    __slots__ = ("durations",)
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+
+    def stage(self, name: str) -> _Stage:
+        """Context manager timing one stage, e.g. `with timer.stage("probe"): ...`."""
+        return _Stage(self, name)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        STAGE_DURATION.observe(seconds, name)
+
+    @property
+    def total(self) -> float:
+        return sum(self.durations.values())
+
+    def __str__(self):
+        stages = ", ".join(f"{name} {seconds * 1000:.2f} ms" for name, seconds in self.durations.items())
+        return f"{stages} (total {self.total * 1000:.2f} ms)"
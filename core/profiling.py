@@ -0,0 +1,137 @@
+import io
+import sys
+import threading
+from typing import List, Optional
+
+PROFILE_MODES = ("cpu", "memory", "all")
+
+
+class RunProfiler:
+    """
+    Profile a whole command: CPU time with cProfile and allocations with tracemalloc.
+
+    Probes run in worker threads and on the background event loop, so the CPU
+    profile follows every thread started while it is running, not only the
+    main one, and their statistics are merged in the report. Python 3.12 and
+    later allow a single active profiler per process: there threads get no
+    profiler of their own, whatever the main one records of them is not
+    separated.
+    """
+
+    def __init__(self, mode: str = "cpu", limit: int = 30, sort: str = "cumulative",
+                 output: Optional[str] = None, frames: int = 1):
+        """
+        Args:
+            mode (str): cpu, memory or all
+            limit (int): Lines printed in each report
+            sort (str): pstats sort key of the CPU report, e.g. cumulative or tottime
+            output (str, optional): File the raw CPU statistics are dumped to, for pstats or snakeviz
+            frames (int): Frames kept per allocation; more frames give tracebacks but cost more
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}', use {', '.join(PROFILE_MODES)}")
+        self.cpu = mode in ("cpu", "all")
+        self.memory = mode in ("memory", "all")
+        self.limit = limit
+        self.sort = sort
+        self.output = output
+        self.frames = frames
+        self._profiles: List = []  # cProfile.Profile of each thread, the main one first
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._peak = None
+        self._warned = False
+
+    def _warn(self, message: str) -> None:
+        with self._lock:
+            if self._warned:
+                return
+            self._warned = True
+        print(f"Profiler: {message}")
+
+    def _profile_thread(self, frame, event, arg):
+        # Called once by every new thread: hand the thread over to a profiler of its own.
+        # Nothing may be raised from here, it would kill the thread (and hang a pool waiting for it)
+        sys.setprofile(None)
+        try:
+            import cProfile
+
+            profile = cProfile.Profile()
+            profile.enable()
+        except Exception as e:
+            threading.setprofile(None)
+            self._warn(f"threads are not profiled separately ({e})")
+            return
+        with self._lock:
+            self._profiles.append(profile)
+
+    def start(self) -> None:
+        # Imported here, pstats alone would add more than 10 ms to every cron start
+        import cProfile
+        import tracemalloc
+
+        if self.memory:
+            tracemalloc.start(self.frames)
+        if self.cpu:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Another tool (a debugger, coverage) already profiles the process
+                print(f"Profiler: CPU profiling disabled ({e})")
+                self.cpu = False
+                return
+            self._profiles.append(profile)
+            if sys.version_info >= (3, 12):
+                # cProfile is built on sys.monitoring, a second profiler in a thread would fail
+                self._warn("Python 3.12+ allows one profiler per process, threads are not profiled separately")
+            else:
+                threading.setprofile(self._profile_thread)
+
+    def stop(self) -> None:
+        import tracemalloc
+
+        if self.cpu:
+            threading.setprofile(None)
+            self._profiles[0].disable()
+        if self.memory:
+            self._snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            self._peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def report(self) -> str:
+        """
+        Format the reports, and dump the CPU statistics if an output file was given.
+
+        Returns:
+            str: The CPU report sorted by `sort`, then the lines allocating the most memory
+        """
+        import pstats
+
+        sections = []
+        if self.cpu:
+            with self._lock:
+                profiles = list(self._profiles)
+            stream = io.StringIO()
+            stats = pstats.Stats(profiles[0], stream=stream)
+            for profile in profiles[1:]:
+                # Threads still running (the event loop, writers) are included as they are now,
+                # their profiler can only be disabled from the thread itself
+                profile.snapshot_stats()
+                if profile.stats:
+                    stats.add(profile)
+            stats.strip_dirs().sort_stats(self.sort).print_stats(self.limit)
+            if self.output:
+                stats.dump_stats(self.output)
+                stream.write(f"CPU statistics of {len(profiles)} threads written to {self.output}\n")
+            sections.append(f"CPU profile ({len(profiles)} threads, sorted by {self.sort}):\n{stream.getvalue()}")
+        if self.memory and self._snapshot is not None:
+            lines = [f"Memory: peak {self._peak / 1024:.1f} KiB traced, top {self.limit} allocating lines:"]
+            for stat in self._snapshot.statistics("lineno")[:self.limit]:
+                frame = stat.traceback[0]
+                lines.append(f"  {stat.size / 1024:10.1f} KiB  {stat.count:8} blocks  {frame.filename}:{frame.lineno}")
+            sections.append("\n".join(lines))
+        return "\n\n".join(sections)
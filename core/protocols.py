@@ -0,0 +1,106 @@
+import importlib
+from typing import Dict, List
+
+# Entry point group third-party packages use to add protocols, e.g. in pyproject.toml:
+#   [project.entry-points."pingmonitor.protocols"]
+#   smtp = "pingmonitor_smtp:SMTPProber"
+ENTRY_POINT_GROUP = "pingmonitor.protocols"
+
+# Built-in protocols as "module:Class", imported only when a site uses them
+BUILTIN_PROTOCOLS = {
+    "icmp": "utils.icmp:ICMPProber",
+    "http": "utils.http:HTTPProber",
+    "port": "utils.port:PortProber",
+    "dns": "utils.dns:DNSProber",
+}
+
+
+class UnknownProtocolError(LookupError):
+    """Raised when no prober is registered for a protocol."""
+
+
+class ProtocolRegistry:
+    def __init__(self):
+        """
+        Map protocol names to prober classes.
+
+        A prober class is built from a site configuration dict and its ping()
+        returns a ProbeResult (core/result.py). It may also define a
+        ping_many(configs) classmethod returning one ProbeResult per
+        configuration, used to probe several sites at once.
+
+        Classes are imported on first use, so a check only loads the modules
+        of its own protocol, and entry points are only read for names that are
+        not built in.
+        """
+        self._specs: Dict[str, object] = dict(BUILTIN_PROTOCOLS)
+        self._classes: Dict[str, type] = {}
+        self._entry_points_loaded = False
+
+    def register(self, name: str, prober) -> None:
+        """
+        Register a prober for a protocol, replacing any previous one.
+
+        Args:
+            name (str): Protocol name as written in site configurations
+            prober: Prober class, or its "module:Class" path to import it lazily
+        """
+        name = name.lower()
+        self._specs[name] = prober
+        self._classes.pop(name, None)
+
+    def _load_entry_points(self) -> None:
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+        from importlib.metadata import entry_points
+
+        try:
+            found = entry_points(group=ENTRY_POINT_GROUP)
+        except TypeError:
+            # Python < 3.10
+            found = entry_points().get(ENTRY_POINT_GROUP, [])
+        for entry_point in found:
+            # Built-in protocols win over plugins with the same name
+            self._specs.setdefault(entry_point.name.lower(), entry_point)
+
+    def is_registered(self, name: str) -> bool:
+        """Whether a prober exists for a protocol, without importing it."""
+        name = name.lower()
+        if name not in self._specs:
+            self._load_entry_points()
+        return name in self._specs
+
+    def names(self) -> List[str]:
+        """Names of every registered protocol, including plugins."""
+        self._load_entry_points()
+        return sorted(self._specs)
+
+    def get(self, name: str) -> type:
+        """
+        Return the prober class of a protocol, importing it on first use.
+
+        Raises:
+            UnknownProtocolError: If no prober is registered for the protocol
+            ImportError: If the prober module cannot be imported
+        """
+        name = name.lower()
+        if name in self._classes:
+            return self._classes[name]
+        if not self.is_registered(name):
+            raise UnknownProtocolError(f"Unknown protocol '{name}'")
+
+        spec = self._specs[name]
+        if isinstance(spec, str):
+            module_name, _, class_name = spec.partition(":")
+            prober = getattr(importlib.import_module(module_name), class_name)
+        elif hasattr(spec, "load"):
+            prober = spec.load()
+        else:
+            prober = spec
+        self._classes[name] = prober
+        return prober
+
+
+# Shared by the whole process
+protocols = ProtocolRegistry()
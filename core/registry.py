@@ -0,0 +1,282 @@
+import configparser
+import hashlib
+import os
+import pickle
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from core.alerts import AlertPolicy
+from core.anomaly import LatencyPolicy
+from core.protocols import protocols
+
+# Bump when SiteConfig or the snapshot layout changes, older snapshots are then ignored
+SNAPSHOT_VERSION = 4
+
+RAW_OUTPUT_MODES = ("all", "failures", "none")
+
+
+def target_host(site: str) -> str:
+    """
+    Host probed for a site value, e.g. example.com for https://example.com:8443/health.
+
+    Sites sharing a host share its politeness limit in the scheduler.
+    """
+    if "://" in site:
+        host = urlsplit(site).hostname
+        if host:
+            return host.lower()
+    return site.strip().lower()
+
+
+class SiteConfigError(Exception):
+    """Raised when a site configuration file is invalid."""
+
+
+class SiteConfig:
+    """
+    Parsed and validated configuration of one site.
+    """
+    __slots__ = ("name", "site", "protocol", "storage", "storage_file", "interval", "min_interval",
+                 "max_interval", "timeout", "target", "options", "reporter", "alert_policy", "latency_policy")
+
+    def __init__(self, name: str, options: Dict[str, str], reporter: Dict[str, str]):
+        """
+        Build a site configuration from the values of its file.
+
+        Args:
+            name (str): Site name (configuration file at sites/<name>.conf)
+            options (dict): Values of the site section
+            reporter (dict): Values of the [reporter] section, empty if there is none
+
+        Raises:
+            SiteConfigError: If a value is missing or invalid
+        """
+        missing = [key for key in ("site", "protocol", "storage") if not options.get(key)]
+        if missing:
+            raise SiteConfigError(f"Missing configuration: {', '.join(missing)}")
+
+        self.name = name
+        self.site = options["site"]
+        self.protocol = options["protocol"].lower()
+        self.storage = options["storage"].lower()
+        self.storage_file = options.get("storage_file") or None
+        self.interval = self._positive(options, "interval")
+        # Bounds of the adaptive scheduler, see core.scheduler.AdaptivePolicy
+        self.min_interval = self._positive(options, "min_interval")
+        self.max_interval = self._positive(options, "max_interval")
+        self.timeout = self._positive(options, "timeout")
+        self.target = target_host(self.site)
+        self.options = options
+        self.reporter = reporter
+
+        if not protocols.is_registered(self.protocol):
+            raise SiteConfigError(f"Unknown protocol '{self.protocol}'")
+        if self.storage == "sqlite" and not self.storage_file:
+            raise SiteConfigError("SQLite database file not specified (storage_file)")
+        if self.min_interval and self.max_interval and self.min_interval > self.max_interval:
+            raise SiteConfigError(f"min_interval {self.min_interval:g} is above max_interval {self.max_interval:g}")
+        if options.get("raw_output", "all").lower() not in RAW_OUTPUT_MODES:
+            raise SiteConfigError(f"Invalid raw_output '{options['raw_output']}', use {', '.join(RAW_OUTPUT_MODES)}")
+        if reporter:
+            if "type" not in reporter:
+                raise SiteConfigError("Missing reporter type")
+            if reporter["type"].lower() == "telegram":
+                missing = [key for key in ("bot_token", "chat_id") if not reporter.get(key)]
+                if missing:
+                    raise SiteConfigError(f"Missing reporter configuration: {', '.join(missing)}")
+        # Built here once, every check of the site uses them
+        try:
+            self.alert_policy = AlertPolicy.from_config(reporter)
+        except ValueError as e:
+            raise SiteConfigError(f"Invalid alert policy: {e}")
+        try:
+            self.latency_policy = LatencyPolicy.from_config(reporter)
+        except ValueError as e:
+            raise SiteConfigError(f"Invalid latency policy: {e}")
+
+    @staticmethod
+    def _positive(options: Dict[str, str], key: str) -> Optional[float]:
+        if key not in options:
+            return None
+        try:
+            value = float(options[key])
+        except ValueError:
+            raise SiteConfigError(f"Invalid {key} '{options[key]}', a number of seconds is expected")
+        if value <= 0:
+            raise SiteConfigError(f"Invalid {key} '{options[key]}', it must be positive")
+        return value
+
+
+def parse_site_file(path: str, name: str) -> SiteConfig:
+    """
+    Parse a site configuration file.
+
+    Files written by scripts/site/create.py have a [SiteConfig] section; older
+    hand-written files may have bare key = value lines, which are read as such.
+
+    Args:
+        path (str): Path to the .conf file
+        name (str): Site name
+
+    Returns:
+        SiteConfig: The validated configuration
+
+    Raises:
+        SiteConfigError: If the file cannot be read or is invalid
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+    except OSError as e:
+        raise SiteConfigError(f"Error reading configuration file: {e}")
+    return parse_site_config(content, name)
+
+
+def parse_site_config(content: str, name: str) -> SiteConfig:
+    """
+    Parse the content of a site configuration file, see parse_site_file.
+    """
+    parser = configparser.ConfigParser(interpolation=None, inline_comment_prefixes=("#", ";"), strict=False)
+    try:
+        try:
+            parser.read_string(content)
+        except configparser.MissingSectionHeaderError:
+            parser.read_string("[SiteConfig]\n" + content)
+    except configparser.Error as e:
+        raise SiteConfigError(f"Invalid configuration file: {e}")
+
+    options = {}
+    reporter = {}
+    for section in parser.sections():
+        target = reporter if section.lower() == "reporter" else options
+        target.update(parser[section])
+    return SiteConfig(name, options, reporter)
+
+
+class SiteRegistry:
+    def __init__(self, sites_dir: str = "sites", snapshot_path: Optional[str] = None):
+        """
+        Every site configuration, parsed once and cached between runs.
+
+        The snapshot records the size, modification time and content hash of each
+        file, so only files that really changed are parsed again.
+
+        Args:
+            sites_dir (str): Directory holding the <site>.conf files
+            snapshot_path (str, optional): Snapshot file, data/cache/sites.snapshot by default
+        """
+        self.sites_dir = sites_dir
+        self.snapshot_path = snapshot_path or os.path.join("data", "cache", "sites.snapshot")
+        self.sites: Dict[str, SiteConfig] = {}
+        self.errors: Dict[str, str] = {}
+        self.loaded = False
+        self.parsed = 0  # Files parsed by the last load, the others came from the snapshot
+        # name -> (mtime_ns, size, sha1, SiteConfig or error message)
+        self._entries: Dict[str, Tuple[int, int, str, object]] = {}
+
+    def _read_snapshot(self) -> Dict[str, tuple]:
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return {}
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+            return {}
+        if snapshot.get("sites_dir") != os.path.abspath(self.sites_dir):
+            return {}
+        return snapshot["entries"]
+
+    def _write_snapshot(self) -> None:
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "sites_dir": os.path.abspath(self.sites_dir),
+            "entries": self._entries,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            temporary = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.snapshot_path)
+        except OSError as e:
+            print(f"Error writing site registry snapshot: {e}")
+
+    def load(self) -> "SiteRegistry":
+        """
+        Load every site, parsing only the files changed since the snapshot.
+
+        Returns:
+            SiteRegistry: self, for chaining
+        """
+        previous = self._read_snapshot()
+        entries = {}
+        self.parsed = 0
+
+        try:
+            files = [entry for entry in os.scandir(self.sites_dir) if entry.name.endswith(".conf")]
+        except FileNotFoundError:
+            files = []
+
+        for entry in files:
+            name = entry.name[:-5]
+            stat = entry.stat()
+            cached = previous.get(name)
+            if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                entries[name] = cached
+                continue
+
+            try:
+                with open(entry.path, "rb") as f:
+                    content = f.read()
+            except OSError as e:
+                entries[name] = (stat.st_mtime_ns, stat.st_size, "", f"Error reading configuration file: {e}")
+                continue
+            digest = hashlib.sha1(content).hexdigest()
+            if cached is not None and cached[2] == digest:
+                # Touched but unchanged, e.g. by a checkout
+                entries[name] = (stat.st_mtime_ns, stat.st_size, digest, cached[3])
+                continue
+
+            self.parsed += 1
+            try:
+                parsed = parse_site_config(content.decode("utf-8"), name)
+            except (SiteConfigError, UnicodeDecodeError) as e:
+                parsed = str(e)
+            entries[name] = (stat.st_mtime_ns, stat.st_size, digest, parsed)
+
+        self._entries = entries
+        self.sites = {name: value[3] for name, value in entries.items() if isinstance(value[3], SiteConfig)}
+        self.errors = {name: value[3] for name, value in entries.items() if not isinstance(value[3], SiteConfig)}
+        self.loaded = True
+        if self.parsed or entries.keys() != previous.keys():
+            self._write_snapshot()
+        return self
+
+    def names(self) -> List[str]:
+        """Names of every valid site, sorted."""
+        return sorted(self.sites)
+
+    def get(self, name: str) -> SiteConfig:
+        """
+        Return a loaded site.
+
+        Raises:
+            SiteConfigError: If the site does not exist or its configuration is invalid
+        """
+        if name in self.sites:
+            return self.sites[name]
+        if name in self.errors:
+            raise SiteConfigError(self.errors[name])
+        raise SiteConfigError(f"Configuration file '{os.path.join(self.sites_dir, name + '.conf')}' does not exist.")
+
+    def load_one(self, name: str) -> SiteConfig:
+        """
+        Parse a single site without touching the snapshot, for one-off pings.
+
+        Raises:
+            SiteConfigError: If the site does not exist or its configuration is invalid
+        """
+        path = os.path.join(self.sites_dir, f"{name}.conf")
+        if not os.path.exists(path):
+            raise SiteConfigError(f"Configuration file '{path}' does not exist.")
+        return parse_site_file(path, name)
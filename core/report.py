@@ -0,0 +1,226 @@
+import json
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# Latency percentiles reported by default
+DEFAULT_PERCENTILES = (50, 90, 95, 99)
+
+
+def _row_dtype():
+    import numpy as np
+
+    return np.dtype([("site", np.int32), ("protocol", np.int32), ("hostname", np.int32),
+                     ("timestamp_ms", np.int64), ("success", np.bool_), ("response_ms", np.float64)])
+
+
+def load_rows(chunks: Iterable[list]):
+    """
+    Load chunks of rows read by PingMonitorDB.read_columns into one structured array.
+
+    Args:
+        chunks (iterable): Lists of (site id, protocol id, hostname id, epoch ms, success, response ms or -1)
+
+    Returns:
+        numpy.ndarray: Rows in read order, with the site, protocol, hostname, timestamp_ms,
+                       success and response_ms fields
+    """
+    import numpy as np
+
+    dtype = _row_dtype()
+    arrays = [np.array(rows, dtype=dtype) for rows in chunks]
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+
+
+def _none(value):
+    """A statistic as a float, None when it is undefined (NaN) so it reads as missing in tables and JSON."""
+    return float(value) if math.isfinite(value) else None
+
+
+def analyze(rows, names: Sequence[Dict[int, str]], min_failures: int = 1,
+            percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> List[dict]:
+    """
+    Compute uptime, outages and latency percentiles per site, protocol and hostname.
+
+    Every statistic is computed over all the groups at once on sorted arrays,
+    so the cost grows with the number of rows and not with Python loops over
+    them. An outage is a run of at least min_failures consecutive failed checks
+    of one group; it lasts from its first failure to the next success, or to
+    the last check of the group when it is still ongoing. Uptime is the share
+    of the time between the first and the last check not spent in outages.
+
+    Args:
+        rows (numpy.ndarray): Rows as returned by load_rows
+        names (sequence): {id: name} dicts of the sites, protocols and hostnames
+        min_failures (int): Consecutive failures making an outage
+        percentiles (sequence): Latency percentiles between 0 and 100
+
+    Returns:
+        list: One dict per group, sorted by site, protocol and hostname, with checks, failures,
+              success_pct, uptime_pct, outages, downtime_s, mttr_s, mtbf_s, mean_ms, max_ms,
+              the p<q>_ms percentiles and the outage intervals
+    """
+    import numpy as np
+
+    if min_failures < 1:
+        raise ValueError("An outage needs at least one failure")
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+    if len(rows) == 0:
+        return []
+
+    # Order by group then time; the group key packs the three ids into one integer
+    key = ((rows["site"].astype(np.int64) << 42) | (rows["protocol"].astype(np.int64) << 21)
+           | rows["hostname"].astype(np.int64))
+    order = np.lexsort((rows["timestamp_ms"], key))
+    key, timestamps = key[order], rows["timestamp_ms"][order]
+    success, response = rows["success"][order], rows["response_ms"][order]
+    count = len(key)
+
+    first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])  # First row of each group
+    last = np.r_[first[1:], count] - 1
+    group = np.repeat(np.arange(len(first)), np.diff(np.r_[first, count]))
+    checks = last - first + 1
+    failures = checks - np.add.reduceat(success.astype(np.int64), first)
+    span = (timestamps[last] - timestamps[first]).astype(np.float64)
+
+    # Runs of failures within a group: where a failure follows a success or starts a group
+    failed = ~success
+    new_group = np.zeros(count, dtype=bool)
+    new_group[first] = True
+    run_start = np.flatnonzero(failed & (new_group | np.r_[False, success[:-1]]))
+    run_end = np.flatnonzero(failed & (np.r_[new_group[1:], True] | np.r_[success[1:], False])) + 1
+    keep = run_end - run_start >= min_failures
+    run_start, run_end = run_start[keep], run_end[keep]
+    run_group = group[run_start]
+    # The next check of the group is the success ending the outage, otherwise it is ongoing
+    ongoing = run_end > last[run_group]
+    end_index = np.where(ongoing, last[run_group], run_end)
+    duration = (timestamps[end_index] - timestamps[run_start]).astype(np.float64)
+
+    groups = len(first)
+    outages = np.bincount(run_group, minlength=groups)
+    downtime = np.bincount(run_group, weights=duration, minlength=groups)
+    recovered = np.bincount(run_group, weights=(~ongoing).astype(np.float64), minlength=groups)
+    recovered_time = np.bincount(run_group, weights=np.where(ongoing, 0.0, duration), minlength=groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        uptime = np.where(span > 0, 100.0 * (1 - downtime / span), 100.0 * (checks - failures) / checks)
+        mttr = recovered_time / recovered / 1000
+        mtbf = np.where(outages > 0, (span - downtime) / outages / 1000, np.nan)
+
+    # Percentiles of the successful response times, interpolated linearly like numpy.percentile
+    measured = success & (response >= 0)
+    latency_group, latency = group[measured], response[measured]
+    latency_order = np.lexsort((latency, latency_group))
+    latency_group, latency = latency_group[latency_order], latency[latency_order]
+    samples = np.bincount(latency_group, minlength=groups)
+    offset = np.r_[0, np.cumsum(samples)[:-1]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(latency_group, weights=latency, minlength=groups) / samples
+    # A trailing NaN is what groups without any sample read
+    latency = np.r_[latency, np.nan]
+    highest = np.where(samples > 0, samples - 1, 0)
+    values = {}
+    for q in percentiles:
+        position = highest * (q / 100.0)
+        below = np.floor(position).astype(np.int64)
+        above = np.minimum(below + 1, highest)
+        low, high = latency[offset + below], latency[offset + above]
+        values[q] = np.where(samples > 0, low + (high - low) * (position - below), np.nan)
+    maximum = np.where(samples > 0, latency[offset + highest], np.nan)
+
+    site_names, protocol_names, hostname_names = names
+    report = []
+    for index, start in enumerate(first):
+        group_key = int(key[start])
+        entry = {
+            "site": site_names.get(group_key >> 42),
+            "protocol": protocol_names.get((group_key >> 21) & 0x1FFFFF),
+            "hostname": hostname_names.get(group_key & 0x1FFFFF),
+            "first_check": int(timestamps[start]),
+            "last_check": int(timestamps[last[index]]),
+            "checks": int(checks[index]),
+            "failures": int(failures[index]),
+            "success_pct": round(100.0 * float(checks[index] - failures[index]) / checks[index], 4),
+            "uptime_pct": round(float(uptime[index]), 4),
+            "outages": int(outages[index]),
+            "downtime_s": round(float(downtime[index]) / 1000, 3),
+            "mttr_s": _none(mttr[index]),
+            "mtbf_s": _none(mtbf[index]),
+            "mean_ms": _none(mean[index]),
+            "max_ms": _none(maximum[index]),
+        }
+        for q in percentiles:
+            entry[f"p{q:g}_ms"] = _none(values[q][index])
+        entry["outage_intervals"] = []
+        report.append(entry)
+
+    for start, end, run_end_index, is_ongoing, owner in zip(run_start, end_index, run_end, ongoing, run_group):
+        report[owner]["outage_intervals"].append({
+            "start": int(timestamps[start]),
+            "end": None if is_ongoing else int(timestamps[end]),
+            "duration_s": (int(timestamps[end]) - int(timestamps[start])) / 1000,
+            "failures": int(run_end_index - start),
+        })
+
+    report.sort(key=lambda entry: (entry["site"] or "", entry["protocol"] or "", entry["hostname"] or ""))
+    return report
+
+
+def _time(timestamp_ms: Optional[int]) -> str:
+    if timestamp_ms is None:
+        return "ongoing"
+    return datetime.fromtimestamp(timestamp_ms / 1000).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.1f}m"
+    if seconds < 172800:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / 86400:.1f}d"
+
+
+def format_table(report: List[dict], percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                 outages: bool = False) -> str:
+    """
+    Format a report as a text table, one line per site, protocol and hostname.
+
+    Args:
+        report (list): Groups as returned by analyze
+        percentiles (sequence): Percentiles shown, as passed to analyze
+        outages (bool): List the outage intervals under each group
+
+    Returns:
+        str: The table
+    """
+    headers = (["site", "protocol", "hostname", "checks", "uptime%", "success%", "outages", "downtime",
+                "MTTR", "MTBF", "mean"] + [f"p{q:g}" for q in percentiles])
+    lines = []
+    for entry in report:
+        latencies = [entry["mean_ms"]] + [entry[f"p{q:g}_ms"] for q in percentiles]
+        lines.append([
+            entry["site"], entry["protocol"], entry["hostname"], str(entry["checks"]),
+            f"{entry['uptime_pct']:.3f}", f"{entry['success_pct']:.3f}", str(entry["outages"]),
+            _duration(entry["downtime_s"]), _duration(entry["mttr_s"]), _duration(entry["mtbf_s"]),
+        ] + ["-" if value is None else f"{value:.1f}" for value in latencies])
+
+    widths = [max(len(str(row[column])) for row in [headers] + lines) for column in range(len(headers))]
+    output = []
+    for row, entry in zip([headers] + lines, [None] + report):
+        output.append("  ".join(str(value).ljust(width) if column < 3 else str(value).rjust(width)
+                                for column, (value, width) in enumerate(zip(row, widths))).rstrip())
+        if outages and entry is not None:
+            for outage in entry["outage_intervals"]:
+                output.append(f"    down {_time(outage['start'])} -> {_time(outage['end'])} "
+                              f"({_duration(outage['duration_s'])}, {outage['failures']} failed checks)")
+    return "\n".join(output)
+
+
+def format_json(report: List[dict]) -> str:
+    """Format a report as JSON, times in epoch milliseconds."""
+    return json.dumps(report, indent=2)
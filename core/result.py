@@ -0,0 +1,263 @@
+import errno
+import math
+import socket
+import sys
+import time
+from array import array
+from typing import List, Optional
+
+# Error classes, so failures can be grouped whatever the protocol
+ERROR_TIMEOUT = "timeout"          # No answer in time
+ERROR_DNS = "dns"                  # The name could not be resolved
+ERROR_REFUSED = "refused"          # The connection was actively refused
+ERROR_UNREACHABLE = "unreachable"  # No route to the host or network
+ERROR_TLS = "tls"                  # TLS handshake or certificate failure
+ERROR_STATUS = "status"            # Answered with an unexpected status (HTTP code, DNS rcode)
+ERROR_ASSERTION = "assertion"      # Answered, but the content did not match the expectations
+ERROR_OTHER = "error"              # Anything else
+ERROR_CLASSES = (ERROR_TIMEOUT, ERROR_DNS, ERROR_REFUSED, ERROR_UNREACHABLE, ERROR_TLS,
+                 ERROR_STATUS, ERROR_ASSERTION, ERROR_OTHER)
+
+_UNREACHABLE_ERRNOS = {errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN, errno.ENETDOWN}
+
+# Latency samples are packed as little-endian float32 milliseconds, NaN for a lost sample
+_SAMPLE_TYPECODE = "f"
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Return the error class of an exception raised while probing.
+
+    Args:
+        error (BaseException): Exception raised by a probe
+
+    Returns:
+        str: One of ERROR_CLASSES
+    """
+    if isinstance(error, (TimeoutError, socket.timeout)) or error.__class__.__name__ == "TimeoutError":
+        return ERROR_TIMEOUT
+    if isinstance(error, socket.gaierror):
+        return ERROR_DNS
+    # ssl is only loaded by the probers using TLS, no need to import it here
+    ssl = sys.modules.get("ssl")
+    if ssl is not None and isinstance(error, ssl.SSLError):
+        return ERROR_TLS
+    if isinstance(error, ConnectionRefusedError):
+        return ERROR_REFUSED
+    if isinstance(error, OSError) and error.errno in _UNREACHABLE_ERRNOS:
+        return ERROR_UNREACHABLE
+    return ERROR_OTHER
+
+
+def pack_samples(samples: List[Optional[float]]) -> bytes:
+    """
+    Pack latency samples into a compact blob, 4 bytes per sample.
+
+    Args:
+        samples (list): Milliseconds, None for a sample without an answer
+
+    Returns:
+        bytes: The packed samples
+    """
+    packed = array(_SAMPLE_TYPECODE, (math.nan if sample is None else sample for sample in samples))
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_samples(blob: bytes) -> List[Optional[float]]:
+    """
+    Unpack the latency samples packed by pack_samples.
+
+    Returns:
+        list: Milliseconds, None for a sample without an answer
+    """
+    samples = array(_SAMPLE_TYPECODE)
+    samples.frombytes(bytes(blob))
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return [None if math.isnan(sample) else sample for sample in samples]
+
+
+def latency_stats(samples: List[Optional[float]]) -> dict:
+    """
+    Summarize the latency samples of one probe, e.g. the echoes of an ICMP ping.
+
+    Args:
+        samples (list): Milliseconds in sending order, None for a sample without an answer
+
+    Returns:
+        dict: sent, received, loss_pct, and over the answered samples min_ms, avg_ms, max_ms,
+              stddev_ms (population) and jitter_ms (mean difference between consecutive
+              answers, as ping and RFC 3550 report it); the latencies are None without answers
+    """
+    received = [sample for sample in samples if sample is not None]
+    stats = {
+        "sent": len(samples),
+        "received": len(received),
+        "loss_pct": round(100.0 * (len(samples) - len(received)) / len(samples), 2) if samples else 0.0,
+        "min_ms": None, "avg_ms": None, "max_ms": None, "stddev_ms": None, "jitter_ms": None,
+    }
+    if not received:
+        return stats
+    average = math.fsum(received) / len(received)
+    variance = math.fsum((sample - average) ** 2 for sample in received) / len(received)
+    differences = [abs(current - previous) for previous, current in zip(received, received[1:])]
+    stats.update({
+        "min_ms": round(min(received), 3),
+        "avg_ms": round(average, 3),
+        "max_ms": round(max(received), 3),
+        "stddev_ms": round(math.sqrt(variance), 3),
+        "jitter_ms": round(math.fsum(differences) / len(differences), 3) if differences else 0.0,
+    })
+    return stats
+
+
+class ProbeResult:
+    """
+    Outcome of one probe, whatever the protocol.
+    """
+    __slots__ = ("success", "response_time_ms", "status_code", "error_class", "error", "output",
+                 "payload", "timestamp", "hostname", "samples")
+
+    def __init__(self, success: bool, response_time_ms: Optional[float] = None, status_code: Optional[int] = None,
+                 error_class: Optional[str] = None, error: Optional[str] = None, output: str = "",
+                 payload: Optional[dict] = None, timestamp: Optional[float] = None,
+                 samples: Optional[List[Optional[float]]] = None):
+        """
+        Args:
+            success (bool): Whether the target answered as expected
+            response_time_ms (float, optional): Response time in milliseconds, None without an answer
+            status_code (int, optional): Protocol status, e.g. the HTTP code or the DNS rcode
+            error_class (str, optional): One of ERROR_CLASSES, set on failure
+            error (str, optional): Error message, set on failure
+            output (str): Human readable details of the probe
+            payload (dict, optional): Protocol specific values, e.g. HTTP phase timings
+            timestamp (float, optional): Epoch seconds when the probe completed, now by default
+            samples (list, optional): Latency of each attempt in milliseconds (None when lost),
+                                      for probes sending several, e.g. ICMP echoes
+        """
+        self.success = success
+        self.response_time_ms = response_time_ms
+        self.status_code = status_code
+        self.error_class = None if success else (error_class or ERROR_OTHER)
+        self.error = error
+        self.output = output
+        self.payload = payload
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.hostname = None  # Monitoring host, set when the result is stored
+        self.samples = samples
+
+    @classmethod
+    def failure(cls, error_class: str, error: str, status_code: Optional[int] = None,
+                payload: Optional[dict] = None, output: Optional[str] = None) -> "ProbeResult":
+        """
+        Build the result of a failed probe, the output defaults to the error message.
+        """
+        return cls(False, None, status_code, error_class, error,
+                   f"Error: {error}" if output is None else output, payload)
+
+    @classmethod
+    def from_exception(cls, error: BaseException, payload: Optional[dict] = None) -> "ProbeResult":
+        """
+        Build the result of a probe that raised an exception.
+        """
+        return cls.failure(classify_error(error), str(error) or error.__class__.__name__, payload=payload)
+
+    def to_dict(self) -> dict:
+        """Every field as a plain dict, e.g. for JSON output."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        state = "up" if self.success else f"down ({self.error_class})"
+        return f"<ProbeResult {state} {self.response_time_ms} ms>"
+
+
+class ProbeBatch:
+    """
+    Many probe results stored column by column.
+
+    Numeric columns are arrays (missing latencies are NaN), so storage and
+    analytics read whole columns instead of looking up keys result by result.
+    """
+    COLUMNS = ("site", "protocol", "hostname", "timestamp", "success", "response_time_ms",
+               "status_code", "error_class", "error", "output", "samples")
+
+    def __init__(self):
+        self.site = []
+        self.protocol = []
+        self.hostname = []
+        self.timestamp = array("d")
+        self.success = array("b")
+        self.response_time_ms = array("d")
+        self.status_code = []
+        self.error_class = []
+        self.error = []
+        self.output = []
+        self.samples = []  # Packed latency samples (pack_samples), None when the probe had none
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def append(self, site: str, protocol: str, result: ProbeResult, keep_output: bool = True) -> None:
+        """
+        Add a result.
+
+        Args:
+            site (str): The hostname or IP that was probed
+            protocol (str): The protocol used
+            result (ProbeResult): The probe result
+            keep_output (bool): Keep the output, or store an empty one
+        """
+        self.site.append(site)
+        self.protocol.append(protocol)
+        self.hostname.append(result.hostname or "unknown")
+        self.timestamp.append(result.timestamp)
+        self.success.append(1 if result.success else 0)
+        self.response_time_ms.append(math.nan if result.response_time_ms is None else result.response_time_ms)
+        self.status_code.append(result.status_code)
+        self.error_class.append(result.error_class)
+        self.error.append(result.error)
+        self.output.append(result.output if keep_output else "")
+        self.samples.append(pack_samples(result.samples) if result.samples else None)
+
+    def extend(self, other: "ProbeBatch") -> None:
+        """Add every result of another batch."""
+        for name in self.COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+    def slice(self, start: int, stop: int) -> "ProbeBatch":
+        """Return a new batch of the results from `start` to `stop`."""
+        batch = ProbeBatch()
+        for name in self.COLUMNS:
+            setattr(batch, name, getattr(self, name)[start:stop])
+        return batch
+
+    def truncate(self, count: int) -> None:
+        """Drop the first `count` results."""
+        for name in self.COLUMNS:
+            del getattr(self, name)[:count]
+
+    def latencies(self) -> list:
+        """Response time column with None for missing values."""
+        return [None if math.isnan(value) else value for value in self.response_time_ms]
+
+    def failures(self) -> int:
+        """Number of failed probes."""
+        return len(self.success) - sum(self.success)
+
+    def results(self):
+        """
+        Yield (site, protocol, ProbeResult) for each row, latency samples included;
+        the payload is not kept in batches.
+        """
+        for index in range(len(self)):
+            latency = self.response_time_ms[index]
+            samples = self.samples[index]
+            result = ProbeResult(
+                bool(self.success[index]), None if math.isnan(latency) else latency, self.status_code[index],
+                self.error_class[index], self.error[index], self.output[index], timestamp=self.timestamp[index],
+                samples=None if samples is None else unpack_samples(samples)
+            )
+            result.hostname = self.hostname[index]
+            yield self.site[index], self.protocol[index], result
@@ -0,0 +1,472 @@
+import asyncio
+import heapq
+import random
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.metrics import (SCHEDULER_BUDGET_WAIT, SCHEDULER_INTERVAL_CHANGES, SCHEDULER_LAG, SCHEDULER_MISSED,
+                          SCHEDULER_PLANNED_RATE, SCHEDULER_POLITENESS_DELAYS, SCHEDULER_RATE_BUDGET,
+                          SCHEDULER_SITES)
+
+# Priorities of the checks waiting for the rate budget, lowest served first
+PRIORITY_INCIDENT = 0
+PRIORITY_NORMAL = 1
+
+
+class ScheduledSite:
+    """
+    Scheduling state of a single site inside the monitor daemon.
+    """
+
+    def __init__(self, site: str, interval: float, jitter: float = 0.0, min_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None, target: Optional[str] = None):
+        """
+        Initialize the site schedule.
+
+        Args:
+            site (str): Site name (configuration file at sites/<site>.conf)
+            interval (float): Seconds between two checks of the site
+            jitter (float): Maximum random delay in seconds before the first check
+            min_interval (float, optional): Shortest interval the adaptive policy may use
+            max_interval (float, optional): Longest interval the adaptive policy may use
+            target (str, optional): Host probed, checks of the same host are kept apart
+        """
+        self.site = site
+        self.interval = interval  # Current interval, moved by the adaptive policy
+        self.base_interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target = target
+        self.jitter = jitter
+        self.next_run = None  # Monotonic time of the next planned check
+        self.runs = 0  # Number of checks performed
+        self.missed_ticks = 0  # Planned checks skipped because the previous one overran
+        self.last_duration = None  # Duration of the last check in seconds
+        self.last_lag = None  # Delay between the planned and the real start of the last check
+        self.failing = False  # Whether the last check failed
+        self.healthy_streak = 0  # Successful checks in a row without a latency spike
+        self.latency_ewma = None  # Moving average of the response time in milliseconds
+        self.latency_samples = 0
+
+    @property
+    def mode(self) -> str:
+        """tightened, base or relaxed, depending on the current interval."""
+        if self.interval < self.base_interval:
+            return "tightened"
+        if self.interval > self.base_interval:
+            return "relaxed"
+        return "base"
+
+    @property
+    def priority(self) -> int:
+        """Priority of the site for the rate budget: sites in an incident first."""
+        return PRIORITY_INCIDENT if self.failing or self.interval < self.base_interval else PRIORITY_NORMAL
+
+
+class AdaptivePolicy:
+    """
+    Adapt the interval of each site to what its last checks showed.
+
+    A failure halves the interval and a latency spike (well above the moving
+    average of the site) shortens it by a quarter, down to the minimum, so an
+    incident is confirmed and followed closely. After `relax_after` healthy
+    checks in a row, each further one lengthens the interval by a quarter up
+    to the maximum, so long-stable sites cost less. The bounds are the
+    min_interval and max_interval of the site, by default a quarter and four
+    times its configured interval.
+    """
+
+    def __init__(self, min_factor: float = 0.25, max_factor: float = 4.0, failure_factor: float = 0.5,
+                 spike_factor: float = 0.75, relax_factor: float = 1.25, relax_after: int = 10,
+                 spike_ratio: float = 1.5, spike_min_ms: float = 5.0, smoothing: float = 0.2, warmup: int = 5):
+        """
+        Args:
+            min_factor (float): Default minimum, as a fraction of the configured interval
+            max_factor (float): Default maximum, as a multiple of the configured interval
+            failure_factor (float): Interval multiplier after a failure
+            spike_factor (float): Interval multiplier after a latency spike
+            relax_factor (float): Interval multiplier after each healthy check past relax_after
+            relax_after (int): Healthy checks in a row before the interval grows
+            spike_ratio (float): Latency over this multiple of the moving average is a spike
+            spike_min_ms (float): ...and must also exceed it by this many milliseconds
+            smoothing (float): Weight of a new sample in the latency moving average
+            warmup (int): Samples needed before spikes are detected
+        """
+        if not 0 < min_factor <= 1 <= max_factor:
+            raise ValueError("The adaptive bounds must include the configured interval")
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.failure_factor = failure_factor
+        self.spike_factor = spike_factor
+        self.relax_factor = relax_factor
+        self.relax_after = relax_after
+        self.spike_ratio = spike_ratio
+        self.spike_min_ms = spike_min_ms
+        self.smoothing = smoothing
+        self.warmup = warmup
+
+    def bounds(self, entry: ScheduledSite) -> Tuple[float, float]:
+        low = entry.min_interval or entry.base_interval * self.min_factor
+        high = entry.max_interval or entry.base_interval * self.max_factor
+        return min(low, entry.base_interval), max(high, entry.base_interval)
+
+    def update(self, entry: ScheduledSite, result) -> Optional[str]:
+        """
+        Move the interval of a site after one of its checks.
+
+        Args:
+            entry (ScheduledSite): The site checked
+            result (ProbeResult): Result of the check, None if it did not probe (nothing changes)
+
+        Returns:
+            str: tighten or relax if the interval changed, None otherwise
+        """
+        if result is None:
+            return None
+        low, high = self.bounds(entry)
+        interval = entry.interval
+        if not result.success:
+            entry.healthy_streak = 0
+            interval = max(low, interval * self.failure_factor)
+        else:
+            latency = result.response_time_ms
+            spike = False
+            if latency is not None:
+                average = entry.latency_ewma
+                spike = (entry.latency_samples >= self.warmup and latency > average * self.spike_ratio
+                         and latency - average > self.spike_min_ms)
+                entry.latency_ewma = latency if average is None else average + self.smoothing * (latency - average)
+                entry.latency_samples += 1
+            if spike:
+                entry.healthy_streak = 0
+                interval = max(low, interval * self.spike_factor)
+            else:
+                entry.healthy_streak += 1
+                if entry.healthy_streak > self.relax_after:
+                    interval = min(high, interval * self.relax_factor)
+
+        if interval == entry.interval:
+            return None
+        direction = "tighten" if interval < entry.interval else "relax"
+        entry.interval = interval
+        return direction
+
+
+class RateBudget:
+    """
+    Global probe rate limit of a scheduler.
+
+    A token bucket refilled at `rate` tokens per second; when it is empty the
+    waiting checks are served by priority, sites in an incident first, so the
+    spare capacity goes to the checks that detect and follow incidents.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            rate (float): Probes per second
+            burst (float, optional): Probes that may start at once after an idle period, one second worth by default
+            clock (callable): Monotonic clock returning seconds
+        """
+        if rate <= 0:
+            raise ValueError(f"Invalid probe rate budget: {rate}")
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._waiters: List[tuple] = []  # (priority, sequence, future)
+        self._sequence = 0
+        self._pacer: Optional[asyncio.Task] = None
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> float:
+        """
+        Wait for a token.
+
+        Returns:
+            float: Seconds waited
+        """
+        self._refill()
+        if self._tokens >= 1 and not self._waiters:
+            self._tokens -= 1
+            return 0.0
+        started = self.clock()
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._waiters, (priority, self._sequence, future))
+        if self._pacer is None or self._pacer.done():
+            self._pacer = asyncio.create_task(self._pace())
+        await future
+        return self.clock() - started
+
+    async def _pace(self) -> None:
+        while self._waiters:
+            self._refill()
+            while self._tokens >= 1 and self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():  # Cancelled waiters give their turn away
+                    self._tokens -= 1
+                    future.set_result(None)
+            if self._waiters:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def release_all(self) -> None:
+        """Wake every waiting check, e.g. when the scheduler stops."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+
+class Scheduler:
+    def __init__(self, check: Callable[[str], object], max_workers: int = 32,
+                 clock: Callable[[], float] = time.monotonic, policy: Optional[AdaptivePolicy] = None,
+                 max_rate: Optional[float] = None, politeness: float = 0.0):
+        """
+        Initialize the scheduler.
+
+        Args:
+            check (callable): Blocking function performing one check for a site name, returning its ProbeResult
+            max_workers (int): Maximum number of checks running at the same time
+            clock (callable): Monotonic clock returning seconds
+            policy (AdaptivePolicy, optional): Adapts the interval of each site to its results, fixed intervals if None
+            max_rate (float, optional): Global budget in probes per second, unlimited if None
+            politeness (float): Minimum seconds between the start of two probes of the same host
+        """
+        self.check = check
+        self.max_workers = max_workers
+        self.clock = clock
+        self.policy = policy
+        self.max_rate = max_rate
+        self.budget = RateBudget(max_rate, clock=clock) if max_rate else None
+        self.politeness = politeness
+        self.sites: Dict[str, ScheduledSite] = {}
+        self._target_next: Dict[str, float] = {}  # Host -> earliest start of its next probe
+        self._stopping: Optional[asyncio.Event] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def add_site(self, site: str, interval: float, jitter: Optional[float] = None,
+                 min_interval: Optional[float] = None, max_interval: Optional[float] = None,
+                 target: Optional[str] = None) -> ScheduledSite:
+        """
+        Register a site to be checked periodically.
+
+        Args:
+            site (str): Site name
+            interval (float): Seconds between two checks
+            jitter (float, optional): Maximum start delay, defaults to the interval
+            min_interval (float, optional): Shortest interval of the adaptive policy
+            max_interval (float, optional): Longest interval of the adaptive policy
+            target (str, optional): Host probed, for the politeness limit
+
+        Returns:
+            ScheduledSite: The schedule entry of the site
+        """
+        if interval <= 0:
+            raise ValueError(f"Invalid interval for site '{site}': {interval}")
+        entry = ScheduledSite(site, interval, interval if jitter is None else jitter,
+                              min_interval, max_interval, target)
+        self.sites[site] = entry
+        return entry
+
+    def stop(self) -> None:
+        """
+        Ask the running scheduler to finish after the checks in progress.
+        """
+        if self._stopping is not None:
+            self._stopping.set()
+        if self.budget is not None:
+            self.budget.release_all()
+
+    async def _sleep_until(self, deadline: float) -> bool:
+        """
+        Sleep until the given monotonic time.
+
+        Returns:
+            bool: True if the scheduler was stopped while sleeping
+        """
+        delay = deadline - self.clock()
+        if delay <= 0:
+            return self._stopping.is_set()
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _wait_for_turn(self, entry: ScheduledSite) -> bool:
+        """
+        Wait for the rate budget, then for the politeness gap of the host.
+
+        Returns:
+            bool: True if the scheduler was stopped while waiting
+        """
+        if self.budget is not None:
+            priority = entry.priority
+            waited = await self.budget.acquire(priority)
+            SCHEDULER_BUDGET_WAIT.observe(waited, "incident" if priority == PRIORITY_INCIDENT else "normal")
+            if self._stopping.is_set():
+                return True
+        if self.politeness and entry.target:
+            # Reserved before sleeping, so checks of the same host queue up one gap apart
+            now = self.clock()
+            start_at = max(now, self._target_next.get(entry.target, now))
+            self._target_next[entry.target] = start_at + self.politeness
+            if start_at > now:
+                SCHEDULER_POLITENESS_DELAYS.inc()
+                return await self._sleep_until(start_at)
+        return False
+
+    async def _run_site(self, entry: ScheduledSite) -> None:
+        loop = asyncio.get_running_loop()
+        entry.next_run = self.clock() + random.uniform(0, entry.jitter)
+
+        while not self._stopping.is_set():
+            if await self._sleep_until(entry.next_run):
+                break
+            if await self._wait_for_turn(entry):
+                break
+
+            started = self.clock()
+            result = None
+            try:
+                result = await loop.run_in_executor(self._executor, self._start_check, entry, entry.next_run)
+            except Exception as e:
+                print(f"Error checking site '{entry.site}': {e}")
+            entry.runs += 1
+            entry.last_duration = self.clock() - started
+            if result is not None:
+                entry.failing = not result.success
+            if self.policy is not None:
+                direction = self.policy.update(entry, result)
+                if direction:
+                    SCHEDULER_INTERVAL_CHANGES.inc(direction)
+
+            # Keep the original cadence; ticks that already passed are skipped, not replayed
+            entry.next_run += entry.interval
+            now = self.clock()
+            if now > entry.next_run:
+                missed = int((now - entry.next_run) // entry.interval) + 1
+                entry.missed_ticks += missed
+                SCHEDULER_MISSED.inc(amount=missed)
+                entry.next_run += missed * entry.interval
+
+    def _start_check(self, entry: ScheduledSite, planned: float) -> object:
+        # The lag includes the wait for a free worker, not only for the event loop
+        entry.last_lag = self.clock() - planned
+        SCHEDULER_LAG.observe(entry.last_lag)
+        return self.check(entry.site)
+
+    def _install_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not available on Windows or outside the main thread
+                pass
+
+    async def run(self, duration: Optional[float] = None) -> None:
+        """
+        Run the scheduler until stopped.
+
+        Args:
+            duration (float, optional): Stop automatically after this many seconds
+        """
+        self._stopping = asyncio.Event()
+        self._install_signal_handlers()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pingmonitor")
+        _running.append(self)
+        try:
+            tasks = [asyncio.create_task(self._run_site(entry)) for entry in self.sites.values()]
+            if duration is not None:
+                asyncio.get_running_loop().call_later(duration, self.stop)
+            await asyncio.gather(*tasks)
+        finally:
+            _running.remove(self)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        """
+        Summarize the scheduling state of every site.
+
+        Returns:
+            dict: Per-site intervals, runs, missed ticks, last lag and last duration
+        """
+        return {
+            site: {
+                "interval": entry.interval,
+                "base_interval": entry.base_interval,
+                "mode": entry.mode,
+                "runs": entry.runs,
+                "missed_ticks": entry.missed_ticks,
+                "last_lag": entry.last_lag,
+                "last_duration": entry.last_duration,
+            }
+            for site, entry in self.sites.items()
+        }
+
+
+# Schedulers currently running, read when the metrics are rendered
+_running: List[Scheduler] = []
+
+
+def _sites_by_mode() -> dict:
+    counts = {("tightened",): 0, ("base",): 0, ("relaxed",): 0}
+    for scheduler in list(_running):
+        for entry in list(scheduler.sites.values()):
+            counts[(entry.mode,)] += 1
+    return counts if _running else {}
+
+
+def _planned_rate() -> dict:
+    if not _running:
+        return {}
+    return {(): sum(1 / entry.interval for scheduler in list(_running) for entry in list(scheduler.sites.values()))}
+
+
+def _rate_budget() -> dict:
+    budgets = [scheduler.max_rate for scheduler in list(_running) if scheduler.max_rate]
+    return {(): sum(budgets)} if budgets else {}
+
+
+SCHEDULER_SITES.collect_with(_sites_by_mode)
+SCHEDULER_PLANNED_RATE.collect_with(_planned_rate)
+SCHEDULER_RATE_BUDGET.collect_with(_rate_budget)
+
+
+async def sweep(check: Callable[[str], object], sites: List[str], concurrency: int = 64) -> Dict[str, float]:
+    """
+    Check every site once, running at most `concurrency` checks at the same time.
+
+    Args:
+        check (callable): Blocking function performing one check for a site name
+        sites (list): Site names to check
+        concurrency (int): Maximum number of checks running at the same time
+
+    Returns:
+        dict: Duration in seconds of each site check
+    """
+    loop = asyncio.get_running_loop()
+    durations = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="pingmonitor") as executor:
+        async def run_one(site: str) -> None:
+            started = time.monotonic()
+            try:
+                await loop.run_in_executor(executor, check, site)
+            except Exception as e:
+                print(f"Error checking site '{site}': {e}")
+            durations[site] = time.monotonic() - started
+
+        await asyncio.gather(*(run_one(site) for site in sites))
+
+    return durations
@@ -0,0 +1,317 @@
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from core.registry import SiteConfig
+
+# Results a worker batches before handing them to the supervisor, and how long it waits for more
+RESULT_BATCH_SIZE = 200
+RESULT_BATCH_DELAY = 0.2
+
+# Batches queued between the workers and the supervisor; workers block beyond, so a
+# supervisor falling behind slows the probes down instead of filling the memory
+MAX_QUEUED_BATCHES = 1000
+
+
+def shard_of(site: str, shards: int) -> int:
+    """
+    Shard of a site, stable across processes and runs (unlike hash(), which is salted).
+
+    Args:
+        site (str): Site name
+        shards (int): Number of shards
+
+    Returns:
+        int: Shard index between 0 and shards - 1
+    """
+    return zlib.crc32(site.encode("utf-8")) % shards
+
+
+def assign_shards(configs: Dict[str, SiteConfig], shards: int) -> List[Dict[str, SiteConfig]]:
+    """
+    Split site configurations between shards.
+
+    Sites are hashed by the host they probe, so every site of a host lands in
+    the same worker and the politeness limit of the scheduler holds.
+
+    Returns:
+        list: One {site name: SiteConfig} dict per shard
+    """
+    assignment = [{} for _ in range(shards)]
+    for name, config in configs.items():
+        assignment[shard_of(config.target, shards)][name] = config
+    return assignment
+
+
+def _fingerprint(configs: Dict[str, SiteConfig]) -> dict:
+    return {name: (config.options, config.reporter) for name, config in configs.items()}
+
+
+class _ResultSender:
+    """
+    Batch the results of a worker process and put them on the supervisor queue.
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self._pending = []
+        self._condition = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="pingmonitor-sender", daemon=True)
+        self._thread.start()
+
+    def add(self, site: str, result) -> None:
+        with self._condition:
+            self._pending.append((site, result))
+            if len(self._pending) >= RESULT_BATCH_SIZE:
+                self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closing and len(self._pending) < RESULT_BATCH_SIZE:
+                    self._condition.wait(RESULT_BATCH_DELAY)
+                batch, self._pending = self._pending, []
+                closing = self._closing
+            if batch:
+                self.results.put(batch)
+            if closing:
+                return
+
+    def close(self) -> None:
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+
+
+def run_worker(shard: int, configs: Dict[str, SiteConfig], results, interval: float,
+               jitter: Optional[float], workers: int, scheduling: Optional[dict] = None) -> None:
+    """
+    Entry point of a worker process: schedule and probe the sites of one shard.
+
+    Results are not stored here but handed to the supervisor, so every SQLite
+    file keeps a single writer.
+
+    Args:
+        shard (int): Shard index, for messages
+        configs (dict): {site name: SiteConfig} of the shard
+        results (multiprocessing.Queue): Where batches of (site, ProbeResult) are put
+        interval (float): Default seconds between checks
+        jitter (float, optional): Maximum start delay in seconds
+        workers (int): Concurrent checks in this process
+        scheduling (dict, optional): Scheduler keyword arguments (policy, max_rate, politeness)
+    """
+    import asyncio
+
+    from core.scheduler import Scheduler
+    # Imported here, the checks themselves are those of the CLI
+    from main import PingMonitor
+
+    monitor = PingMonitor()
+    sender = _ResultSender(results)
+    monitor.result_sink = sender.add
+    scheduler = Scheduler(lambda name: monitor.run_check(name, configs[name]), max_workers=workers,
+                          **(scheduling or {}))
+    for name, config in configs.items():
+        try:
+            scheduler.add_site(name, config.interval or interval, jitter,
+                               config.min_interval, config.max_interval, config.target)
+        except ValueError as e:
+            print(f"Skipping site '{name}': {e}")
+    try:
+        # The scheduler stops on SIGTERM from the supervisor (or Ctrl+C on the process
+        # group), finishing the checks in progress so their results are handed over
+        asyncio.run(scheduler.run())
+    finally:
+        sender.close()
+
+
+class _Worker:
+    __slots__ = ("shard", "configs", "process", "started_at", "crashes", "restarts", "restart_at")
+
+    def __init__(self, shard: int):
+        self.shard = shard
+        self.configs: Dict[str, SiteConfig] = {}
+        self.process = None
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restarts = 0  # Crashes in a row, shortly after starting
+        self.restart_at = None  # Monotonic time a crashed worker is started again
+
+
+class Supervisor:
+    def __init__(self, load_sites: Callable[[], Dict[str, SiteConfig]],
+                 record: Callable[[str, SiteConfig, object], None], processes: int,
+                 interval: float = 60, jitter: Optional[float] = None, workers: int = 32,
+                 reload_interval: float = 30, max_restart_delay: float = 60, scheduling: Optional[dict] = None):
+        """
+        Run the checks in several worker processes, one shard of the sites each.
+
+        Sites are assigned by a stable hash of the host they probe, so adding
+        or removing a site only restarts the worker of its shard. Workers that exit are
+        restarted, with an exponential delay when they keep crashing. Every
+        result is recorded by the supervisor process, which is the only one
+        writing to the databases.
+
+        Args:
+            load_sites (callable): Returns the current {site name: SiteConfig}, called on each reload
+            record (callable): Stores a result, called as record(name, config, result)
+            processes (int): Number of worker processes
+            interval (float): Default seconds between checks
+            jitter (float, optional): Maximum start delay in seconds, the site interval by default
+            workers (int): Concurrent checks in each worker process
+            reload_interval (float): Seconds between two reloads of the site registry
+            max_restart_delay (float): Longest delay before restarting a crashing worker
+            scheduling (dict, optional): Scheduler keyword arguments of the workers (policy, max_rate, politeness)
+        """
+        if processes < 1:
+            raise ValueError("At least one worker process is needed")
+        self.load_sites = load_sites
+        self.record = record
+        self.interval = interval
+        self.jitter = jitter
+        self.workers = workers
+        self.reload_interval = reload_interval
+        self.max_restart_delay = max_restart_delay
+        self.scheduling = scheduling
+        self.configs: Dict[str, SiteConfig] = {}
+        self.results_recorded = 0
+        self._workers = [_Worker(shard) for shard in range(processes)]
+        self._context = multiprocessing.get_context("spawn")
+        self._results = None
+        self._stopping = threading.Event()
+
+    def stop(self, *args) -> None:
+        """Ask the supervisor to stop its workers and return, e.g. from a signal handler."""
+        self._stopping.set()
+
+    def _start(self, worker: _Worker) -> None:
+        worker.process = self._context.Process(
+            target=run_worker, name=f"pingmonitor-shard-{worker.shard}",
+            args=(worker.shard, worker.configs, self._results, self.interval, self.jitter, self.workers,
+                  self.scheduling),
+            daemon=True,
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+
+    def _terminate(self, worker: _Worker, timeout: float = 10) -> None:
+        process, worker.process = worker.process, None
+        if process is None:
+            return
+        if process.is_alive():
+            # SIGTERM lets the scheduler finish the checks in progress
+            process.terminate()
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def rebalance(self) -> None:
+        """
+        Reload the sites and restart the workers whose share of sites changed.
+        """
+        try:
+            configs = self.load_sites()
+        except Exception as e:
+            print(f"Error reloading the sites: {e}")
+            return
+        self.configs = configs
+        for worker, shard_configs in zip(self._workers, assign_shards(configs, len(self._workers))):
+            if _fingerprint(shard_configs) == _fingerprint(worker.configs) and (
+                    worker.process is not None or worker.restart_at is not None or not shard_configs):
+                continue
+            if worker.configs:
+                print(f"Shard {worker.shard}: {len(worker.configs)} -> {len(shard_configs)} sites, restarting")
+            worker.configs = shard_configs
+            self._terminate(worker)
+            if shard_configs:
+                self._start(worker)
+
+    def _check_workers(self) -> None:
+        now = time.monotonic()
+        for worker in self._workers:
+            if worker.restart_at is not None and now >= worker.restart_at:
+                self._start(worker)
+            elif worker.process is not None and not worker.process.is_alive():
+                exitcode = worker.process.exitcode
+                worker.process.join()
+                worker.process = None
+                worker.crashes += 1
+                # Back off while the worker keeps crashing shortly after starting
+                if now - worker.started_at < self.max_restart_delay:
+                    worker.restarts += 1
+                else:
+                    worker.restarts = 0
+                delay = min(2 ** worker.restarts, self.max_restart_delay)
+                worker.restart_at = now + delay
+                print(f"Shard {worker.shard} exited with code {exitcode}, restarting in {delay:.0f}s")
+
+    def _record_results(self) -> None:
+        while True:
+            try:
+                batch = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopping.is_set() and not any(worker.process for worker in self._workers):
+                    return
+                continue
+            for name, result in batch:
+                config = self.configs.get(name)
+                if config is None:
+                    continue  # Removed since it was probed
+                try:
+                    self.record(name, config, result)
+                except Exception as e:
+                    print(f"Error recording result of site '{name}': {e}")
+                self.results_recorded += 1
+
+    def run(self, duration: Optional[float] = None) -> None:
+        """
+        Start the workers and supervise them until stopped.
+
+        Args:
+            duration (float, optional): Stop automatically after this many seconds
+        """
+        self._results = self._context.Queue(MAX_QUEUED_BATCHES)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                signal.signal(sig, self.stop)
+            except ValueError:
+                pass  # Not in the main thread
+        recorder = threading.Thread(target=self._record_results, name="pingmonitor-recorder", daemon=True)
+        recorder.start()
+
+        self.rebalance()
+        deadline = None if duration is None else time.monotonic() + duration
+        next_reload = time.monotonic() + self.reload_interval
+        while not self._stopping.wait(1.0):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self._check_workers()
+            if time.monotonic() >= next_reload:
+                self.rebalance()
+                next_reload = time.monotonic() + self.reload_interval
+
+        self._stopping.set()
+        for worker in self._workers:
+            worker.restart_at = None
+            self._terminate(worker)
+        # The workers have put their last batches, record them before returning
+        recorder.join()
+
+    def stats(self) -> dict:
+        """Sites, pid and crashes of each shard."""
+        return {
+            worker.shard: {
+                "sites": len(worker.configs),
+                "pid": worker.process.pid if worker.process is not None else None,
+                "crashes": worker.crashes,
+            }
+            for worker in self._workers
+        }
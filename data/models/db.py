@@ -1,16 +1,82 @@
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
 from peewee import (
     Model,
     SqliteDatabase,
     CharField,
     BooleanField,
     IntegerField,
+    FloatField,
+    BlobField,
     TextField,
-    DateTimeField
+    DateTimeField,
+    chunked,
+    fn
+)
+from datetime import datetime, timedelta
+
+from core.alerts import SiteState
+from core.anomaly import LatencyState
+from core.result import ProbeBatch, ProbeResult, pack_samples, unpack_samples
+from data.models.rollup import (
+    RollupBucket,
+    aggregate_columns,
+    aggregate_rows,
+    choose_granularity,
+    covering_buckets
 )
-from datetime import datetime
+
+
+# Write-ahead logging lets readers work while the writer commits, and busy_timeout
+# makes concurrent connections wait for the lock instead of failing with "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 10000,
+    "cache_size": -16000,  # 16 MB
+    "temp_store": "memory",
+    # Only effective on new files, `db compact` converts existing ones
+    "auto_vacuum": "incremental",
+}
+
+# What is kept of the raw output of each ping
+RAW_OUTPUT_ALL = "all"
+RAW_OUTPUT_FAILURES = "failures"
+RAW_OUTPUT_NONE = "none"
+RAW_OUTPUT_MODES = (RAW_OUTPUT_ALL, RAW_OUTPUT_FAILURES, RAW_OUTPUT_NONE)
+
+
+def keep_raw_output(raw_output: str, success: bool) -> bool:
+    """Whether the raw output of a ping is stored under a raw_output mode."""
+    return raw_output == RAW_OUTPUT_ALL or (raw_output == RAW_OUTPUT_FAILURES and not success)
+
+
+# Rows per INSERT statement, keeps the bound variables under SQLite's default limit
+INSERT_CHUNK_SIZE = 100
+
+# Layouts of the raw results, recorded in PRAGMA user_version
+SCHEMA_V1 = 1  # pingresult: text site/protocol/hostname and datetime text per row
+SCHEMA_V2 = 2  # pingresult_v2: interned dimension ids and epoch millisecond timestamps
+
+
+def to_epoch_ms(timestamp: datetime) -> int:
+    """Convert a naive local datetime to epoch milliseconds."""
+    return int(round(timestamp.timestamp() * 1000))
+
+
+def from_epoch_ms(timestamp_ms: int) -> datetime:
+    """Convert epoch milliseconds to a naive local datetime."""
+    return datetime.fromtimestamp(timestamp_ms / 1000)
 
 
 class PingMonitorDB:
+    _shared = {}
+    _shared_lock = threading.Lock()
+
     def __init__(self, database_path: str):
         """
         Initialize the database connection.
@@ -18,18 +84,113 @@ class PingMonitorDB:
         Args:
             database_path (str): Path to the SQLite database file
         """
-        self.db = SqliteDatabase(database_path)
-        # Set the database for the PingResult model
-        self.PingResult._meta.database = self.db
+        self.database_path = database_path
+        self.db = SqliteDatabase(database_path, pragmas=SQLITE_PRAGMAS)
+
+        # Bind models of our own so several databases can be used at the same time
+        self.PingResult = self._bind_model(PingMonitorDB.PingResult, "pingresult")
+        self.PingRollup = self._bind_model(PingMonitorDB.PingRollup, "pingrollup")
+        self.AlertState = self._bind_model(PingMonitorDB.AlertState, "alertstate")
+        self.LatencyBaseline = self._bind_model(PingMonitorDB.LatencyBaseline, "latencybaseline")
+        self.PingResultV2 = self._bind_model(PingMonitorDB.PingResultV2, "pingresult_v2")
+        self.SiteName = self._bind_model(PingMonitorDB.Dimension, "dim_site")
+        self.ProtocolName = self._bind_model(PingMonitorDB.Dimension, "dim_protocol")
+        self.HostnameName = self._bind_model(PingMonitorDB.Dimension, "dim_hostname")
+        self._dimension_ids = {}
         self.initialize_db()
 
+    def _bind_model(self, model, table_name):
+        class Meta:
+            database = self.db
+
+        Meta.table_name = table_name
+        return type(model.__name__, (model,), {"Meta": Meta, "__module__": __name__})
+
+    @classmethod
+    def open(cls, database_path: str) -> "PingMonitorDB":
+        """
+        Return the instance shared by the whole process for a database file.
+
+        Args:
+            database_path (str): Path to the SQLite database file
+
+        Returns:
+            PingMonitorDB: Instance whose tables are already created
+        """
+        key = os.path.abspath(database_path)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(database_path)
+            return cls._shared[key]
+
     def initialize_db(self):
         """
         Initialize the database and create tables.
+
+        New files use the v2 layout, existing ones keep theirs until migrated.
+        The connection is kept open so it can be reused by later queries.
+        """
+        self.db.connect(reuse_if_open=True)
+        with self.db.atomic():
+            if self.schema_version() == 0:
+                version = SCHEMA_V1 if self.db.table_exists("pingresult") else SCHEMA_V2
+                self.db.execute_sql(f"PRAGMA user_version = {version}")
+            if self.schema_version() == SCHEMA_V1:
+                self.db.create_tables([self.PingResult, self.PingRollup, self.AlertState, self.LatencyBaseline],
+                                      safe=True)
+            else:
+                self.db.create_tables(self._v2_models() + [self.PingRollup, self.AlertState, self.LatencyBaseline],
+                                      safe=True)
+                self._unique_dimensions()
+            self._upgrade_schema()
+
+    def _v2_models(self):
+        return [self.SiteName, self.ProtocolName, self.HostnameName, self.PingResultV2]
+
+    def _upgrade_schema(self):
+        """
+        Add the columns introduced after a database was created.
         """
-        self.db.connect()
-        self.db.create_tables([self.PingResult], safe=True)
-        self.db.close()
+        table = "pingresult_v2" if self.schema_version() == SCHEMA_V2 else "pingresult"
+        columns = {column.name for column in self.db.get_columns(table)}
+        if table == "pingresult" and "raw_output_z" not in columns:
+            self.db.execute_sql("ALTER TABLE pingresult ADD COLUMN raw_output_z BLOB")
+        if "rtt_samples" not in columns:
+            self.db.execute_sql(f"ALTER TABLE {table} ADD COLUMN rtt_samples BLOB")
+
+    def _unique_dimensions(self):
+        """
+        Give every dimension table a unique index on the name, so a name is interned once.
+        """
+        for model in (self.SiteName, self.ProtocolName, self.HostnameName):
+            table = model._meta.table_name
+            self.db.execute_sql(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_name" ON "{table}" ("name")')
+
+    def schema_version(self) -> int:
+        """
+        Layout of the raw results: SCHEMA_V1, SCHEMA_V2, or 0 before initialization.
+        """
+        return self.db.execute_sql("PRAGMA user_version").fetchone()[0]
+
+    def close(self):
+        """
+        Close the connection of the calling thread.
+        """
+        if not self.db.is_closed():
+            self.db.close()
+
+    @contextmanager
+    def short_connection(self):
+        """
+        Run a few queries from a thread that does not keep a connection, closing
+        the one they open on exit; a connection already open is left alone.
+        """
+        opened = self.db.is_closed()
+        try:
+            yield self
+        finally:
+            if opened:
+                self.close()
 
     class PingResult(Model):
         """
@@ -46,7 +207,9 @@ class PingMonitorDB:
 
         # Metadata
         timestamp = DateTimeField(default=datetime.now)  # When the ping was performed
-        raw_output = TextField()  # Raw output from the ping command
+        raw_output = TextField()  # Raw output from the ping command, empty when compressed
+        raw_output_z = BlobField(null=True)  # Raw output compressed with zlib
+        rtt_samples = BlobField(null=True)  # Latency of each attempt, see core.result.pack_samples
         hostname = CharField()  # The hostname of the machine performing the ping
 
         class Meta:
@@ -57,29 +220,650 @@ class PingMonitorDB:
         def __str__(self):
             return f"Ping to {self.site} at {self.timestamp} - {'Success' if self.success else 'Failed'}"
 
-    def store_ping_result(self, site: str, protocol: str, result: dict):
+        def get_raw_output(self) -> str:
+            """Return the raw output, decompressing it if needed."""
+            if self.raw_output_z is not None:
+                return zlib.decompress(bytes(self.raw_output_z)).decode("utf-8")
+            return self.raw_output
+
+        def get_samples(self) -> list:
+            """Return the latency samples in milliseconds (None when lost), empty if none were stored."""
+            return unpack_samples(self.rtt_samples) if self.rtt_samples is not None else []
+
+    class Dimension(Model):
+        """
+        Model interning a site, protocol or hostname name as a small integer (v2 layout).
+        """
+        # Unique per table, see _unique_dimensions: an index declared here would be
+        # named after the model and only created on the first table
+        name = CharField()
+
+    class PingResultV2(Model):
+        """
+        Model to store ping results with interned dimensions (v2 layout).
+        """
+        site_id = IntegerField()  # Id in dim_site
+        protocol_id = IntegerField()  # Id in dim_protocol
+        hostname_id = IntegerField()  # Id in dim_hostname
+
+        timestamp_ms = IntegerField()  # When the ping was performed, epoch milliseconds
+        success = BooleanField()
+        response_time_ms = IntegerField(null=True)
+        error_message = TextField(null=True)
+        raw_output_z = BlobField(null=True)  # Raw output compressed with zlib
+        rtt_samples = BlobField(null=True)  # Latency of each attempt, see core.result.pack_samples
+
+        class Meta:
+            indexes = (
+                (('site_id', 'protocol_id', 'timestamp_ms'), False),
+            )
+
+        @property
+        def timestamp(self) -> datetime:
+            return from_epoch_ms(self.timestamp_ms)
+
+        def __str__(self):
+            return f"Ping to {self.site} at {self.timestamp} - {'Success' if self.success else 'Failed'}"
+
+        def get_raw_output(self) -> str:
+            """Return the decompressed raw output."""
+            if self.raw_output_z is None:
+                return ""
+            return zlib.decompress(bytes(self.raw_output_z)).decode("utf-8")
+
+        def get_samples(self) -> list:
+            """Return the latency samples in milliseconds (None when lost), empty if none were stored."""
+            return unpack_samples(self.rtt_samples) if self.rtt_samples is not None else []
+
+    class PingRollup(Model):
+        """
+        Model to store ping results aggregated over a minute, an hour or a day.
+        """
+        granularity = IntegerField()  # Bucket size in seconds
+        bucket_start = DateTimeField()  # Start of the bucket
+        site = CharField()
+        protocol = CharField()
+        hostname = CharField()
+
+        samples = IntegerField()  # Number of pings
+        failures = IntegerField()  # Number of failed pings
+        latency_count = IntegerField()  # Number of pings with a response time
+        latency_sum = FloatField()  # Sum of the response times in milliseconds
+        latency_min = FloatField(null=True)
+        latency_max = FloatField(null=True)
+        histogram = BlobField()  # Packed latency histogram, see data.models.rollup
+
+        class Meta:
+            indexes = (
+                (('site', 'protocol', 'granularity', 'bucket_start', 'hostname'), True),
+            )
+
+    class AlertState(Model):
+        """
+        Model to store the alerting state machine of each site, see core.alerts.
+        """
+        site = CharField()
+        protocol = CharField()
+        state = CharField()  # unknown, up or down
+        changed_at = FloatField()  # Epoch seconds, first result of the current state
+        streak_success = BooleanField()  # Whether the current streak is of successes
+        streak = IntegerField()  # Consecutive results of the current streak
+        streak_started = FloatField()
+        down_since = FloatField(null=True)  # First failure of the last DOWN state
+        transitions = TextField()  # JSON list of the recent transition times
+        flapping = BooleanField()
+        suppressed_until = FloatField()
+        suppressed = IntegerField()  # Changes not notified while flapping
+
+        class Meta:
+            indexes = (
+                (('site', 'protocol'), True),
+            )
+
+    class LatencyBaseline(Model):
+        """
+        Model to store the latency baseline of each site, see core.anomaly.
+        """
+        site = CharField()
+        protocol = CharField()
+        state = CharField()  # normal or slow
+        changed_at = FloatField()  # Epoch seconds, first check of the current state
+        samples = IntegerField()  # Latencies learned
+        mean = FloatField()  # Exponentially weighted mean latency in ms
+        variance = FloatField()
+        sketch = TextField()  # JSON P² markers of the normal latencies
+        streak_slow = BooleanField()  # Whether the current streak is of slow checks
+        streak = IntegerField()
+        streak_started = FloatField()
+
+        class Meta:
+            indexes = (
+                (('site', 'protocol'), True),
+            )
+
+    @staticmethod
+    def build_row(site: str, protocol: str, result: ProbeResult, timestamp: datetime = None,
+                  raw_output: str = RAW_OUTPUT_ALL) -> dict:
+        """
+        Convert a ping result into the column values of a PingResult row.
+
+        Args:
+            site (str): The hostname or IP that was pinged
+            protocol (str): The protocol used for the ping
+            result (ProbeResult): The result of the ping operation
+            timestamp (datetime, optional): When the ping was performed, the result timestamp by default
+            raw_output (str, optional): Raw output kept: all, failures or none
+
+        Returns:
+            dict: Column values
+        """
+        response_time = result.response_time_ms
+        output = result.output
+        keep = keep_raw_output(raw_output, result.success)
+        return {
+            "site": site,
+            "protocol": protocol,
+            "success": bool(result.success),
+            "response_time_ms": int(response_time) if response_time is not None else None,
+            "error_message": result.error,
+            "timestamp": timestamp or datetime.fromtimestamp(result.timestamp),
+            "raw_output": "",
+            "raw_output_z": zlib.compress(output.encode("utf-8")) if keep and output else None,
+            "rtt_samples": pack_samples(result.samples) if result.samples else None,
+            "hostname": result.hostname or "unknown",
+        }
+
+    def store_ping_result(self, site: str, protocol: str, result: ProbeResult):
         """
         Store a ping result in the database.
 
         Args:
             site (str): The hostname or IP that was pinged
             protocol (str): The protocol used for the ping
-            result (dict): The result dictionary from the ping operation
+            result (ProbeResult): The result of the ping operation
         """
         try:
-            with self.db.atomic():
-                self.PingResult.create(
-                    site=site,
-                    protocol=protocol,
-                    success=result.get('success', False),
-                    response_time_ms=result.get('response_time_ms'),
-                    error_message=result.get('error'),
-                    raw_output=result.get('output', ''),
-                    hostname=result.get('hostname', 'unknown')
-                )
+            batch = ProbeBatch()
+            batch.append(site, protocol, result)
+            self.insert_batch(batch)
         except Exception as e:
             print(f"Error storing ping result: {e}")
 
+    def insert_batch(self, batch: ProbeBatch):
+        """
+        Insert a batch of probe results in a single transaction, column by column.
+
+        Args:
+            batch (ProbeBatch): Results to store, with the raw output already
+                                emptied where it must not be kept
+
+        Raises:
+            peewee.PeeweeException: If the transaction fails, no row is stored
+        """
+        if not len(batch):
+            return
+        timestamps = [datetime.fromtimestamp(timestamp) for timestamp in batch.timestamp]
+        successes = [bool(success) for success in batch.success]
+        latencies = [None if latency is None else int(latency) for latency in batch.latencies()]
+        outputs = [zlib.compress(output.encode("utf-8")) if output else None for output in batch.output]
+
+        try:
+            with self.db.atomic():
+                # Read inside the transaction, another process may have migrated the file
+                if self.schema_version() == SCHEMA_V2:
+                    Result = self.PingResultV2
+                    site_ids = self._intern(self.SiteName, batch.site)
+                    protocol_ids = self._intern(self.ProtocolName, batch.protocol)
+                    hostname_ids = self._intern(self.HostnameName, batch.hostname)
+                    fields = [Result.site_id, Result.protocol_id, Result.hostname_id, Result.timestamp_ms,
+                              Result.success, Result.response_time_ms, Result.error_message, Result.raw_output_z,
+                              Result.rtt_samples]
+                    values = zip(
+                        [site_ids[site] for site in batch.site],
+                        [protocol_ids[protocol] for protocol in batch.protocol],
+                        [hostname_ids[hostname] for hostname in batch.hostname],
+                        [int(round(timestamp * 1000)) for timestamp in batch.timestamp],
+                        successes, latencies, batch.error, outputs, batch.samples,
+                    )
+                else:
+                    Result = self.PingResult
+                    fields = [Result.site, Result.protocol, Result.success, Result.response_time_ms,
+                              Result.error_message, Result.timestamp, Result.raw_output, Result.raw_output_z,
+                              Result.rtt_samples, Result.hostname]
+                    values = zip(batch.site, batch.protocol, successes, latencies, batch.error, timestamps,
+                                 [""] * len(batch), outputs, batch.samples, batch.hostname)
+                for chunk in chunked(values, INSERT_CHUNK_SIZE):
+                    Result.insert_many(chunk, fields=fields).execute()
+                self._merge_rollups(aggregate_columns(
+                    timestamps, batch.site, batch.protocol, batch.hostname, successes, latencies
+                ))
+        except Exception:
+            # Ids interned in a rolled back transaction do not exist
+            self._dimension_ids.clear()
+            raise
+
+    def insert_rows(self, rows: list):
+        """
+        Insert many rows in a single transaction.
+
+        Args:
+            rows (list): Column values as returned by build_row
+
+        Raises:
+            peewee.PeeweeException: If the transaction fails, no row is stored
+        """
+        try:
+            with self.db.atomic():
+                # Read inside the transaction, another process may have migrated the file
+                if self.schema_version() == SCHEMA_V2:
+                    self._insert_rows_v2(rows)
+                else:
+                    for batch in chunked(rows, INSERT_CHUNK_SIZE):
+                        self.PingResult.insert_many(batch).execute()
+                self.update_rollups(rows)
+        except Exception:
+            # Ids interned in a rolled back transaction do not exist
+            self._dimension_ids.clear()
+            raise
+
+    def _intern(self, model, names) -> dict:
+        """
+        Return the ids of dimension names, creating the missing ones.
+        """
+        ids = self._dimension_ids.setdefault(model._meta.table_name, {})
+        missing = list({name for name in names if name not in ids})
+        for batch in chunked(missing, INSERT_CHUNK_SIZE):
+            model.insert_many([{"name": name} for name in batch]).on_conflict_ignore().execute()
+            for row in model.select(model.id, model.name).where(model.name.in_(batch)):
+                ids[row.name] = row.id
+        return ids
+
+    def _lookup_id(self, model, name: str):
+        """
+        Return the id of an existing dimension name, None if it was never stored.
+        """
+        ids = self._dimension_ids.setdefault(model._meta.table_name, {})
+        if name not in ids:
+            row = model.get_or_none(model.name == name)
+            if row is None:
+                return None
+            ids[name] = row.id
+        return ids[name]
+
+    def _v2_row(self, row: dict, site_ids: dict, protocol_ids: dict, hostname_ids: dict) -> dict:
+        return {
+            "site_id": site_ids[row["site"]],
+            "protocol_id": protocol_ids[row["protocol"]],
+            "hostname_id": hostname_ids[row["hostname"]],
+            "timestamp_ms": to_epoch_ms(row["timestamp"]),
+            "success": row["success"],
+            "response_time_ms": row["response_time_ms"],
+            "error_message": row["error_message"],
+            "raw_output_z": row["raw_output_z"],
+            "rtt_samples": row.get("rtt_samples"),
+        }
+
+    def _insert_rows_v2(self, rows: list):
+        site_ids = self._intern(self.SiteName, [row["site"] for row in rows])
+        protocol_ids = self._intern(self.ProtocolName, [row["protocol"] for row in rows])
+        hostname_ids = self._intern(self.HostnameName, [row["hostname"] for row in rows])
+        values = [self._v2_row(row, site_ids, protocol_ids, hostname_ids) for row in rows]
+        for batch in chunked(values, INSERT_CHUNK_SIZE):
+            self.PingResultV2.insert_many(batch).execute()
+
+    def _dimension_names(self, model) -> dict:
+        return {row.id: row.name for row in model.select(model.id, model.name)}
+
+    def iter_rows(self, chunk_size: int = 10000, after_id: int = 0):
+        """
+        Read every raw result in id order, whatever the layout.
+
+        Args:
+            chunk_size (int): Rows read per query
+            after_id (int): Only read rows with a greater id
+
+        Yields:
+            list: Chunks of column values shaped like build_row, plus 'id'
+                  (raw output is returned as stored, in 'raw_output' and 'raw_output_z')
+        """
+        v2 = self.schema_version() == SCHEMA_V2
+        if v2:
+            Result = self.PingResultV2
+            names = [self._dimension_names(model) for model in (self.SiteName, self.ProtocolName, self.HostnameName)]
+        else:
+            Result = self.PingResult
+
+        last_id = after_id
+        while True:
+            rows = list(Result.select().where(Result.id > last_id).order_by(Result.id).limit(chunk_size).dicts())
+            if not rows:
+                return
+            if v2:
+                rows = [{
+                    "id": row["id"],
+                    "site": names[0][row["site_id"]],
+                    "protocol": names[1][row["protocol_id"]],
+                    "hostname": names[2][row["hostname_id"]],
+                    "success": row["success"],
+                    "response_time_ms": row["response_time_ms"],
+                    "error_message": row["error_message"],
+                    "timestamp": from_epoch_ms(row["timestamp_ms"]),
+                    "raw_output": "",
+                    "raw_output_z": row["raw_output_z"],
+                    "rtt_samples": row["rtt_samples"],
+                } for row in rows]
+            yield rows
+            last_id = rows[-1]["id"]
+
+    def update_rollups(self, rows: list):
+        """
+        Add rows to the minute, hour and day rollups.
+
+        Should run in the transaction inserting the rows, so the rollups never
+        disagree with the raw results.
+
+        Args:
+            rows (list): Column values as returned by build_row
+        """
+        self._merge_rollups(aggregate_rows(rows))
+
+    def _merge_rollups(self, buckets: dict):
+        """
+        Add aggregated buckets to the stored rollups.
+        """
+        if not buckets:
+            return
+
+        # Merge with the buckets already stored, one query per granularity
+        Rollup = self.PingRollup
+        for granularity in {key[0] for key in buckets}:
+            keys = [key for key in buckets if key[0] == granularity]
+            starts = list({key[1] for key in keys})
+            sites = list({key[2] for key in keys})
+            for batch in chunked(starts, INSERT_CHUNK_SIZE):
+                existing = Rollup.select().where(
+                    (Rollup.granularity == granularity)
+                    & (Rollup.bucket_start.in_(batch))
+                    & (Rollup.site.in_(sites))
+                )
+                for row in existing:
+                    key = (granularity, row.bucket_start, row.site, row.protocol, row.hostname)
+                    if key in buckets:
+                        buckets[key].merge(RollupBucket.from_row(row))
+
+        values = [bucket.to_row(key) for key, bucket in buckets.items()]
+        for batch in chunked(values, INSERT_CHUNK_SIZE):
+            Rollup.insert_many(batch).on_conflict_replace().execute()
+
+    def rebuild_rollups(self, chunk_size: int = 10000):
+        """
+        Recompute every rollup from the raw results, e.g. for a database created
+        before rollups existed. No results should be written meanwhile.
+
+        Args:
+            chunk_size (int): Raw rows processed per transaction
+        """
+        with self.db.atomic():
+            self.PingRollup.delete().execute()
+        for rows in self.iter_rows(chunk_size):
+            with self.db.atomic():
+                self.update_rollups(rows)
+
+    def _rollup_filter(self, site: str, protocol: str, hostname: str = None):
+        condition = (self.PingRollup.site == site) & (self.PingRollup.protocol == protocol)
+        if hostname:
+            condition &= self.PingRollup.hostname == hostname
+        return condition
+
+    def get_rollups(self, site: str, protocol: str, start: datetime, end: datetime,
+                    hostname: str = None, granularity: int = None, max_points: int = 1000):
+        """
+        Retrieve aggregated statistics over time, e.g. for a dashboard graph.
+
+        Args:
+            site (str): Site to query
+            protocol (str): Protocol to query
+            start (datetime): Beginning of the range
+            end (datetime): End of the range
+            hostname (str, optional): Only results of this monitoring host
+            granularity (int, optional): Bucket size in seconds, chosen from the range by default
+            max_points (int, optional): Maximum number of buckets when choosing the granularity
+
+        Returns:
+            list: (bucket start, summary dict) tuples in time order
+        """
+        if granularity is None:
+            granularity = choose_granularity(start, end, max_points)
+        Rollup = self.PingRollup
+        query = (Rollup.select()
+                 .where(self._rollup_filter(site, protocol, hostname)
+                        & (Rollup.granularity == granularity)
+                        & (Rollup.bucket_start >= start - timedelta(seconds=granularity))
+                        & (Rollup.bucket_start < end))
+                 .order_by(Rollup.bucket_start))
+
+        # Several monitoring hosts share a bucket unless one was selected
+        series = {}
+        for row in query:
+            bucket = series.get(row.bucket_start)
+            if bucket is None:
+                series[row.bucket_start] = RollupBucket.from_row(row)
+            else:
+                bucket.merge(RollupBucket.from_row(row))
+        return [(bucket_start, bucket.summary()) for bucket_start, bucket in series.items()]
+
+    def summarize(self, site: str, protocol: str, start: datetime, end: datetime, hostname: str = None) -> dict:
+        """
+        Aggregate statistics over a range from the coarsest rollups that cover it.
+
+        The range is rounded to whole minutes.
+
+        Args:
+            site (str): Site to query
+            protocol (str): Protocol to query
+            start (datetime): Beginning of the range
+            end (datetime): End of the range
+            hostname (str, optional): Only results of this monitoring host
+
+        Returns:
+            dict: Summary as returned by RollupBucket.summary
+        """
+        Rollup = self.PingRollup
+        total = RollupBucket()
+        for granularity, first, last in covering_buckets(start, end):
+            query = Rollup.select().where(
+                self._rollup_filter(site, protocol, hostname)
+                & (Rollup.granularity == granularity)
+                & (Rollup.bucket_start.between(first, last))
+            )
+            for row in query:
+                total.merge(RollupBucket.from_row(row))
+        return total.summary()
+
+    def read_columns(self, sites: list = None, start: datetime = None, end: datetime = None,
+                     chunk_size: int = 100000):
+        """
+        Read the columns of the raw results needed by reports, in bulk.
+
+        Rows are returned as plain tuples straight from the SQLite cursor, with
+        the dimensions as integer ids, so they can be loaded into arrays without
+        building a model object per row.
+
+        Args:
+            sites (list, optional): Only results of these sites
+            start (datetime, optional): Only results from this time
+            end (datetime, optional): Only results before this time
+            chunk_size (int): Rows fetched at a time
+
+        Returns:
+            tuple: (names, chunks) where names holds the {id: name} dicts of the sites,
+                   protocols and hostnames and chunks yields lists of (site id, protocol id,
+                   hostname id, epoch ms, success, response ms or -1) tuples. With the v1
+                   layout the names are interned while reading, so the dicts are only
+                   complete once every chunk was read.
+        """
+        if self.schema_version() == SCHEMA_V2:
+            names = tuple(self._dimension_names(model) for model in (self.SiteName, self.ProtocolName,
+                                                                     self.HostnameName))
+            ids = {name: id for id, name in names[0].items()}
+            site_keys = None if sites is None else [ids[site] for site in sites if site in ids]
+            columns = "site_id, protocol_id, hostname_id, timestamp_ms"
+            table, site_column, time_column = "pingresult_v2", "site_id", "timestamp_ms"
+            bounds = [None if bound is None else to_epoch_ms(bound) for bound in (start, end)]
+        else:
+            names = ({}, {}, {})
+            site_keys = sites
+            # Naive local datetimes stored as text, converted to epoch ms like to_epoch_ms
+            columns = ("site, protocol, hostname, "
+                       "CAST(ROUND((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER)")
+            table, site_column, time_column = "pingresult", "site", "timestamp"
+            bounds = [None if bound is None else str(bound) for bound in (start, end)]
+
+        sql = f"SELECT {columns}, success, IFNULL(response_time_ms, -1) FROM {table} WHERE 1"
+        params = []
+        for operator, bound in zip((">=", "<"), bounds):
+            if bound is not None:
+                sql += f" AND {time_column} {operator} ?"
+                params.append(bound)
+
+        interned = ({}, {}, {})  # v1 layout: {name: id} of each dimension, numbered in order of appearance
+
+        def intern(dimension: int, name: str) -> int:
+            id = interned[dimension].get(name)
+            if id is None:
+                id = interned[dimension][name] = len(interned[dimension]) + 1
+                names[dimension][id] = name
+            return id
+
+        def chunks():
+            for batch in ([None] if site_keys is None else chunked(site_keys, INSERT_CHUNK_SIZE)):
+                query, values = sql, params
+                if batch is not None:
+                    query += f" AND {site_column} IN ({', '.join('?' * len(batch))})"
+                    values = params + list(batch)
+                cursor = self.db.execute_sql(query, values)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    if table == "pingresult":
+                        rows = [(intern(0, row[0]), intern(1, row[1]), intern(2, row[2])) + row[3:] for row in rows]
+                    yield rows
+
+        return names, chunks()
+
+    def storage_size(self) -> int:
+        """
+        Size in bytes of the database file and its write-ahead log.
+        """
+        return sum(
+            os.path.getsize(path)
+            for path in (self.database_path, self.database_path + "-wal", self.database_path + "-shm")
+            if os.path.exists(path)
+        )
+
+    def prune(self, older_than: datetime, site: str = None, batch_size: int = 5000,
+              vacuum_pages: int = 1000) -> int:
+        """
+        Delete raw results older than a date, keeping the rollups.
+
+        Rows are deleted in short transactions so writers are never blocked for
+        long, and the freed pages are returned to the filesystem incrementally.
+
+        Args:
+            older_than (datetime): Results before this time are deleted
+            site (str, optional): Only delete results of this site
+            batch_size (int, optional): Rows deleted per transaction
+            vacuum_pages (int, optional): Pages released after each batch
+
+        Returns:
+            int: Number of rows deleted
+        """
+        if self.schema_version() == SCHEMA_V2:
+            Result = self.PingResultV2
+            condition = Result.timestamp_ms < to_epoch_ms(older_than)
+            if site:
+                condition &= Result.site_id == self._lookup_id(self.SiteName, site)
+        else:
+            Result = self.PingResult
+            condition = Result.timestamp < older_than
+            if site:
+                condition &= Result.site == site
+
+        deleted = 0
+        while True:
+            batch = Result.select(Result.id).where(condition).order_by(Result.id).limit(batch_size)
+            with self.db.atomic():
+                count = Result.delete().where(Result.id.in_(batch)).execute()
+            if vacuum_pages:
+                self.db.execute_sql(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    def compress_raw_output(self, site: str = None, raw_output: str = RAW_OUTPUT_ALL,
+                            batch_size: int = 5000) -> int:
+        """
+        Compress the raw output of rows stored before compression existed,
+        dropping it where the raw output mode does not keep it.
+
+        Args:
+            site (str, optional): Only rewrite results of this site
+            raw_output (str, optional): Raw output kept: all, failures or none
+            batch_size (int, optional): Rows rewritten per transaction
+
+        Returns:
+            int: Number of rows rewritten
+        """
+        v2 = self.schema_version() == SCHEMA_V2
+        Result = self.PingResultV2 if v2 else self.PingResult
+        # Compressed output the mode no longer keeps
+        condition = None
+        if raw_output == RAW_OUTPUT_NONE:
+            condition = Result.raw_output_z.is_null(False)
+        elif raw_output == RAW_OUTPUT_FAILURES:
+            condition = Result.raw_output_z.is_null(False) & (Result.success == True)  # noqa: E712
+        # and output stored uncompressed, which only exists in the v1 layout
+        if not v2:
+            uncompressed = Result.raw_output != ""
+            condition = uncompressed if condition is None else condition | uncompressed
+        if condition is None:
+            return 0
+        if site:
+            condition &= (Result.site_id == self._lookup_id(self.SiteName, site)) if v2 else (Result.site == site)
+
+        rewritten = 0
+        last_id = 0
+        while True:
+            rows = list(Result.select()
+                        .where(condition & (Result.id > last_id))
+                        .order_by(Result.id)
+                        .limit(batch_size))
+            if not rows:
+                return rewritten
+            with self.db.atomic():
+                for row in rows:
+                    keep = raw_output == RAW_OUTPUT_ALL or (raw_output == RAW_OUTPUT_FAILURES and not row.success)
+                    if v2:
+                        # v2 output is always compressed, only dropping is left
+                        Result.update({Result.raw_output_z: None}).where(Result.id == row.id).execute()
+                        continue
+                    compressed = zlib.compress(row.raw_output.encode("utf-8")) if keep and row.raw_output else None
+                    Result.update({Result.raw_output: "", Result.raw_output_z: compressed}).where(
+                        Result.id == row.id
+                    ).execute()
+            rewritten += len(rows)
+            last_id = rows[-1].id
+
+    def vacuum(self):
+        """
+        Rebuild the file to release all free space and enable incremental vacuum.
+        """
+        self.db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.execute_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        self.db.execute_sql("VACUUM")
+        self.db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
     def get_ping_history(self, site: str = None, protocol: str = None, limit: int = 100):
         """
         Retrieve ping history from the database.
@@ -92,6 +876,9 @@ class PingMonitorDB:
         Returns:
             list: List of PingResult objects
         """
+        if self.schema_version() == SCHEMA_V2:
+            return self._get_ping_history_v2(site, protocol, limit)
+
         query = self.PingResult.select()
 
         if site:
@@ -100,3 +887,231 @@ class PingMonitorDB:
             query = query.where(self.PingResult.protocol == protocol)
 
         return query.order_by(self.PingResult.timestamp.desc()).limit(limit)
+
+    def _get_ping_history_v2(self, site: str = None, protocol: str = None, limit: int = 100):
+        Result = self.PingResultV2
+        Site, Protocol, Hostname = self.SiteName, self.ProtocolName, self.HostnameName
+        query = (Result
+                 .select(Result, Site.name.alias("site"), Protocol.name.alias("protocol"),
+                         Hostname.name.alias("hostname"))
+                 .join(Site, on=(Result.site_id == Site.id))
+                 .switch(Result)
+                 .join(Protocol, on=(Result.protocol_id == Protocol.id))
+                 .switch(Result)
+                 .join(Hostname, on=(Result.hostname_id == Hostname.id)))
+
+        # Filter on the ids so the narrow (site_id, protocol_id, timestamp_ms) index is used
+        if site:
+            query = query.where(Result.site_id == self._lookup_id(Site, site))
+        if protocol:
+            query = query.where(Result.protocol_id == self._lookup_id(Protocol, protocol))
+
+        return query.order_by(Result.timestamp_ms.desc()).limit(limit).objects()
+
+    def get_site_state(self, site: str, protocol: str) -> SiteState:
+        """
+        Return the alerting state of a site, a fresh one if it was never stored.
+        """
+        row = self.AlertState.get_or_none(
+            (self.AlertState.site == site) & (self.AlertState.protocol == protocol)
+        )
+        if row is None:
+            return SiteState()
+        return SiteState(**{name: getattr(row, name) for name in SiteState.__slots__})
+
+    def save_site_state(self, site: str, protocol: str, state: SiteState):
+        """
+        Store the alerting state of a site.
+        """
+        self.AlertState.insert(site=site, protocol=protocol, **state.to_row()).on_conflict_replace().execute()
+
+    def get_latency_state(self, site: str, protocol: str) -> LatencyState:
+        """
+        Return the latency baseline of a site, a fresh one if it was never stored.
+        """
+        row = self.LatencyBaseline.get_or_none(
+            (self.LatencyBaseline.site == site) & (self.LatencyBaseline.protocol == protocol)
+        )
+        if row is None:
+            return LatencyState()
+        return LatencyState(**{name: getattr(row, name) for name in LatencyState.__slots__})
+
+    def save_latency_state(self, site: str, protocol: str, state: LatencyState):
+        """
+        Store the latency baseline of a site.
+        """
+        self.LatencyBaseline.insert(site=site, protocol=protocol, **state.to_row()).on_conflict_replace().execute()
+
+    def load_states(self):
+        """
+        Return the alerting state and latency baseline of every site, one query per table.
+
+        Returns:
+            tuple: ({(site, protocol): SiteState}, {(site, protocol): LatencyState})
+        """
+        site_states = {
+            (row.site, row.protocol): SiteState(**{name: getattr(row, name) for name in SiteState.__slots__})
+            for row in self.AlertState.select()
+        }
+        latency_states = {
+            (row.site, row.protocol): LatencyState(**{name: getattr(row, name) for name in LatencyState.__slots__})
+            for row in self.LatencyBaseline.select()
+        }
+        return site_states, latency_states
+
+    def save_states(self, site_states: dict, latency_states: dict):
+        """
+        Store alerting states and latency baselines in one transaction.
+
+        Args:
+            site_states (dict): SiteState.to_row values by (site, protocol)
+            latency_states (dict): LatencyState.to_row values by (site, protocol)
+
+        Raises:
+            peewee.PeeweeException: If the transaction fails, no state is stored
+        """
+        with self.db.atomic():
+            for model, states in ((self.AlertState, site_states), (self.LatencyBaseline, latency_states)):
+                rows = [dict(row, site=site, protocol=protocol) for (site, protocol), row in states.items()]
+                # State rows are wider than result rows, fewer of them fit in one statement
+                for chunk in chunked(rows, INSERT_CHUNK_SIZE // 2):
+                    model.insert_many(chunk).on_conflict_replace().execute()
+
+    def outage_start(self, site: str, protocol: str, down_since: float) -> float:
+        """
+        Find when an outage really began from the raw results.
+
+        A site is only DOWN after several failures, and isolated successes may
+        have interrupted them; the outage starts at the first failure after the
+        last success preceding the failure that made the site DOWN.
+
+        Args:
+            site (str): The site that was pinged
+            protocol (str): The protocol used
+            down_since (float): Epoch seconds of the failure that started the DOWN streak
+
+        Returns:
+            float: Epoch seconds of the first failure of the outage, down_since if
+                   the results were pruned
+        """
+        if self.schema_version() == SCHEMA_V2:
+            Result = self.PingResultV2
+            site_id = self._lookup_id(self.SiteName, site)
+            protocol_id = self._lookup_id(self.ProtocolName, protocol)
+            if site_id is None or protocol_id is None:
+                return down_since
+            scope = (Result.site_id == site_id) & (Result.protocol_id == protocol_id)
+            column, limit = Result.timestamp_ms, int(round(down_since * 1000))
+        else:
+            Result = self.PingResult
+            scope = (Result.site == site) & (Result.protocol == protocol)
+            column, limit = Result.timestamp, datetime.fromtimestamp(down_since)
+
+        last_success = (Result.select(fn.MAX(column))
+                        .where(scope & (Result.success == True) & (column < limit))  # noqa: E712
+                        .scalar())
+        condition = scope & (Result.success == False) & (column <= limit)  # noqa: E712
+        if last_success is not None:
+            condition &= column > last_success
+        first_failure = Result.select(fn.MIN(column)).where(condition).scalar()
+        if first_failure is None:
+            return down_since
+        if isinstance(first_failure, datetime):
+            return min(first_failure.timestamp(), down_since)
+        if isinstance(first_failure, str):
+            # Raw aggregates on the legacy table come back as text
+            return min(datetime.fromisoformat(first_failure).timestamp(), down_since)
+        return min(first_failure / 1000, down_since)
+
+    def migrate_to_v2(self, chunk_size: int = 10000, pause: float = 0.05, keep_legacy: bool = False,
+                      progress=None) -> int:
+        """
+        Convert a v1 database to the v2 layout while it stays in use.
+
+        Rows are copied in short transactions, resuming where a previous run
+        stopped, with a pause between chunks so writers are not starved. Writers
+        keep appending to the v1 table meanwhile; the last rows are copied and
+        the layout switched in one final transaction.
+
+        Args:
+            chunk_size (int): Rows copied per transaction
+            pause (float): Seconds slept between two chunks
+            keep_legacy (bool): Keep the v1 table renamed as pingresult_v1 instead of dropping it
+            progress (callable, optional): Called with the number of rows copied so far
+
+        Returns:
+            int: Number of rows copied
+        """
+        if self.schema_version() == SCHEMA_V2:
+            return 0
+
+        self.db.create_tables(self._v2_models(), safe=True)
+        self._unique_dimensions()
+        # A table left by an interrupted run may predate the samples column
+        if "rtt_samples" not in {column.name for column in self.db.get_columns("pingresult_v2")}:
+            self.db.execute_sql("ALTER TABLE pingresult_v2 ADD COLUMN rtt_samples BLOB")
+        # Resume after the rows copied by an interrupted run
+        last_id = self.PingResultV2.select(fn.MAX(self.PingResultV2.id)).scalar() or 0
+        copied = 0
+
+        while True:
+            rows, last_id = self._copy_to_v2(last_id, chunk_size)
+            copied += rows
+            if progress:
+                progress(copied)
+            if rows < chunk_size:
+                break
+            time.sleep(pause)
+
+        # Take the write lock so no v1 row can be added between the last copy and the switch
+        with self.db.atomic(lock_type="IMMEDIATE"):
+            while True:
+                rows, last_id = self._copy_to_v2(last_id, chunk_size, transaction=False)
+                copied += rows
+                if rows < chunk_size:
+                    break
+            if keep_legacy:
+                self.db.execute_sql("ALTER TABLE pingresult RENAME TO pingresult_v1")
+            else:
+                self.db.execute_sql("DROP TABLE pingresult")
+            self.db.execute_sql(f"PRAGMA user_version = {SCHEMA_V2}")
+        return copied
+
+    def _copy_to_v2(self, after_id: int, chunk_size: int, transaction: bool = True) -> int:
+        """
+        Copy the next v1 rows to the v2 table, keeping their ids.
+
+        Returns:
+            tuple: (number of rows copied, id of the last row copied)
+        """
+        Legacy = self.PingResult
+        rows = list(Legacy.select().where(Legacy.id > after_id).order_by(Legacy.id).limit(chunk_size).dicts())
+        if not rows:
+            return 0, after_id
+
+        for row in rows:
+            if row["raw_output"] and row.get("raw_output_z") is None:
+                row["raw_output_z"] = zlib.compress(row["raw_output"].encode("utf-8"))
+
+        def copy():
+            site_ids = self._intern(self.SiteName, [row["site"] for row in rows])
+            protocol_ids = self._intern(self.ProtocolName, [row["protocol"] for row in rows])
+            hostname_ids = self._intern(self.HostnameName, [row["hostname"] for row in rows])
+            values = []
+            for row in rows:
+                value = self._v2_row(row, site_ids, protocol_ids, hostname_ids)
+                value["id"] = row["id"]
+                values.append(value)
+            for batch in chunked(values, INSERT_CHUNK_SIZE):
+                self.PingResultV2.insert_many(batch).execute()
+
+        try:
+            if transaction:
+                with self.db.atomic():
+                    copy()
+            else:
+                copy()
+        except Exception:
+            self._dimension_ids.clear()
+            raise
+        return len(rows), rows[-1]["id"]
@@ -0,0 +1,273 @@
+import math
+import struct
+from datetime import datetime, timedelta
+
+# Rollup granularities in seconds
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+GRANULARITIES = (MINUTE, HOUR, DAY)
+
+# Latency histogram: bucket 0 holds values under 1 ms, bucket i holds [g^(i-1), g^i) ms
+# and the last one everything above, so percentiles are within about 10% of the real value
+HISTOGRAM_GROWTH = 1.2
+HISTOGRAM_BUCKETS = 64
+_HISTOGRAM_FORMAT = f"<{HISTOGRAM_BUCKETS}I"
+_LOG_GROWTH = math.log(HISTOGRAM_GROWTH)
+
+
+def bucket_start(timestamp: datetime, granularity: int) -> datetime:
+    """
+    Truncate a timestamp to the start of its rollup bucket.
+
+    Args:
+        timestamp (datetime): Time of a ping
+        granularity (int): Bucket size in seconds (MINUTE, HOUR or DAY)
+
+    Returns:
+        datetime: Start of the bucket
+    """
+    if granularity == DAY:
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def histogram_index(latency_ms: float) -> int:
+    """Return the histogram bucket of a latency in milliseconds."""
+    if latency_ms < 1:
+        return 0
+    return min(int(math.log(latency_ms) / _LOG_GROWTH) + 1, HISTOGRAM_BUCKETS - 1)
+
+
+class RollupBucket:
+    """
+    Aggregated ping results of one site/protocol/hostname over one time bucket.
+    """
+    __slots__ = ("samples", "failures", "latency_count", "latency_sum", "latency_min", "latency_max", "histogram")
+
+    def __init__(self):
+        self.samples = 0
+        self.failures = 0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, success: bool, latency_ms: float = None) -> None:
+        """
+        Account for one ping result.
+
+        Args:
+            success (bool): Whether the ping was successful
+            latency_ms (float, optional): Response time in milliseconds
+        """
+        self.samples += 1
+        if not success:
+            self.failures += 1
+        if latency_ms is None:
+            return
+        self.latency_count += 1
+        self.latency_sum += latency_ms
+        self.latency_min = latency_ms if self.latency_min is None else min(self.latency_min, latency_ms)
+        self.latency_max = latency_ms if self.latency_max is None else max(self.latency_max, latency_ms)
+        self.histogram[histogram_index(latency_ms)] += 1
+
+    def merge(self, other: "RollupBucket") -> None:
+        """
+        Add the results aggregated in another bucket.
+        """
+        self.samples += other.samples
+        self.failures += other.failures
+        self.latency_count += other.latency_count
+        self.latency_sum += other.latency_sum
+        for attribute, pick in (("latency_min", min), ("latency_max", max)):
+            mine, theirs = getattr(self, attribute), getattr(other, attribute)
+            setattr(self, attribute, theirs if mine is None else mine if theirs is None else pick(mine, theirs))
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def percentile(self, q: float):
+        """
+        Estimate a latency percentile from the histogram.
+
+        Args:
+            q (float): Percentile between 0 and 100
+
+        Returns:
+            float: Estimated latency in milliseconds, None without latency samples
+        """
+        if not self.latency_count:
+            return None
+        rank = max(1, math.ceil(q / 100 * self.latency_count))
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank:
+                break
+        if index == 0:
+            estimate = 0.5
+        else:
+            # Geometric middle of the bucket bounds
+            estimate = HISTOGRAM_GROWTH ** (index - 0.5)
+        return min(max(estimate, self.latency_min), self.latency_max)
+
+    def summary(self) -> dict:
+        """
+        Describe the bucket with uptime and latency statistics.
+
+        Returns:
+            dict: samples, failures, uptime (%), min, max, mean, p50, p95 and p99 in ms
+        """
+        return {
+            "samples": self.samples,
+            "failures": self.failures,
+            "uptime": round(100.0 * (self.samples - self.failures) / self.samples, 4) if self.samples else None,
+            "min": self.latency_min,
+            "max": self.latency_max,
+            "mean": self.latency_sum / self.latency_count if self.latency_count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+    def pack_histogram(self) -> bytes:
+        return struct.pack(_HISTOGRAM_FORMAT, *self.histogram)
+
+    @classmethod
+    def from_row(cls, row) -> "RollupBucket":
+        """
+        Load a bucket from a PingRollup row.
+        """
+        bucket = cls()
+        bucket.samples = row.samples
+        bucket.failures = row.failures
+        bucket.latency_count = row.latency_count
+        bucket.latency_sum = row.latency_sum
+        bucket.latency_min = row.latency_min
+        bucket.latency_max = row.latency_max
+        bucket.histogram = list(struct.unpack(_HISTOGRAM_FORMAT, bytes(row.histogram)))
+        return bucket
+
+    def to_row(self, key: tuple) -> dict:
+        """
+        Column values of the PingRollup row for a (granularity, bucket_start, site, protocol, hostname) key.
+        """
+        granularity, start, site, protocol, hostname = key
+        return {
+            "granularity": granularity,
+            "bucket_start": start,
+            "site": site,
+            "protocol": protocol,
+            "hostname": hostname,
+            "samples": self.samples,
+            "failures": self.failures,
+            "latency_count": self.latency_count,
+            "latency_sum": self.latency_sum,
+            "latency_min": self.latency_min,
+            "latency_max": self.latency_max,
+            "histogram": self.pack_histogram(),
+        }
+
+
+def aggregate_columns(timestamps, sites, protocols, hostnames, successes, latencies) -> dict:
+    """
+    Aggregate ping results given column by column into rollup buckets of every granularity.
+
+    Args:
+        timestamps (list): Naive local datetimes of the pings
+        sites (list): Sites pinged
+        protocols (list): Protocols used
+        hostnames (list): Monitoring hosts
+        successes (list): Whether each ping was successful
+        latencies (list): Response times in milliseconds, None without an answer
+
+    Returns:
+        dict: RollupBucket per (granularity, bucket_start, site, protocol, hostname)
+    """
+    buckets = {}
+    for timestamp, site, protocol, hostname, success, latency in zip(
+            timestamps, sites, protocols, hostnames, successes, latencies):
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(timestamp, granularity), site, protocol, hostname)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = RollupBucket()
+            bucket.add(success, latency)
+    return buckets
+
+
+def aggregate_rows(rows) -> dict:
+    """
+    Aggregate PingResult column values into rollup buckets of every granularity.
+
+    Args:
+        rows (iterable): Column values as returned by PingMonitorDB.build_row
+
+    Returns:
+        dict: RollupBucket per (granularity, bucket_start, site, protocol, hostname)
+    """
+    rows = list(rows)
+    return aggregate_columns(
+        [row["timestamp"] for row in rows], [row["site"] for row in rows], [row["protocol"] for row in rows],
+        [row["hostname"] for row in rows], [row["success"] for row in rows],
+        [row["response_time_ms"] for row in rows],
+    )
+
+
+def choose_granularity(start: datetime, end: datetime, max_points: int = 1000) -> int:
+    """
+    Pick the finest granularity whose buckets over the range fit in max_points.
+
+    Args:
+        start (datetime): Beginning of the range
+        end (datetime): End of the range
+        max_points (int): Maximum number of buckets wanted
+
+    Returns:
+        int: Granularity in seconds, DAY when even days do not fit
+    """
+    span = (end - start).total_seconds()
+    for granularity in GRANULARITIES:
+        if span / granularity <= max_points:
+            return granularity
+    return DAY
+
+
+def covering_buckets(start: datetime, end: datetime) -> list:
+    """
+    Split a range into the coarsest whole buckets it contains.
+
+    Whole days are used where possible, whole hours at the edges and whole
+    minutes for what is left, so summarizing months reads a few hundred rows.
+
+    Args:
+        start (datetime): Beginning of the range (inclusive)
+        end (datetime): End of the range (exclusive)
+
+    Returns:
+        list: (granularity, first bucket start, last bucket start) tuples
+    """
+    def ceil(timestamp, granularity):
+        floor = bucket_start(timestamp, granularity)
+        return floor if floor == timestamp else floor + timedelta(seconds=granularity)
+
+    start = ceil(start, MINUTE)
+    end = bucket_start(end, MINUTE)
+    if start >= end:
+        return []
+
+    coarse = {}
+    for granularity in (DAY, HOUR):
+        first, last = ceil(start, granularity), bucket_start(end, granularity)
+        if first < last:
+            coarse = {"granularity": granularity, "first": first, "last": last}
+            break
+    if not coarse:
+        return [(MINUTE, start, end - timedelta(seconds=MINUTE))]
+
+    step = timedelta(seconds=coarse["granularity"])
+    parts = [(coarse["granularity"], coarse["first"], coarse["last"] - step)]
+    parts = covering_buckets(start, coarse["first"]) + parts + covering_buckets(coarse["last"], end)
+    return parts
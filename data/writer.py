@@ -0,0 +1,369 @@
+import atexit
+import os
+import threading
+import time
+from typing import Dict
+
+from peewee import DataError, IntegrityError, InterfaceError
+
+from core.alerts import SiteState
+from core.anomaly import LatencyState
+from core.metrics import DB_FLUSH_DURATION, DB_FLUSH_ERRORS, DB_FLUSH_ROWS, DB_PENDING, DB_ROWS_DROPPED
+from core.result import ProbeBatch, ProbeResult
+from data.models.db import RAW_OUTPUT_ALL, PingMonitorDB, keep_raw_output
+
+# Errors caused by the values of a result rather than by the database itself
+ROW_ERRORS = (IntegrityError, DataError, InterfaceError, ValueError, TypeError, OverflowError)
+
+
+class BatchWriter:
+    def __init__(self, db: PingMonitorDB, max_batch: int = 500, max_delay: float = 1.0,
+                 max_pending: int = 100000, max_attempts: int = 3):
+        """
+        Buffer ping results and write them in multi-row transactions.
+
+        A single background thread owns the writes, so each database file is
+        written through one long-lived connection. The alerting states and
+        latency baselines of the sites are kept in memory, read once per
+        process and written back with the results.
+
+        A batch the database rejects is split in halves until the offending
+        results are isolated; the others are written and each rejected result
+        is retried alone on the next flushes, then dropped.
+
+        Args:
+            db (PingMonitorDB): Database the results are written to
+            max_batch (int): Flush as soon as this many results are buffered
+            max_delay (float): Flush buffered results at least every this many seconds
+            max_pending (int): Results kept in memory while the database is failing
+            max_attempts (int): Writes of a rejected result before it is dropped
+        """
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.last_flush_size = 0
+        self.last_flush_seconds = None
+        self._pending = ProbeBatch()
+        self._rejected = []  # [(single result ProbeBatch, failed writes)] retried alone
+        self._site_states = None  # {(site, protocol): SiteState}, read on first use
+        self._latency_states = None  # {(site, protocol): LatencyState}
+        self._dirty_sites = {}  # (site, protocol) -> SiteState.to_row waiting to be written
+        self._dirty_latency = {}  # (site, protocol) -> LatencyState.to_row
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="pingmonitor-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, site: str, protocol: str, result: ProbeResult, raw_output: str = RAW_OUTPUT_ALL) -> None:
+        """
+        Queue a ping result.
+
+        Args:
+            site (str): The hostname or IP that was pinged
+            protocol (str): The protocol used for the ping
+            result (ProbeResult): The result of the ping operation
+            raw_output (str, optional): Raw output kept: all, failures or none
+        """
+        keep = keep_raw_output(raw_output, result.success)
+        with self._condition:
+            self._pending.append(site, protocol, result, keep)
+            if len(self._pending) >= self.max_batch:
+                self._condition.notify()
+
+    def _load_states(self) -> None:
+        """Read every stored state at once, called with the condition held."""
+        if self._site_states is None:
+            # Called from the check threads, which must not each keep a connection
+            with self.db.short_connection():
+                self._site_states, self._latency_states = self.db.load_states()
+
+    def get_site_state(self, site: str, protocol: str) -> SiteState:
+        """
+        Return the alerting state of a site, updated in place by the caller.
+        """
+        with self._condition:
+            self._load_states()
+            return self._site_states.setdefault((site, protocol), SiteState())
+
+    def save_site_state(self, site: str, protocol: str, state: SiteState) -> None:
+        """
+        Write the alerting state of a site with the next flush.
+        """
+        with self._condition:
+            self._dirty_sites[(site, protocol)] = state.to_row()
+
+    def get_latency_state(self, site: str, protocol: str) -> LatencyState:
+        """
+        Return the latency baseline of a site, updated in place by the caller.
+        """
+        with self._condition:
+            self._load_states()
+            return self._latency_states.setdefault((site, protocol), LatencyState())
+
+    def save_latency_state(self, site: str, protocol: str, state: LatencyState) -> None:
+        """
+        Write the latency baseline of a site with the next flush.
+        """
+        with self._condition:
+            self._dirty_latency[(site, protocol)] = state.to_row()
+
+    def forget_state(self, site: str, protocol: str) -> None:
+        """
+        Drop the states of a site from memory, they are read again on next use.
+        """
+        with self._condition:
+            if self._site_states is not None:
+                self._site_states.pop((site, protocol), None)
+                self._latency_states.pop((site, protocol), None)
+
+    def outage_start(self, site: str, protocol: str, down_since: float) -> float:
+        """
+        Find when an outage began, see PingMonitorDB.outage_start, without forcing a flush.
+
+        Buffered results were all fed to the state machine of their site: once
+        one of them is a success preceding down_since, no stored result can
+        belong to the outage.
+        """
+        with self._flush_lock:
+            with self._condition:
+                pending = self._pending
+                recovered = any(
+                    pending.success[index] and pending.timestamp[index] < down_since
+                    and pending.site[index] == site and pending.protocol[index] == protocol
+                    for index in range(len(pending))
+                )
+            if recovered:
+                return down_since
+            with self.db.short_connection():
+                return self.db.outage_start(site, protocol, down_since)
+
+    @property
+    def pending(self) -> int:
+        """Number of results waiting to be written."""
+        return len(self._pending)
+
+    def flush(self) -> int:
+        """
+        Write every buffered result and changed state now.
+
+        Returns:
+            int: Number of rows written
+        """
+        with self._flush_lock:
+            with self._condition:
+                rows, self._pending = self._pending, ProbeBatch()
+                site_states, self._dirty_sites = self._dirty_sites, {}
+                latency_states, self._dirty_latency = self._dirty_latency, {}
+                rejected, self._rejected = self._rejected, []
+
+            started = time.perf_counter()
+            written = 0
+            failed = False  # The database itself failed, not some of the results
+            for index, (row, attempts) in enumerate(rejected):
+                try:
+                    self.db.insert_batch(row)
+                    written += 1
+                except ROW_ERRORS as e:
+                    self._reject(row, attempts + 1, e)
+                except Exception as e:
+                    # The database itself is failing, this write does not count
+                    print(f"Error storing {len(rejected) - index} rejected ping results: {e}")
+                    DB_FLUSH_ERRORS.inc()
+                    with self._condition:
+                        self._rejected.extend(rejected[index:])
+                    failed = True
+                    break
+
+            if len(rows) and failed:
+                self._keep(rows)
+            elif len(rows):
+                try:
+                    self.db.insert_batch(rows)
+                    written += len(rows)
+                except ROW_ERRORS as e:
+                    print(f"Error storing {len(rows)} ping results, isolating the rejected ones: {e}")
+                    DB_FLUSH_ERRORS.inc()
+                    split_written, unwritten = self._insert_split(rows, e)
+                    written += split_written
+                    if len(unwritten):
+                        self._keep(unwritten)
+                        failed = True
+                except Exception as e:
+                    print(f"Error storing {len(rows)} ping results: {e}")
+                    DB_FLUSH_ERRORS.inc()
+                    self._keep(rows)
+                    failed = True
+
+            if written:
+                self.flushes += 1
+                self.rows_written += written
+                self.last_flush_size = written
+                self.last_flush_seconds = time.perf_counter() - started
+                DB_FLUSH_DURATION.observe(self.last_flush_seconds)
+                DB_FLUSH_ROWS.observe(written)
+            if failed:
+                self._keep_states(site_states, latency_states)
+                return written
+
+            # After the results, so a failure here never writes them twice
+            if site_states or latency_states:
+                try:
+                    self.db.save_states(site_states, latency_states)
+                except Exception as e:
+                    print(f"Error storing the state of {len(site_states) + len(latency_states)} sites: {e}")
+                    DB_FLUSH_ERRORS.inc()
+                    self._keep_states(site_states, latency_states)
+            return written
+
+    def _insert_split(self, rows: ProbeBatch, error: Exception) -> tuple:
+        """
+        Write a batch the database rejected by halves, down to single results.
+
+        Results still rejected alone are queued for retry, see _reject. Once the
+        database itself fails, the remaining halves are not tried.
+
+        Args:
+            rows (ProbeBatch): The rejected batch
+            error (Exception): Why it was rejected
+
+        Returns:
+            tuple: (rows written, ProbeBatch of the results left unwritten)
+        """
+        if len(rows) == 1:
+            self._reject(rows, 1, error)
+            return 0, ProbeBatch()
+        written, unwritten = 0, ProbeBatch()
+        middle = len(rows) // 2
+        for half in (rows.slice(0, middle), rows.slice(middle, len(rows))):
+            if len(unwritten):
+                unwritten.extend(half)
+                continue
+            try:
+                self.db.insert_batch(half)
+                written += len(half)
+            except ROW_ERRORS as e:
+                half_written, half_unwritten = self._insert_split(half, e)
+                written += half_written
+                unwritten.extend(half_unwritten)
+            except Exception:
+                unwritten.extend(half)
+        return written, unwritten
+
+    def _reject(self, row: ProbeBatch, attempts: int, error: Exception) -> None:
+        """Queue a result the database rejected for another write, or drop it after max_attempts."""
+        if attempts < self.max_attempts:
+            with self._condition:
+                self._rejected.append((row, attempts))
+            return
+        print(f"Dropping the result of {row.site[0]} ({row.protocol[0]}) after {attempts} failed writes: {error}")
+        self.rows_dropped += 1
+        DB_ROWS_DROPPED.inc()
+
+    def _keep(self, rows: ProbeBatch) -> None:
+        """Put results back for the next flush, oldest first, within the memory limit."""
+        with self._condition:
+            rows.extend(self._pending)
+            self._pending = rows
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                self._pending.truncate(overflow)
+                self.rows_dropped += overflow
+                DB_ROWS_DROPPED.inc(amount=overflow)
+
+    def _keep_states(self, site_states: dict, latency_states: dict) -> None:
+        """Queue states that failed to be written again, unless newer ones were saved since."""
+        with self._condition:
+            site_states.update(self._dirty_sites)
+            latency_states.update(self._dirty_latency)
+            self._dirty_sites, self._dirty_latency = site_states, latency_states
+
+    def _run(self) -> None:
+        failed = False
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.max_delay
+                # After a failed flush wait the full delay even if the buffer is full
+                while not self._closing and (failed or len(self._pending) < self.max_batch):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                closing = self._closing
+            failed = self.flush() == 0 and self.pending > 0
+            if closing:
+                break
+        # Release the connection this thread opened
+        self.db.close()
+
+    def close(self) -> None:
+        """
+        Flush what is left and stop the writer thread.
+        """
+        with self._condition:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+
+
+_writers: Dict[str, BatchWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database_path: str) -> BatchWriter:
+    """
+    Return the writer shared by the whole process for a database file.
+
+    Args:
+        database_path (str): Path to the SQLite database file
+
+    Returns:
+        BatchWriter: Running writer for the file
+    """
+    key = os.path.abspath(database_path)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = BatchWriter(PingMonitorDB.open(database_path))
+        return _writers[key]
+
+
+def forget_state(database_path: str, site: str, protocol: str) -> None:
+    """
+    Drop the states of a site kept by the writer of a database file, if it has one.
+
+    Args:
+        database_path (str): Path to the SQLite database file
+        site (str): The site, as stored
+        protocol (str): Its protocol
+    """
+    with _writers_lock:
+        writer = _writers.get(os.path.abspath(database_path))
+    if writer is not None:
+        writer.forget_state(site, protocol)
+
+
+def close_writers() -> None:
+    """
+    Flush and stop every writer, called on shutdown.
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+def _pending_rows() -> dict:
+    with _writers_lock:
+        return {(key,): writer.pending for key, writer in _writers.items()}
+
+
+DB_PENDING.collect_with(_pending_rows)
+atexit.register(close_writers)
@@ -1,16 +1,28 @@
 #!/usr/bin/env python3
 
 import argparse
+import fnmatch
 import subprocess
 import sys
 import os
 import socket
-from typing import Optional
+import time
+from typing import Dict, List, Optional
+
+from core.metrics import StageTimer, observe_probe
+from core.profiling import PROFILE_MODES
+from core.protocols import UnknownProtocolError, protocols
+from core.registry import SiteConfig, SiteConfigError, SiteRegistry
+from core.result import ProbeResult
 
 
 class PingMonitor:
     def __init__(self):
         self.hostname = self._get_hostname()
+        self.registry = SiteRegistry("sites")
+        self.verbose = False  # Print every result and the time spent in each stage
+        self.result_sink = None  # Callable taking (site, result) instead of storing results here
+        self.cluster = None  # core.cluster.Cluster sharing the sites with other nodes, if any
 
     def _get_hostname(self) -> str:
         """Get hostname from config or system."""
@@ -35,162 +47,636 @@ class PingMonitor:
         except subprocess.CalledProcessError as e:
             print(f"Error executing script: {e}")
 
+    def _registry(self) -> SiteRegistry:
+        """Every site configuration, loaded on first use from the registry snapshot."""
+        if not self.registry.loaded:
+            self.registry.load()
+            for site, error in sorted(self.registry.errors.items()):
+                print(f"Skipping site '{site}': {error}")
+        return self.registry
+
+    def list_sites(self) -> List[str]:
+        """List the names of every valid site configured in the sites directory."""
+        return self._registry().names()
+
+    def load_site_config(self, site: str) -> Optional[SiteConfig]:
+        """
+        Return the configuration of a site.
+
+        Only that file is parsed unless the registry was already loaded, so a
+        single ping does not pay for reading every site.
+
+        Args:
+            site (str): Site name (configuration file at sites/<site>.conf)
+
+        Returns:
+            SiteConfig: The validated configuration, or None on error
+        """
+        try:
+            if self.registry.loaded:
+                return self.registry.get(site)
+            return self.registry.load_one(site)
+        except SiteConfigError as e:
+            print(f"Invalid configuration for site '{site}': {e}")
+            return None
+
     def check_site_config(self, site: str) -> None:
-        # Build the configuration file path
-        config_filename = f"{site}.conf"
-        config_path = os.path.join("sites", config_filename)
+        config = self.load_site_config(site)
+        if config is None:
+            return
+
+        print(f"The site '{site}' has a valid configuration.")
+        # Optionally: display the configuration
+        for key in ("site", "protocol", "storage"):
+            print(f"{key}: {getattr(config, key)}")
+
+    def select_sites(self, pattern: str = "*") -> List[str]:
+        """
+        Select configured sites whose name matches a shell-style pattern.
+
+        Args:
+            pattern (str): Pattern such as "prod-*"
+
+        Returns:
+            list: Matching site names, sorted
+        """
+        return [site for site in self.list_sites() if fnmatch.fnmatchcase(site, pattern)]
 
-        if not os.path.exists(config_path):
-            print(f"Configuration file '{config_path}' does not exist.")
+    def ping_sites(self, sites: List[str], concurrency: int = 64) -> None:
+        """
+        Ping several sites concurrently.
+
+        Every configuration is loaded up front, then the checks run with at most
+        `concurrency` of them in flight, so a sweep takes about as long as its
+        slowest probe instead of the sum of all of them.
+
+        Args:
+            sites (list): Site names to ping
+            concurrency (int): Maximum number of checks running at the same time
+        """
+        import asyncio
+        from core.scheduler import sweep
+
+        if self.cluster is not None:
+            # One heartbeat per run: the lease outlives the period until the next one, see main
+            try:
+                self.cluster.heartbeat()
+            except Exception as e:
+                print(f"Error joining the cluster: {e}")
+                return
+            selected = self.cluster.select(sites)
+            print(f"Node '{self.cluster.node}' owns {len(selected)} of {len(sites)} sites "
+                  f"({len(self.cluster.ring.nodes)} live nodes)")
+            sites = selected
+
+        started = time.perf_counter()
+        configs = {}
+        for site in sites:
+            config = self.load_site_config(site)
+            if config is not None:
+                configs[site] = config
+        if self.verbose:
+            print(f"Loaded {len(configs)} site configurations in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+        if not configs:
+            print("No site configurations found.")
+            return
+
+        # Protocols with a batch engine (ICMP over a single socket) probe all their
+        # sites at once, the sweep then only stores and reports
+        results = {}
+        batch_seconds = {}
+        by_protocol = {}
+        for site, config in configs.items():
+            by_protocol.setdefault(config.protocol, []).append(site)
+        for protocol, names in by_protocol.items():
+            try:
+                prober = protocols.get(protocol)
+            except ImportError as e:
+                print(f"Could not import module for protocol '{protocol}': {e}")
+                continue
+            if hasattr(prober, "ping_many"):
+                started = time.perf_counter()
+                try:
+                    replies = prober.ping_many([configs[name].options for name in names])
+                except Exception as e:
+                    # A failing batch engine fails its own sites, the other protocols are still probed
+                    print(f"Error probing {len(names)} '{protocol}' sites: {e}")
+                    replies = [ProbeResult.from_exception(e) for _ in names]
+                results.update(zip(names, replies))
+                batch_seconds.update(dict.fromkeys(names, time.perf_counter() - started))
+
+        asyncio.run(sweep(
+            lambda name: self.run_check(name, configs[name], result=results.get(name),
+                                        probe_seconds=batch_seconds.get(name)),
+            list(configs),
+            concurrency
+        ))
+
+    def ping_site(self, site: str) -> None:
+        timer = StageTimer()
+        with timer.stage("parse"):
+            config = self.load_site_config(site)
+        if config is None:
             return
+        self.run_check(site, config, timer=timer)
+
+    def run_check(self, site: str, config: SiteConfig, result: Optional[ProbeResult] = None,
+                  timer: Optional[StageTimer] = None, probe_seconds: Optional[float] = None) -> Optional[ProbeResult]:
+        """
+        Probe a site, store the result and notify reporters when its state changes.
+
+        Args:
+            site (str): Site name
+            config (SiteConfig): Configuration of the site
+            result (ProbeResult, optional): Result of a probe already performed, e.g. by a batch engine
+            timer (StageTimer, optional): Timer of the check, already holding e.g. the parse stage
+            probe_seconds (float, optional): Duration of the batch that produced `result`
+
+        Returns:
+            ProbeResult: The result of the probe, None if the site could not be probed
+        """
+        protocol = config.protocol
+        timer = timer or StageTimer()
 
-        config = {}
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    # Ignore empty lines and comments
-                    if not line or line.startswith("#"):
-                        continue
-                    if "=" in line:
-                        key, value = line.split("=", 1)
-                        config[key.strip()] = value.strip()
+            # Execute the ping with the prober of the protocol, unless it was already probed
+            if result is None:
+                with timer.stage("import"):
+                    prober = protocols.get(protocol)
+                with timer.stage("probe"):
+                    result = prober(config.options).ping()
+                observe_probe(protocol, result, timer.durations["probe"])
+            else:
+                observe_probe(protocol, result, probe_seconds)
+
+            # Worker processes of the supervisor hand their results over instead of storing them
+            result.hostname = self.hostname
+            if self.result_sink is not None:
+                self.result_sink(site, result)
+            else:
+                self.record_result(site, config, result, timer)
+        except UnknownProtocolError as e:
+            print(e)
+        except ImportError as e:
+            print(f"Could not import module for protocol '{protocol}': {e}")
         except Exception as e:
-            print(f"Error reading configuration file: {e}")
+            print(f"Error performing ping: {e}")
+        finally:
+            if self.verbose:
+                # One write, so the lines of concurrent checks do not interleave
+                print(f"{site} ({protocol}): {result!r}\n  {timer}\n", end="")
+        return result
+
+    def record_result(self, site: str, config: SiteConfig, result, timer: Optional[StageTimer] = None) -> None:
+        """
+        Store the result of a check and notify reporters when the state of the site changes.
+
+        Args:
+            site (str): Site name
+            config (SiteConfig): Configuration of the site
+            result (ProbeResult): The result of the probe
+            timer (StageTimer, optional): Timer of the check
+        """
+        if config.storage != "sqlite":
             return
+        timer = timer or StageTimer()
+        domain = config.site
+        protocol = config.protocol
+        db_file = config.storage_file
+        try:
+            # The first check of a database imports the storage layer and creates the tables
+            with timer.stage("open"):
+                from data.writer import get_writer
+                writer = get_writer(db_file)
+            # Queue the result on the shared writer of the database file
+            with timer.stage("store"):
+                writer.add(
+                    site=domain, protocol=protocol, result=result,
+                    raw_output=config.options.get("raw_output", "all").lower()
+                )
 
-        # Verify required keys are present
-        required_keys = ["site", "protocol", "storage"]
-        missing_keys = [key for key in required_keys if key not in config]
+            # Feed the state machine and the latency baseline of the site, the
+            # dispatcher sends their changes in the background
+            with timer.stage("report"):
+                self.track_state(db_file, domain, protocol, result, config)
+        except Exception as db_error:
+            print(f"Error saving to database: {db_error}")
 
-        if missing_keys:
-            print(f"Missing configuration in '{config_path}': {', '.join(missing_keys)}")
-        else:
-            print(f"The site '{site}' has a valid configuration.")
-            # Optionally: display the configuration
-            for key in required_keys:
-                print(f"{key}: {config[key]}")
+    def track_state(self, db_file: str, domain: str, protocol: str, result, config: SiteConfig) -> None:
+        """
+        Advance the alerting state and the latency baseline of a site and queue their changes, if any.
 
-    def ping_site(self, site: str) -> None:
-        # Build the configuration file path
-        config_filename = f"{site}.conf"
-        config_path = os.path.join("sites", config_filename)
+        Both are tracked for every stored site, so a reporter added later starts
+        from a learned baseline; changes are only sent when the site has one.
+        The states live in memory in the writer of the database file, which
+        stores them with the results, so a check does not read or write them.
+
+        Args:
+            db_file (str): SQLite database of the site, which also keeps its state
+            domain (str): The site that was pinged
+            protocol (str): The protocol used
+            result (ProbeResult): The new result
+            config (SiteConfig): Configuration of the site, with its reporter and policies
+        """
+        from core.alerts import CHANGE_UP, advance
+        from core.anomaly import observe
+        from data.writer import get_writer
+
+        notify = "type" in config.reporter
+        writer = get_writer(db_file)
+        state = writer.get_site_state(domain, protocol)
+        down_since = state.down_since
+        change = advance(state, config.alert_policy, domain, protocol, result)
+        writer.save_site_state(domain, protocol, state)
+        if notify and change is not None and change.kind == CHANGE_UP and down_since is not None:
+            # The outage is measured on the stored results and the ones still buffered
+            change.duration = change.since - writer.outage_start(domain, protocol, down_since)
+        changes = [change]
+
+        if result.success:
+            latency = writer.get_latency_state(domain, protocol)
+            changes.append(observe(latency, config.latency_policy, domain, protocol, result))
+            writer.save_latency_state(domain, protocol, latency)
+
+        changes = [change for change in changes if change is not None]
+        if notify and changes:
+            from reporters.dispatcher import get_dispatcher
+
+            for change in changes:
+                get_dispatcher().submit(config.reporter, change)
+
+    def release_site(self, config: SiteConfig) -> None:
+        """
+        Forget the states kept in memory for a site another node now checks,
+        so they are read again from the database if it comes back.
+        """
+        if config.storage == "sqlite" and config.storage_file:
+            from data.writer import forget_state
+            forget_state(config.storage_file, config.site, config.protocol)
+
+    def manage_databases(self, action: str, sites: List[str]) -> None:
+        """
+        Maintain the SQLite databases of the sites.
+
+        Actions:
+            prune: delete raw results older than each site's `raw_retention_days`
+            compact: prune, compress or drop old raw output following each site's
+                     `raw_output` mode, then rebuild the file and report bytes saved
+            rollup: recompute the rollups from the raw results
+            migrate: convert the database to the v2 layout while it stays in use
+
+        Args:
+            action (str): prune, compact, rollup or migrate
+            sites (list): Site names, every configured site if empty
+        """
+        from datetime import datetime, timedelta
+        from data.models.db import PingMonitorDB
+
+        # Group the sites by database file, several sites may share one
+        databases = {}
+        for site in sites or self.list_sites():
+            config = self.load_site_config(site)
+            if config is None or config.storage != "sqlite":
+                continue
+            databases.setdefault(config.storage_file, []).append(config.options)
+
+        for db_file, configs in databases.items():
+            if not os.path.exists(db_file):
+                print(f"Database file '{db_file}' does not exist.")
+                continue
+            try:
+                db = PingMonitorDB.open(db_file)
+                size_before = db.storage_size()
+
+                if action == "rollup":
+                    db.rebuild_rollups()
+                    print(f"{db_file}: rollups rebuilt")
+                    continue
+                if action == "migrate":
+                    copied = db.migrate_to_v2(progress=lambda rows: print(f"{db_file}: {rows} rows copied"))
+                    print(f"{db_file}: v2 layout, {copied} rows migrated, "
+                          f"{size_before} -> {db.storage_size()} bytes")
+                    continue
+
+                pruned = 0
+                for config in configs:
+                    if config.get("raw_retention_days"):
+                        cutoff = datetime.now() - timedelta(days=float(config["raw_retention_days"]))
+                        pruned += db.prune(cutoff, site=config["site"])
+
+                rewritten = 0
+                if action == "compact":
+                    for config in configs:
+                        mode = config.get("raw_output", "all").lower()
+                        rewritten += db.compress_raw_output(site=config["site"], raw_output=mode)
+                    db.vacuum()
 
-        if not os.path.exists(config_path):
-            print(f"Configuration file '{config_path}' does not exist.")
+                size_after = db.storage_size()
+                print(
+                    f"{db_file}: {pruned} rows pruned, {rewritten} raw outputs rewritten, "
+                    f"{size_before} -> {size_after} bytes ({size_before - size_after} bytes saved)"
+                )
+            except Exception as e:
+                print(f"Error maintaining database '{db_file}': {e}")
+
+    def report_sites(self, sites: List[str], days: float = 30, since: Optional[str] = None,
+                     until: Optional[str] = None, output_format: str = "table", min_failures: int = 1,
+                     percentiles: Optional[List[float]] = None, outages: bool = False) -> None:
+        """
+        Print uptime, MTTR/MTBF, outages and latency percentiles computed from the raw results.
+
+        The results are read column by column from each database file and
+        analyzed with NumPy, so long histories are reported in one pass.
+
+        Args:
+            sites (list): Site names to report, every configured site if empty
+            days (float): Length of the reported period, ending at `until`
+            since (str, optional): Start of the period (ISO date or datetime), instead of `days`
+            until (str, optional): End of the period (ISO date or datetime), now by default
+            output_format (str): table or json
+            min_failures (int): Consecutive failed checks counted as an outage
+            percentiles (list, optional): Latency percentiles, 50, 90, 95 and 99 by default
+            outages (bool): List every outage interval in the table
+        """
+        from datetime import datetime, timedelta
+
+        try:
+            from core.report import DEFAULT_PERCENTILES, analyze, format_json, format_table, load_rows
+            import numpy  # noqa: F401
+        except ImportError:
+            print("Error: the report needs NumPy, install it with `pip install numpy`.")
             return
+        from data.models.db import PingMonitorDB
 
-        config = {}
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    # Ignore empty lines and comments
-                    if not line or line.startswith("#"):
-                        continue
-                    if "=" in line:
-                        key, value = line.split("=", 1)
-                        config[key.strip()] = value.strip()
-        except Exception as e:
-            print(f"Error reading configuration file: {e}")
+            end = datetime.fromisoformat(until) if until else datetime.now()
+            start = datetime.fromisoformat(since) if since else end - timedelta(days=days)
+        except ValueError as e:
+            print(f"Error: invalid date: {e}")
             return
+        percentiles = percentiles or list(DEFAULT_PERCENTILES)
+
+        # Group the sites by database file, several sites may share one
+        databases = {}
+        for site in sites or self.list_sites():
+            config = self.load_site_config(site)
+            if config is None or config.storage != "sqlite":
+                continue
+            databases.setdefault(config.storage_file, []).append(config.options.get("site", site))
+
+        report = []
+        for db_file, domains in databases.items():
+            if not os.path.exists(db_file):
+                print(f"Database file '{db_file}' does not exist.")
+                continue
+            try:
+                db = PingMonitorDB.open(db_file)
+                names, chunks = db.read_columns(domains, start, end)
+                rows = load_rows(chunks)
+                report.extend(analyze(rows, names, min_failures, percentiles))
+            except Exception as e:
+                print(f"Error reading database '{db_file}': {e}")
+
+        report.sort(key=lambda entry: (entry["site"] or "", entry["protocol"] or "", entry["hostname"] or ""))
+        if output_format == "json":
+            print(format_json(report))
+        elif report:
+            print(f"From {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M}:")
+            print(format_table(report, percentiles, outages))
+        else:
+            print("No results in this period.")
+
+    def run_monitor(self, sites: List[str], interval: float = 60, jitter: Optional[float] = None,
+                    workers: int = 32, duration: Optional[float] = None, adaptive: bool = False,
+                    max_rate: Optional[float] = None, politeness: float = 0.0) -> None:
+        """
+        Check sites periodically from a single long-running process.
+
+        Site configurations come from the registry snapshot, loaded once at
+        startup; the per-site interval comes from the `interval` key (seconds)
+        and defaults to `interval`. With `adaptive`, it then moves between the
+        `min_interval` and `max_interval` of the site with its results.
 
-        if "protocol" not in config:
-            print(f"Missing protocol in '{site}' configuration")
+        Args:
+            sites (list): Site names to monitor, every configured site if empty
+            interval (float): Default seconds between two checks of a site
+            jitter (float, optional): Maximum start delay, defaults to each site interval
+            workers (int): Maximum number of checks running at the same time
+            duration (float, optional): Stop after this many seconds
+            adaptive (bool): Tighten the interval of failing sites and relax that of stable ones
+            max_rate (float, optional): Global budget in probes per second
+            politeness (float): Minimum seconds between two probes of the same host
+        """
+        import asyncio
+        from core.scheduler import AdaptivePolicy, Scheduler
+
+        configs = {}
+        for site in sites or self.list_sites():
+            config = self.load_site_config(site)
+            if config is not None:
+                configs[site] = config
+
+        if not configs:
+            print("No site configurations to monitor.")
             return
 
-        protocol = config["protocol"].lower()
+        def check(name: str) -> Optional[ProbeResult]:
+            # Every site is scheduled, so a site failing over to this node is checked at its next tick
+            if self.cluster is not None and not self.cluster.owns(name):
+                self.release_site(configs[name])
+                return None
+            return self.run_check(name, configs[name])
+
+        scheduler = Scheduler(check, max_workers=workers, policy=AdaptivePolicy() if adaptive else None,
+                              max_rate=max_rate, politeness=politeness)
+        for site, config in configs.items():
+            try:
+                scheduler.add_site(site, config.interval or interval, jitter,
+                                   config.min_interval, config.max_interval, config.target)
+            except ValueError as e:
+                print(f"Skipping site '{site}': {e}")
 
+        if self.cluster is not None:
+            try:
+                self.cluster.start()
+            except Exception as e:
+                print(f"Error joining the cluster: {e}")
+                return
+            print(f"Node '{self.cluster.node}' joined {len(self.cluster.ring.nodes)} live nodes")
+        print(f"Monitoring {len(scheduler.sites)} sites. Press Ctrl+C to stop.")
         try:
-            # Dynamically import the protocol module
-            module_name = f"utils.{protocol}"
-            protocol_module = __import__(module_name, fromlist=[''])
-
-            # Get the domain or IP of the site
-            domain = config.get("site", site)
-
-            # Execute the ping using the specific protocol class
-            if protocol == "icmp":
-                # For ICMP, we use the ICMPPing class
-                pinger = protocol_module.ICMPPing(domain)
-                result = pinger.ping()
-            else:
-                # For other protocols, we try to use the generic ping function
-                result = protocol_module.ping(config)
+            asyncio.run(scheduler.run(duration))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.cluster is not None:
+                self.cluster.leave()
 
-            # TODO: add verbose mode to show ping results
-            # print(f"Ping result for {domain} using {protocol}: {result}")
-            if config.get("storage", "").lower() == "sqlite":
-                try:
-                    from data.models.db import PingMonitorDB
-                    # Get the database file path
-                    db_file = config.get("storage_file")
-                    if not db_file:
-                        print("Error: SQLite database file not specified in configuration.")
-                        return
-                    # Initialize database connection and save the result
-                    db = PingMonitorDB(db_file)
-                    # Add hostname to result
-                    result["hostname"] = self.hostname
-                    db.store_ping_result(site=domain, protocol=protocol, result=result)
-                    # print(f"Result saved to SQLite database: {db_file}")
-                    
-                    # Check if ping failed and if reporters are configured
-                    if not result["success"]:
-                        # Look for reporter section in configuration file
-                        reporter_section = False
-                        reporter_config = {}
-                        
-                        # Read configuration file to find reporter section
-                        config_path = os.path.join("sites", f"{site}.conf")
-                        try:
-                            with open(config_path, 'r', encoding='utf-8') as f:
-                                current_section = None
-                                for line in f:
-                                    line = line.strip()
-                                    if not line or line.startswith("#"):
-                                        continue
-                                    if line.startswith("[") and line.endswith("]"):
-                                        current_section = line[1:-1].lower()
-                                    elif current_section == "reporter" and "=" in line:
-                                        key, value = line.split("=", 1)
-                                        reporter_config[key.strip()] = value.strip()
-                                        reporter_section = True
-                            
-                            if reporter_section and "type" in reporter_config:
-                                reporter_type = reporter_config["type"].lower()
-                                
-                                # Send notification based on reporter type
-                                if reporter_type == "telegram":
-                                    try:
-                                        from reporters.telegram import TelegramReporter
-                                        bot_token = reporter_config["bot_token"]
-                                        chat_id = reporter_config["chat_id"]
-                                        reporter = TelegramReporter(bot_token, chat_id)
-                                        message = (
-                                            f"⚠️ Ping Error Detected\n"
-                                            f"Host: {self.hostname}\n"
-                                            f"Site: {domain}\n"
-                                            f"Protocol: {protocol}\n"
-                                            f"Error: {result.get('error_message', 'Unknown error')}"
-                                        )
-                                        reporter._send_message(message)
-                                    except Exception as reporter_error:
-                                        print(f"Error sending Telegram notification: {reporter_error}")
-                        except Exception as config_error:
-                            print(f"Error reading reporter configuration: {config_error}")
-                except Exception as db_error:
-                    print(f"Error saving to database: {db_error}")
-        except ImportError:
-            print(f"Could not import module for protocol '{protocol}'")
-        except Exception as e:
-            print(f"Error performing ping: {e}")
+        for site, stats in scheduler.stats().items():
+            if stats["missed_ticks"]:
+                print(f"Site '{site}' missed {stats['missed_ticks']} of {stats['runs'] + stats['missed_ticks']} checks")
+
+    def run_supervisor(self, sites: List[str], processes: int, interval: float = 60, jitter: Optional[float] = None,
+                       workers: int = 32, duration: Optional[float] = None, reload_interval: float = 30,
+                       adaptive: bool = False, max_rate: Optional[float] = None, politeness: float = 0.0) -> None:
+        """
+        Check sites periodically from several worker processes.
+
+        Sites are split between the workers by a stable hash of their host. The
+        registry is reloaded every `reload_interval` seconds and only the
+        workers whose sites changed are restarted; in a cluster, sites failing
+        over to or away from this node are picked up at the same time. Workers only probe: this
+        process stores every result and drives the alerts, so each database
+        keeps a single writer.
+
+        Args:
+            sites (list): Site names to monitor, every configured site if empty
+            processes (int): Number of worker processes
+            interval (float): Default seconds between two checks of a site
+            jitter (float, optional): Maximum start delay, defaults to each site interval
+            workers (int): Maximum number of checks running at the same time in each worker
+            duration (float, optional): Stop after this many seconds
+            reload_interval (float): Seconds between two reloads of the site registry
+            adaptive (bool): Tighten the interval of failing sites and relax that of stable ones
+            max_rate (float, optional): Global budget in probes per second, split evenly between the workers
+            politeness (float): Minimum seconds between two probes of the same host
+        """
+        from core.scheduler import AdaptivePolicy
+        from core.supervisor import Supervisor
+
+        reported_errors = {}
+
+        def load_sites() -> Dict[str, SiteConfig]:
+            self.registry.load()
+            for site, error in sorted(self.registry.errors.items()):
+                if reported_errors.get(site) != error:
+                    print(f"Skipping site '{site}': {error}")
+            reported_errors.clear()
+            reported_errors.update(self.registry.errors)
+            names = [site for site in sites if site in self.registry.sites] if sites else self.registry.sites
+            if self.cluster is not None:
+                selected = self.cluster.select(names)
+                for site in set(names).difference(selected):
+                    self.release_site(self.registry.sites[site])
+                names = selected
+            return {site: self.registry.sites[site] for site in names}
+
+        def record(site: str, config: SiteConfig, result) -> None:
+            # Counted again here, so the metrics endpoint of the supervisor covers every worker
+            observe_probe(config.protocol, result)
+            self.record_result(site, config, result)
+
+        scheduling = {
+            "policy": AdaptivePolicy() if adaptive else None,
+            "max_rate": max_rate / processes if max_rate else None,
+            "politeness": politeness,
+        }
+        supervisor = Supervisor(load_sites, record, processes, interval, jitter, workers, reload_interval,
+                                scheduling=scheduling)
+        if self.cluster is not None:
+            try:
+                self.cluster.start()
+            except Exception as e:
+                print(f"Error joining the cluster: {e}")
+                return
+            print(f"Node '{self.cluster.node}' joined {len(self.cluster.ring.nodes)} live nodes")
+        print(f"Supervising {processes} worker processes. Press Ctrl+C to stop.")
+        try:
+            supervisor.run(duration)
+        finally:
+            if self.cluster is not None:
+                self.cluster.leave()
+
+        print(f"{supervisor.results_recorded} results recorded")
+        for shard, stats in supervisor.stats().items():
+            if stats["crashes"]:
+                print(f"Shard {shard} ({stats['sites']} sites) crashed {stats['crashes']} times and was restarted")
+
+    def show_cluster(self) -> None:
+        """Print the nodes of the cluster and the number of sites each one owns."""
+        import datetime
+        from core.cluster import HashRing
+
+        if self.cluster is None:
+            print("No cluster configured, use --cluster FILE.")
+            return
+        members = self.cluster.members()
+        if not members:
+            print(f"No node has joined the cluster in '{self.cluster.path}'.")
+            return
+        ring = HashRing(member["node"] for member in members if member["live"])
+        owned = {}
+        for site in self.list_sites():
+            owner = ring.owner(site)
+            owned[owner] = owned.get(owner, 0) + 1
+        for member in members:
+            heartbeat = datetime.datetime.fromtimestamp(member["heartbeat"]).strftime("%Y-%m-%d %H:%M:%S")
+            state = f"live, {owned.get(member['node'], 0)} sites" if member["live"] else "expired"
+            print(f"{member['node']} ({member['hostname']}, pid {member['pid']}): last heartbeat {heartbeat}, {state}")
+
+    def run_benchmark(self, targets: List[int], protocol_names: List[str], concurrency: int, rows: int,
+                      batch_size: int, schema: str, output: Optional[str], baseline: Optional[str],
+                      record: bool) -> None:
+        """
+        Benchmark the probers against local stand-ins and the storage layer.
+
+        Args:
+            targets (list): Target counts each prober is measured at
+            protocol_names (list): Protocols to benchmark
+            concurrency (int): Checks in flight
+            rows (int): Results inserted in the storage benchmark, 0 to skip it
+            batch_size (int): Results per insert transaction
+            schema (str): Database layout, v2 or v1
+            output (str, optional): File the JSON report is written to
+            baseline (str, optional): JSON report to compare with, the last recorded run by default
+            record (bool): Append the report to the benchmark history
+        """
+        import json
+        from bench.suite import HISTORY_FILE, compare, last_record, run_suite
+
+        report = run_suite(targets, protocol_names, concurrency, rows, batch_size, schema)
+
+        if baseline:
+            with open(baseline, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+        else:
+            previous = last_record(HISTORY_FILE)
+        if previous:
+            print(f"Compared with the run of {previous['environment']['date']} "
+                  f"({previous['environment'].get('commit') or 'unknown commit'}):")
+            if previous.get("parameters") != report["parameters"]:
+                print("  (the parameters differ, only the figures measured by both runs are compared)")
+            for line in compare(report, previous):
+                print(f"  {line}")
+
+        if record:
+            os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
+            with open(HISTORY_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(report) + "\n")
+        if output:
+            with open(output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {output}")
 
 
 def main():
     monitor = PingMonitor()
 
     parser = argparse.ArgumentParser(description="Ping Monitor Command Line Interface")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print every result and the time spent in each stage of the checks")
+    parser.add_argument("--profile", choices=PROFILE_MODES,
+                        help="Profile the command: cpu (cProfile), memory (tracemalloc) or all")
+    parser.add_argument("--profile-limit", type=int, default=30, help="Lines printed in each profile report")
+    parser.add_argument("--profile-sort", default="cumulative", help="Sort key of the CPU report, e.g. tottime")
+    parser.add_argument("--profile-output", help="Dump the raw CPU statistics to this file (pstats format)")
+    parser.add_argument("--cluster", metavar="FILE",
+                        help="Share the sites with the other nodes using this SQLite lease file")
+    parser.add_argument("--node", help="Name of this node in the cluster (default: the hostname)")
+    parser.add_argument("--cluster-ttl", type=float, default=None,
+                        help="Seconds the lease of this node lasts without a heartbeat "
+                             "(default: 30, or twice the --period of ping)")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     parser_run = subparsers.add_parser("runscript", help="Execute a script")
@@ -200,19 +686,171 @@ def main():
     parser_check.add_argument("site", type=str, help="Site name (configuration file at sites/<site>.conf)")
 
     parser_ping = subparsers.add_parser("ping", help="Ping a site")
-    parser_ping.add_argument("site", type=str, help="Site to ping (e.g., domain name or IP)")
+    parser_ping.add_argument("site", type=str, nargs="?", help="Site to ping (e.g., domain name or IP)")
+    parser_ping.add_argument("--all", action="store_true", help="Ping every site configured in sites/")
+    parser_ping.add_argument("--glob", type=str, help="Ping every configured site matching a pattern, e.g. 'prod-*'")
+    parser_ping.add_argument("--concurrency", type=int, default=64,
+                             help="Maximum concurrent checks with --all or --glob")
+    parser_ping.add_argument("--metrics-textfile", help="Write Prometheus metrics of the run to this file on exit")
+    parser_ping.add_argument("--period", type=float,
+                             help="Seconds between two runs from cron, required with --cluster and --all or --glob")
+
+    parser_monitor = subparsers.add_parser("monitor", help="Continuously monitor sites from one process")
+    parser_monitor.add_argument("sites", nargs="*", help="Sites to monitor (default: every file in sites/)")
+    parser_monitor.add_argument("--interval", type=float, default=60,
+                                help="Default seconds between checks when a site sets no interval")
+    parser_monitor.add_argument("--jitter", type=float, default=None,
+                                help="Maximum start delay in seconds (default: the site interval)")
+    parser_monitor.add_argument("--workers", type=int, default=32, help="Maximum concurrent checks")
+    parser_monitor.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    parser_monitor.add_argument("--adaptive", action="store_true",
+                                help="Tighten the interval of failing sites, relax it for stable ones")
+    parser_monitor.add_argument("--max-rate", type=float, help="Global budget in probes per second")
+    parser_monitor.add_argument("--politeness", type=float, default=0.0,
+                                help="Minimum seconds between two probes of the same host")
+    parser_monitor.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port at /metrics")
+    parser_monitor.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics endpoint listens on")
+    parser_monitor.add_argument("--metrics-textfile", help="Write Prometheus metrics to this file on exit")
+
+    parser_supervise = subparsers.add_parser("supervise", help="Continuously monitor sites from several processes")
+    parser_supervise.add_argument("sites", nargs="*", help="Sites to monitor (default: every file in sites/)")
+    parser_supervise.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                                  help="Worker processes the sites are split between (default: one per CPU)")
+    parser_supervise.add_argument("--interval", type=float, default=60,
+                                  help="Default seconds between checks when a site sets no interval")
+    parser_supervise.add_argument("--jitter", type=float, default=None,
+                                  help="Maximum start delay in seconds (default: the site interval)")
+    parser_supervise.add_argument("--workers", type=int, default=32, help="Maximum concurrent checks per process")
+    parser_supervise.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    parser_supervise.add_argument("--reload", type=float, default=30,
+                                  help="Seconds between two rescans of sites/ for added, removed or changed sites")
+    parser_supervise.add_argument("--adaptive", action="store_true",
+                                  help="Tighten the interval of failing sites, relax it for stable ones")
+    parser_supervise.add_argument("--max-rate", type=float,
+                                  help="Global budget in probes per second, split between the processes")
+    parser_supervise.add_argument("--politeness", type=float, default=0.0,
+                                  help="Minimum seconds between two probes of the same host")
+    parser_supervise.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port at /metrics")
+    parser_supervise.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics endpoint listens on")
+    parser_supervise.add_argument("--metrics-textfile", help="Write Prometheus metrics to this file on exit")
+
+    subparsers.add_parser("cluster", help="List the nodes of the --cluster and the sites they own")
+
+    parser_db = subparsers.add_parser("db", help="Maintain the site databases")
+    parser_db.add_argument("action", choices=["prune", "compact", "rollup", "migrate"],
+                           help="prune old raw results, compact the files, rebuild the rollups "
+                                "or migrate to the v2 layout")
+    parser_db.add_argument("sites", nargs="*", help="Sites whose databases are maintained (default: all)")
+
+    parser_report = subparsers.add_parser("report", help="Report uptime, outages and latency from the stored results")
+    parser_report.add_argument("sites", nargs="*", help="Sites to report (default: every file in sites/)")
+    parser_report.add_argument("--days", type=float, default=30, help="Length of the reported period in days")
+    parser_report.add_argument("--since", help="Start of the period, e.g. 2024-01-01 (instead of --days)")
+    parser_report.add_argument("--until", help="End of the period (default: now)")
+    parser_report.add_argument("--format", choices=["table", "json"], default="table", help="Output format")
+    parser_report.add_argument("--min-failures", type=int, default=1,
+                               help="Consecutive failed checks counted as an outage")
+    parser_report.add_argument("--percentiles", default="50,90,95,99",
+                               help="Comma separated latency percentiles")
+    parser_report.add_argument("--outages", action="store_true", help="List every outage under its site")
+
+    parser_bench = subparsers.add_parser("bench", help="Benchmark the probers and the storage layer locally")
+    parser_bench.add_argument("--targets", default="1,100,10000",
+                              help="Comma separated target counts each prober is measured at")
+    parser_bench.add_argument("--protocols", default="http,port,dns,icmp",
+                              help="Comma separated protocols to benchmark, empty to skip the probes")
+    parser_bench.add_argument("--concurrency", type=int, default=64, help="Maximum concurrent checks")
+    parser_bench.add_argument("--rows", type=int, default=1000000,
+                              help="Results inserted in the storage benchmark, 0 to skip it")
+    parser_bench.add_argument("--batch-size", type=int, default=500, help="Results per insert transaction")
+    parser_bench.add_argument("--schema", choices=["v2", "v1"], default="v2", help="Database layout benchmarked")
+    parser_bench.add_argument("--output", help="Write the JSON report to this file")
+    parser_bench.add_argument("--compare", help="JSON report to compare with (default: the last recorded run)")
+    parser_bench.add_argument("--no-record", action="store_true",
+                              help="Do not append the report to data/benchmarks/bench.jsonl")
 
     args = parser.parse_args()
+    monitor.verbose = args.verbose
+    if args.cluster:
+        from core.cluster import DEFAULT_TTL, Cluster
+        ttl = DEFAULT_TTL if args.cluster_ttl is None else args.cluster_ttl
+        if args.command == "ping" and (args.all or args.glob):
+            # Each run renews the lease once, it must last until the next run or the
+            # sites of the node fail over between runs and are probed by every node
+            if args.period is None or args.period <= 0:
+                parser_ping.error("--cluster needs the --period of the runs, in seconds")
+            if args.cluster_ttl is None:
+                ttl = 2 * args.period
+            elif args.cluster_ttl <= args.period:
+                parser_ping.error(f"--cluster-ttl must be above the --period of {args.period:g} s")
+        monitor.cluster = Cluster(args.cluster, args.node or monitor.hostname, ttl, monitor.hostname)
+
+    profiler = None
+    if args.profile:
+        from core.profiling import RunProfiler
+        profiler = RunProfiler(args.profile, args.profile_limit, args.profile_sort, args.profile_output)
+        profiler.start()
 
     if args.command == "runscript":
         monitor.run_script(args.script_name)
     elif args.command == "check":
         monitor.check_site_config(args.site)
     elif args.command == "ping":
-        monitor.ping_site(args.site)
+        if args.all or args.glob:
+            monitor.ping_sites(monitor.select_sites(args.glob or "*"), args.concurrency)
+        elif args.site:
+            monitor.ping_site(args.site)
+        else:
+            parser_ping.error("a site name, --all or --glob is required")
+    elif args.command == "monitor":
+        if args.metrics_port:
+            from core.metrics import metrics
+            metrics.serve(args.metrics_port, args.metrics_host)
+        monitor.run_monitor(args.sites, args.interval, args.jitter, args.workers, args.duration,
+                            args.adaptive, args.max_rate, args.politeness)
+    elif args.command == "supervise":
+        if args.metrics_port:
+            from core.metrics import metrics
+            metrics.serve(args.metrics_port, args.metrics_host)
+        monitor.run_supervisor(args.sites, args.processes, args.interval, args.jitter, args.workers,
+                               args.duration, args.reload, args.adaptive, args.max_rate, args.politeness)
+    elif args.command == "cluster":
+        monitor.show_cluster()
+    elif args.command == "db":
+        monitor.manage_databases(args.action, args.sites)
+    elif args.command == "report":
+        monitor.report_sites(
+            args.sites, args.days, args.since, args.until, args.format, args.min_failures,
+            [float(q) for q in args.percentiles.split(",") if q.strip()], args.outages
+        )
+    elif args.command == "bench":
+        monitor.run_benchmark(
+            [int(count) for count in args.targets.split(",") if count.strip()],
+            [name.strip().lower() for name in args.protocols.split(",") if name.strip()],
+            args.concurrency, args.rows, args.batch_size, args.schema, args.output, args.compare,
+            not args.no_record
+        )
     else:
         parser.print_help()
 
+    # Write the results still buffered and send the queued alerts before exiting
+    shutdown = StageTimer()
+    if "data.writer" in sys.modules:
+        with shutdown.stage("flush"):
+            sys.modules["data.writer"].close_writers()
+    if "reporters.dispatcher" in sys.modules:
+        with shutdown.stage("send"):
+            sys.modules["reporters.dispatcher"].close_dispatcher()
+    if args.verbose and shutdown.durations:
+        print(f"Shutdown: {shutdown}")
+    if profiler is not None:
+        profiler.stop()
+        print(profiler.report())
+    # Last, so the final flushes and sends are counted
+    if getattr(args, "metrics_textfile", None):
+        from core.metrics import metrics
+        metrics.write_textfile(args.metrics_textfile)
+
 
 if __name__ == "__main__":
     main()
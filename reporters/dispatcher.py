@@ -0,0 +1,266 @@
+import atexit
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from core.alerts import StateChange
+from core.metrics import ALERT_MESSAGES, ALERT_QUEUE, ALERT_SEND_DURATION, ALERTS_DROPPED
+
+
+def create_reporter(reporter_config: Dict[str, str], session=None):
+    """
+    Build the reporter described by the [reporter] section of a site.
+
+    Args:
+        reporter_config (dict): Reporter configuration, `type` selects the reporter
+        session (requests.Session, optional): Session shared by the reporters
+
+    Returns:
+        Reporter instance, None if the type is not supported
+    """
+    reporter_type = reporter_config.get("type", "").lower()
+    if reporter_type == "telegram":
+        from reporters.telegram import TELEGRAM_API_URL, TelegramReporter
+        return TelegramReporter(
+            reporter_config["bot_token"],
+            reporter_config["chat_id"],
+            session=session,
+            timeout=float(reporter_config.get("timeout", 10)),
+            api_url=reporter_config.get("api_url", TELEGRAM_API_URL),
+        )
+    print(f"Unsupported reporter type '{reporter_type}'")
+    return None
+
+
+class _Chat:
+    """
+    Alerts waiting for one chat and the messages ready to be sent to it.
+    """
+    __slots__ = ("config", "reporter", "alerts", "window_end", "outbox", "attempts", "next_send")
+
+    def __init__(self, config: Dict[str, str]):
+        self.config = config
+        self.reporter = None  # Built by the dispatcher thread on first send
+        self.alerts = []
+        self.window_end = 0.0
+        self.outbox = deque()
+        self.attempts = 0
+        self.next_send = 0.0
+
+
+class AlertDispatcher:
+    def __init__(self, coalesce_window: float = 5.0, min_interval: float = 1.0, max_retries: int = 5,
+                 backoff: float = 1.0, max_backoff: float = 60.0, max_pending: int = 10000,
+                 close_timeout: float = 10.0):
+        """
+        Send alerts from a background thread, so a slow reporter never delays a check.
+
+        State changes reported to the same chat within `coalesce_window` seconds are
+        sent as one summary message, and each chat receives at most one message
+        every `min_interval` seconds. Failed sends are retried with exponential
+        backoff, or after the delay the API asks for when rate limited.
+
+        Args:
+            coalesce_window (float): Seconds alerts are gathered before sending
+            min_interval (float): Minimum seconds between two messages to a chat
+            max_retries (int): Attempts after the first one before a message is dropped
+            backoff (float): First retry delay in seconds, doubled on each attempt
+            max_backoff (float): Longest retry delay in seconds
+            max_pending (int): Alerts queued at most, newer ones are dropped beyond
+            close_timeout (float): Seconds close() waits for the queue to drain
+        """
+        self.coalesce_window = coalesce_window
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+        self.close_timeout = close_timeout
+        self.alerts_received = 0
+        self.alerts_dropped = 0
+        self.messages_sent = 0
+        self.messages_failed = 0
+        self.retries = 0
+        self._session = None
+        self._chats: Dict[tuple, _Chat] = {}
+        self._condition = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="pingmonitor-alerts", daemon=True)
+        self._thread.start()
+
+    def submit(self, reporter_config: Dict[str, str], change: StateChange) -> bool:
+        """
+        Queue the state change of a site, returns right away.
+
+        Args:
+            reporter_config (dict): Reporter configuration of the site
+            change (StateChange): The change to notify
+
+        Returns:
+            bool: False if the alert was dropped
+        """
+        # Sites sharing a reporter configuration share the chat, its window and its rate limit
+        key = tuple(sorted(reporter_config.items()))
+        with self._condition:
+            self.alerts_received += 1
+            if self._closing or self.pending >= self.max_pending:
+                self.alerts_dropped += 1
+                ALERTS_DROPPED.inc()
+                return False
+            chat = self._chats.get(key)
+            if chat is None:
+                chat = self._chats[key] = _Chat(dict(reporter_config))
+            if not chat.alerts:
+                chat.window_end = time.monotonic() + self.coalesce_window
+            chat.alerts.append(change)
+            self._condition.notify()
+        return True
+
+    @property
+    def pending(self) -> int:
+        """Alerts and messages waiting to be sent (queue depth)."""
+        return sum(len(chat.alerts) + len(chat.outbox) for chat in self._chats.values())
+
+    def stats(self) -> dict:
+        """Counters of the dispatcher, including the current queue depth."""
+        with self._condition:
+            return {
+                "pending": self.pending,
+                "alerts_received": self.alerts_received,
+                "alerts_dropped": self.alerts_dropped,
+                "messages_sent": self.messages_sent,
+                "messages_failed": self.messages_failed,
+                "retries": self.retries,
+            }
+
+    def _next_due(self, now: float):
+        """
+        Return the chat with a message to send now, or None and the seconds to wait.
+        Called with the condition held.
+        """
+        deadlines = []
+        for chat in self._chats.values():
+            if chat.alerts and (chat.window_end <= now or self._closing):
+                # The window is over, its alerts become one message
+                chat.outbox.append(chat.alerts)
+                chat.alerts = []
+            elif chat.alerts:
+                deadlines.append(chat.window_end)
+
+            if chat.outbox:
+                if chat.next_send <= now:
+                    return chat, 0
+                deadlines.append(chat.next_send)
+        return None, (min(deadlines) - now if deadlines else None)
+
+    def _send(self, chat: _Chat, alerts: list):
+        """
+        Format and send one message, outside the lock.
+
+        Returns:
+            tuple: (sent, retry_after) as returned by the reporter
+        """
+        if chat.reporter is None:
+            if self._session is None:
+                import requests
+                # One pool of keep-alive connections for every chat
+                self._session = requests.Session()
+            chat.reporter = create_reporter(chat.config, self._session)
+            if chat.reporter is None:
+                return False, None
+        try:
+            if len(alerts) == 1:
+                message = chat.reporter.format_change_message(alerts[0])
+            else:
+                message = chat.reporter.format_summary_message(alerts)
+            return chat.reporter.send(message)
+        except Exception as e:
+            print(f"Error sending alert: {e}")
+            return False, None
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    chat, wait = self._next_due(time.monotonic())
+                    if chat is not None:
+                        break
+                    if self._closing and wait is None:
+                        return
+                    self._condition.wait(wait)
+                alerts = chat.outbox[0]
+
+            started = time.perf_counter()
+            sent, retry_after = self._send(chat, alerts)
+            ALERT_SEND_DURATION.observe(time.perf_counter() - started)
+
+            with self._condition:
+                now = time.monotonic()
+                if sent or retry_after is None or chat.attempts >= self.max_retries:
+                    chat.outbox.popleft()
+                    chat.attempts = 0
+                    chat.next_send = now + self.min_interval
+                    if sent:
+                        self.messages_sent += 1
+                        ALERT_MESSAGES.inc("sent")
+                    else:
+                        self.messages_failed += 1
+                        ALERT_MESSAGES.inc("failed")
+                else:
+                    delay = min(self.backoff * 2 ** chat.attempts, self.max_backoff)
+                    chat.attempts += 1
+                    chat.next_send = now + max(delay, retry_after)
+                    self.retries += 1
+                    ALERT_MESSAGES.inc("retried")
+
+    def close(self) -> None:
+        """
+        Send what is queued, without waiting for the coalescing window, then stop.
+        Gives up after close_timeout seconds so a down API cannot hang the process.
+        """
+        with self._condition:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify()
+        self._thread.join(self.close_timeout)
+        if self._thread.is_alive():
+            print(f"Gave up sending {self.pending} queued alerts")
+        elif self._session is not None:
+            self._session.close()
+
+
+_dispatcher: Optional[AlertDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> AlertDispatcher:
+    """
+    Return the dispatcher shared by the whole process.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AlertDispatcher()
+        return _dispatcher
+
+
+def close_dispatcher() -> None:
+    """
+    Send the queued alerts and stop the dispatcher, called on shutdown.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None:
+        dispatcher.close()
+
+
+def _queue_depth() -> dict:
+    dispatcher = _dispatcher
+    return {(): dispatcher.stats()["pending"]} if dispatcher is not None else {(): 0}
+
+
+ALERT_QUEUE.collect_with(_queue_depth)
+atexit.register(close_dispatcher)
@@ -1,22 +1,51 @@
+import html
 import requests
-from typing import Dict, Any
 from datetime import datetime
+from typing import List, Optional, Tuple
+
+from core.alerts import CHANGE_DOWN, CHANGE_FAST, CHANGE_FLAPPING, CHANGE_SLOW, CHANGE_UP, STATE_UP, StateChange
+from core.result import ProbeResult
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+
+def format_duration(seconds: float) -> str:
+    """Render a duration as e.g. '2h 5m' or '42s'."""
+    seconds = int(max(seconds, 0))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    parts = [f"{value}{unit}" for value, unit in ((days, "d"), (hours, "h"), (minutes, "m")) if value]
+    if not parts or (seconds and len(parts) < 2):
+        parts.append(f"{seconds}s")
+    return " ".join(parts[:2])
 
 
 class TelegramReporter:
-    def __init__(self, bot_token: str, chat_id: str):
+    def __init__(self, bot_token: str, chat_id: str, session: Optional[requests.Session] = None,
+                 timeout: float = 10, api_url: str = TELEGRAM_API_URL):
         """
         Initialize the Telegram reporter.
 
         Args:
             bot_token (str): Telegram bot token
             chat_id (str): Telegram chat ID where messages will be sent
+            session (requests.Session, optional): Session shared to reuse connections
+            timeout (float): Seconds to wait for the Telegram API
+            api_url (str): Base URL of the Bot API, e.g. a local Bot API server
         """
         self.bot_token = bot_token
         self.chat_id = chat_id
-        self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        self.base_url = f"{api_url.rstrip('/')}/bot{bot_token}"
+        self.session = session or requests.Session()
+        self.timeout = timeout
 
-    def _send_message(self, message: str) -> bool:
+    @property
+    def chat_key(self) -> Tuple[str, str]:
+        """Identifies the chat messages go to, rate limits apply per chat."""
+        return self.base_url, str(self.chat_id)
+
+    def send(self, message: str) -> Tuple[bool, Optional[float]]:
         """
         Send a message to Telegram.
 
@@ -24,36 +53,61 @@ class TelegramReporter:
             message (str): Message to send
 
         Returns:
-            bool: True if message was sent successfully, False otherwise
+            tuple: (sent, retry_after) where retry_after is None when retrying is
+                   pointless (e.g. a wrong token), otherwise the seconds Telegram
+                   asked to wait (0 when it did not say)
         """
+        url = f"{self.base_url}/sendMessage"
+        data = {
+            "chat_id": self.chat_id,
+            "text": message,
+            "parse_mode": "HTML"
+        }
         try:
-            url = f"{self.base_url}/sendMessage"
-            data = {
-                "chat_id": self.chat_id,
-                "text": message,
-                "parse_mode": "HTML"
-            }
-            response = requests.post(url, json=data)
-            response.raise_for_status()
-            return True
-        except Exception as e:
+            response = self.session.post(url, json=data, timeout=self.timeout)
+        except requests.RequestException as e:
             print(f"Error sending Telegram message: {e}")
-            return False
+            return False, 0.0
+
+        if response.ok:
+            return True, None
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        print(f"Error sending Telegram message: HTTP {response.status_code} {body.get('description', '')}")
+        if response.status_code == 429:
+            return False, float(body.get("parameters", {}).get("retry_after", 0))
+        if response.status_code >= 500:
+            return False, 0.0
+        return False, None
+
+    def _send_message(self, message: str) -> bool:
+        """
+        Send a message to Telegram right away.
+
+        Args:
+            message (str): Message to send
+
+        Returns:
+            bool: True if message was sent successfully, False otherwise
+        """
+        return self.send(message)[0]
 
-    def format_ping_message(self, site: str, protocol: str, result: Dict[str, Any]) -> str:
+    def format_ping_message(self, site: str, protocol: str, result: ProbeResult) -> str:
         """
         Format the ping result into a readable message.
 
         Args:
             site (str): The site that was pinged
             protocol (str): The protocol used
-            result (dict): The ping result
+            result (ProbeResult): The ping result
 
         Returns:
             str: Formatted message
         """
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        status = "✅ Success" if result.get('success') else "❌ Failed"
+        timestamp = datetime.fromtimestamp(result.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        status = "✅ Success" if result.success else "❌ Failed"
         message = [
             "<b>Ping Monitor Alert</b>",
             f"Time: {timestamp}",
@@ -61,28 +115,118 @@ class TelegramReporter:
             f"Protocol: {protocol}",
             f"Status: {status}"
         ]
+        if result.hostname:
+            message.insert(2, f"Host: {result.hostname}")
 
-        if result.get('success'):
-            message.append(f"Response Time: {result.get('response_time_ms')}ms")
+        if result.success:
+            message.append(f"Response Time: {result.response_time_ms}ms")
         else:
-            message.append(f"Error: {result.get('error_message', 'Unknown error')}")
+            message.append(f"Error: {result.error or 'Unknown error'} ({result.error_class})")
 
         return "\n".join(message)
 
-    def report_ping_result(self, site: str, protocol: str, result: Dict[str, Any]) -> bool:
+    def format_change_message(self, change: StateChange) -> str:
+        """
+        Format a state change of a site into a readable message.
+
+        Args:
+            change (StateChange): The change to notify
+
+        Returns:
+            str: Formatted message
+        """
+        since = datetime.fromtimestamp(change.since).strftime("%Y-%m-%d %H:%M:%S")
+        message = [
+            "<b>Ping Monitor Alert</b>",
+            f"Site: {html.escape(change.site)}",
+            f"Protocol: {change.protocol}",
+        ]
+        if change.result.hostname:
+            message.insert(1, f"Host: {html.escape(change.result.hostname)}")
+
+        if change.kind == CHANGE_DOWN:
+            error = html.escape(change.result.error or "Unknown error")
+            message.append(f"Status: ❌ DOWN since {since}")
+            message.append(f"Error: {error} ({change.result.error_class})")
+        elif change.kind == CHANGE_UP:
+            message.append(f"Status: ✅ UP since {since}")
+            if change.duration is not None:
+                message.append(f"Outage: {format_duration(change.duration)}")
+            if change.result.response_time_ms is not None:
+                message.append(f"Response Time: {change.result.response_time_ms}ms")
+        elif change.kind == CHANGE_FLAPPING:
+            message.append(f"Status: ⚠️ FLAPPING, {change.transitions} state changes recently")
+            message.append("Notifications are paused until it is stable")
+        elif change.kind == CHANGE_SLOW:
+            message.append(f"Status: 🐢 SLOW since {since}")
+            message.append(f"Response Time: {change.result.response_time_ms}ms (usually {change.baseline:.0f}ms)")
+        elif change.kind == CHANGE_FAST:
+            message.append(f"Status: ✅ latency back to normal since {since}")
+            if change.duration is not None:
+                message.append(f"Slow for: {format_duration(change.duration)}")
+            message.append(f"Response Time: {change.result.response_time_ms}ms (usually {change.baseline:.0f}ms)")
+        else:
+            state = "✅ UP" if change.state == STATE_UP else "❌ DOWN"
+            message.append(f"Status: {state} and stable since {since}")
+            message.append(f"Changes not notified while flapping: {change.suppressed}")
+        return "\n".join(message)
+
+    def format_summary_message(self, changes: List[StateChange], limit: int = 20) -> str:
+        """
+        Format several state changes into a single message.
+
+        Args:
+            changes (list): StateChange objects
+            limit (int): Maximum number of changes listed
+
+        Returns:
+            str: Formatted message
+        """
+        first = datetime.fromtimestamp(min(change.since for change in changes))
+        hosts = sorted({change.result.hostname for change in changes if change.result.hostname})
+        down = sum(1 for change in changes if change.kind == CHANGE_DOWN)
+        message = [
+            "<b>Ping Monitor Alert</b>",
+            f"Time: {first.strftime('%Y-%m-%d %H:%M:%S')}",
+        ]
+        if hosts:
+            message.append(f"Host: {html.escape(', '.join(hosts))}")
+        message.append(f"{len(changes)} sites changed state, {down} went down:")
+        for change in changes[:limit]:
+            site = html.escape(change.site)
+            if change.kind == CHANGE_DOWN:
+                error = html.escape(change.result.error or "Unknown error")
+                message.append(f"❌ {site} ({change.protocol}): {error} ({change.result.error_class})")
+            elif change.kind == CHANGE_UP:
+                outage = f" after {format_duration(change.duration)}" if change.duration is not None else ""
+                message.append(f"✅ {site} ({change.protocol}): up{outage}")
+            elif change.kind == CHANGE_FLAPPING:
+                message.append(f"⚠️ {site} ({change.protocol}): flapping, notifications paused")
+            elif change.kind == CHANGE_SLOW:
+                message.append(f"🐢 {site} ({change.protocol}): slow, {change.result.response_time_ms}ms "
+                               f"instead of {change.baseline:.0f}ms")
+            elif change.kind == CHANGE_FAST:
+                message.append(f"✅ {site} ({change.protocol}): latency back to normal")
+            else:
+                message.append(f"• {site} ({change.protocol}): stable, {change.state}")
+        if len(changes) > limit:
+            message.append(f"... and {len(changes) - limit} more")
+        return "\n".join(message)
+
+    def report_ping_result(self, site: str, protocol: str, result: ProbeResult) -> bool:
         """
         Report a ping result to Telegram.
 
         Args:
             site (str): The site that was pinged
             protocol (str): The protocol used
-            result (dict): The ping result
+            result (ProbeResult): The ping result
 
         Returns:
             bool: True if report was sent successfully, False otherwise
         """
         # Only report failed pings
-        if result.get('success'):
+        if result.success:
             return True
 
         message = self.format_ping_message(site, protocol, result)
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HISTORY_FILE = os.path.join("data", "benchmarks", "startup.jsonl")
+
+# Startup path of a cron-driven ping up to the probe itself: CLI, site registry and
+# the prober class of every built-in protocol, without touching the network
+STARTUP_SNIPPET = """
+import json, sys
+import main
+from core.protocols import BUILTIN_PROTOCOLS, protocols
+main.PingMonitor()
+for name in BUILTIN_PROTOCOLS:
+    protocols.get(name)
+print(json.dumps(sorted(m for m in ("requests", "peewee") if m in sys.modules)))
+"""
+
+# Modules that must stay out of the startup path
+HEAVY_MODULES = ("requests", "peewee")
+
+
+def parse_importtime(stderr):
+    """
+    Read the output of `python -X importtime`.
+
+    Returns:
+        dict: Cumulative import time in microseconds of each top-level import
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        # Nested imports are indented, keep the ones made by the snippet itself
+        if not name.startswith("  "):
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def measure(runs):
+    """
+    Start a fresh interpreter `runs` times and time the startup path.
+
+    Returns:
+        dict: Median wall and import times in ms, the slowest imports and the heavy modules loaded
+    """
+    walls = []
+    imports = []
+    slowest = {}
+    heavy = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SNIPPET],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        walls.append((time.perf_counter() - started) * 1000)
+        modules = parse_importtime(completed.stderr)
+        imports.append(sum(modules.values()) / 1000)
+        for name, microseconds in modules.items():
+            slowest[name] = min(slowest.get(name, microseconds), microseconds)
+        heavy = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    return {
+        "wall_ms": round(statistics.median(walls), 1),
+        "import_ms": round(statistics.median(imports), 1),
+        "slowest": {name: round(us / 1000, 2) for name, us in sorted(slowest.items(), key=lambda i: -i[1])[:10]},
+        "heavy_modules": heavy,
+    }
+
+
+def last_record(history_file):
+    if not os.path.exists(history_file):
+        return None
+    with open(history_file, "r", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of Ping Monitor")
+    parser.add_argument("--runs", type=int, default=10, help="Interpreters started (the median is kept)")
+    parser.add_argument("--budget-ms", type=float, default=150, help="Maximum median wall time")
+    parser.add_argument("--history", default=os.path.join(ROOT, HISTORY_FILE), help="JSON lines history file")
+    parser.add_argument("--no-record", action="store_true", help="Do not append the result to the history")
+    args = parser.parse_args()
+
+    result = measure(args.runs)
+    previous = last_record(args.history)
+
+    print(f"Startup: {result['wall_ms']} ms wall, {result['import_ms']} ms importing "
+          f"(median of {args.runs} runs, budget {args.budget_ms} ms)")
+    if previous:
+        print(f"Previous run ({previous['date']}): {previous['wall_ms']} ms wall, "
+              f"{result['wall_ms'] - previous['wall_ms']:+.1f} ms")
+    print("Slowest imports:")
+    for name, ms in result["slowest"].items():
+        print(f"  {ms:8.2f} ms  {name}")
+
+    failures = []
+    if result["heavy_modules"]:
+        failures.append(f"heavy modules imported at startup: {', '.join(result['heavy_modules'])}")
+    if result["wall_ms"] > args.budget_ms:
+        failures.append(f"{result['wall_ms']} ms is over the {args.budget_ms} ms budget")
+
+    if not args.no_record:
+        record = dict(result, date=datetime.now().isoformat(timespec="seconds"),
+                      python=sys.version.split()[0], budget_ms=args.budget_ms, passed=not failures)
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
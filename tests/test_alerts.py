@@ -0,0 +1,82 @@
+import unittest
+
+from core.alerts import (
+    CHANGE_DOWN, CHANGE_FLAPPING, CHANGE_STABLE, CHANGE_UP, STATE_DOWN, STATE_UP, AlertPolicy, SiteState, advance
+)
+from core.result import ERROR_TIMEOUT, ProbeResult
+
+
+def result(success: bool, timestamp: float) -> ProbeResult:
+    if success:
+        return ProbeResult(True, 12.5, timestamp=timestamp)
+    return ProbeResult(False, error_class=ERROR_TIMEOUT, error="No answer", timestamp=timestamp)
+
+
+class AdvanceTest(unittest.TestCase):
+    """
+    The UP/DOWN state machine of a site, fed one result per minute.
+    """
+
+    def setUp(self):
+        self.state = SiteState()
+        self.now = 1000.0
+
+    def feed(self, policy: AlertPolicy, outcomes: str) -> list:
+        """Feed results, "S" for a success and "F" for a failure, and return what advance said."""
+        changes = []
+        for outcome in outcomes:
+            changes.append(advance(self.state, policy, "example.com", "http", result(outcome == "S", self.now)))
+            self.now += 60
+        return changes
+
+    def test_down_after_consecutive_failures(self):
+        policy = AlertPolicy(down_after=3, up_after=2)
+        # The first state of a new site is not notified when it is UP
+        self.assertEqual(self.feed(policy, "SS"), [None, None])
+        self.assertEqual(self.state.state, STATE_UP)
+
+        # An isolated failure restarts the streak
+        self.assertEqual(self.feed(policy, "FFSFF"), [None] * 5)
+        first_failure = self.now - 120
+        change, = self.feed(policy, "F")
+        self.assertEqual((change.kind, change.state, change.since), (CHANGE_DOWN, STATE_DOWN, first_failure))
+        self.assertEqual(self.state.down_since, first_failure)
+
+    def test_up_after_consecutive_successes(self):
+        policy = AlertPolicy(down_after=1, up_after=2)
+        change, = self.feed(policy, "F")
+        self.assertEqual(change.kind, CHANGE_DOWN)
+
+        self.assertEqual(self.feed(policy, "SFS"), [None] * 3)
+        first_success = self.now - 60
+        change, = self.feed(policy, "S")
+        self.assertEqual((change.kind, change.state, change.since), (CHANGE_UP, STATE_UP, first_success))
+        self.assertEqual(self.state.changed_at, first_success)
+
+    def test_flapping_is_suppressed(self):
+        policy = AlertPolicy(down_after=1, up_after=1, flap_window=600, flap_threshold=3, flap_suppress=600)
+        changes = self.feed(policy, "SFSF")
+        kinds = [change and change.kind for change in changes]
+        self.assertEqual(kinds, [None, CHANGE_DOWN, CHANGE_UP, CHANGE_FLAPPING])
+        self.assertEqual(changes[-1].transitions, 3)
+
+        # Every change is held back while the site flaps
+        self.assertEqual(self.feed(policy, "SFS"), [None] * 3)
+        self.assertTrue(self.state.flapping)
+
+        # Once the transitions left the window, a single message tells the state
+        changes = self.feed(policy, "S" * 20)
+        stable = [change for change in changes if change is not None]
+        self.assertEqual(len(stable), 1)
+        self.assertEqual((stable[0].kind, stable[0].state, stable[0].suppressed), (CHANGE_STABLE, STATE_UP, 3))
+        self.assertFalse(self.state.flapping)
+
+    def test_policy_from_config(self):
+        policy = AlertPolicy.from_config({"down_after": "5", "flap_window": "120"})
+        self.assertEqual((policy.down_after, policy.up_after, policy.flap_window), (5, 2, 120))
+        with self.assertRaises(ValueError):
+            AlertPolicy.from_config({"up_after": "0"})
+
+
+if __name__ == "__main__":
+    unittest.main()
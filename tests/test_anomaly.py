@@ -0,0 +1,111 @@
+import random
+import unittest
+
+from core.alerts import CHANGE_FAST, CHANGE_SLOW
+from core.anomaly import LATENCY_NORMAL, LATENCY_SLOW, LatencyPolicy, LatencyState, P2Quantile, observe
+from core.result import ERROR_TIMEOUT, ProbeResult
+
+
+class P2QuantileTest(unittest.TestCase):
+    """
+    The streaming quantile against the exact one.
+    """
+
+    def exact(self, values: list, p: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+    def test_tracks_the_exact_quantile(self):
+        rng = random.Random(1)
+        values = [rng.lognormvariate(3, 0.5) for _ in range(5000)]
+        for p in (0.5, 0.95, 0.99):
+            sketch = P2Quantile(p)
+            for value in values:
+                sketch.add(value)
+            self.assertEqual(sketch.count, len(values))
+            self.assertAlmostEqual(sketch.value(), self.exact(values, p), delta=self.exact(values, p) * 0.05)
+
+    def test_first_values_are_exact(self):
+        sketch = P2Quantile(0.5)
+        self.assertIsNone(sketch.value())
+        for value in (30, 10, 20):
+            sketch.add(value)
+        self.assertEqual(sketch.value(), 20)
+
+    def test_saved_sketch_resumes(self):
+        rng = random.Random(2)
+        values = [rng.uniform(10, 50) for _ in range(300)]
+        sketch = P2Quantile(0.95)
+        for value in values[:150]:
+            sketch.add(value)
+        restored = P2Quantile.from_json(0.95, sketch.to_json())
+        for value in values[150:]:
+            sketch.add(value)
+            restored.add(value)
+        self.assertEqual(restored.value(), sketch.value())
+
+    def test_rejects_invalid_quantile(self):
+        with self.assertRaises(ValueError):
+            P2Quantile(1.0)
+
+
+class ObserveTest(unittest.TestCase):
+    """
+    The latency baseline of a site, fed one check per minute.
+    """
+
+    def setUp(self):
+        self.state = LatencyState()
+        self.now = 1000.0
+        self.rng = random.Random(3)
+
+    def feed(self, policy: LatencyPolicy, latencies: list) -> list:
+        changes = []
+        for latency in latencies:
+            if latency is None:
+                result = ProbeResult(False, error_class=ERROR_TIMEOUT, error="No answer", timestamp=self.now)
+            else:
+                result = ProbeResult(True, latency, timestamp=self.now)
+            changes.append(observe(self.state, policy, "example.com", "http", result))
+            self.now += 60
+        return changes
+
+    def normal(self, count: int) -> list:
+        return [self.rng.gauss(20, 1) for _ in range(count)]
+
+    def test_slow_then_fast(self):
+        policy = LatencyPolicy(warmup=20, slow_after=3, fast_after=2)
+        self.assertEqual(self.feed(policy, self.normal(50)), [None] * 50)
+        self.assertAlmostEqual(self.state.mean, 20, delta=1)
+
+        self.assertEqual(self.feed(policy, [200, 200]), [None, None])
+        first_slow = self.now - 120
+        change, = self.feed(policy, [200])
+        self.assertEqual((change.kind, change.state, change.since), (CHANGE_SLOW, LATENCY_SLOW, first_slow))
+        # A degradation barely moves the baseline
+        self.assertLess(change.baseline, 30)
+
+        # Failures carry no latency and do not end the degradation
+        self.assertEqual(self.feed(policy, [None, None]), [None, None])
+        self.assertEqual(self.feed(policy, self.normal(1)), [None])
+        first_normal = self.now - 60
+        change, = self.feed(policy, self.normal(1))
+        self.assertEqual((change.kind, change.state, change.since), (CHANGE_FAST, LATENCY_NORMAL, first_normal))
+        self.assertEqual(change.duration, first_normal - first_slow)
+
+    def test_warmup_judges_nothing(self):
+        policy = LatencyPolicy(warmup=20, slow_after=1)
+        self.assertEqual(self.feed(policy, self.normal(10) + [500] * 10), [None] * 20)
+        self.assertEqual(self.state.state, LATENCY_NORMAL)
+        self.assertEqual(self.state.samples, 20)
+
+    def test_disabled_alerts_still_learn(self):
+        policy = LatencyPolicy.from_config({"latency_alerts": "off", "latency_warmup": "20", "slow_after": "3"})
+        self.assertFalse(policy.enabled)
+        self.assertEqual(self.feed(policy, self.normal(30) + [200] * 5), [None] * 35)
+        self.assertEqual(self.state.samples, 35)
+        self.assertTrue(self.state.streak_slow)
+
+
+if __name__ == "__main__":
+    unittest.main()
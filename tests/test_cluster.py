@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from core.cluster import Cluster
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SITES = [f"site{index}.example.com" for index in range(200)]
+
+# A node probing from another process until it is killed
+NODE_SNIPPET = """
+import sys, time
+from core.cluster import Cluster
+Cluster(sys.argv[1], sys.argv[2], float(sys.argv[3])).start()
+print("joined", flush=True)
+time.sleep(3600)
+"""
+
+
+class ClusterTest(unittest.TestCase):
+    """
+    Nodes sharing a temporary lease file.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cluster.db")
+
+    def wait_for(self, condition, timeout: float = 10.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the cluster")
+            time.sleep(0.05)
+
+    def start_process(self, node: str, ttl: float) -> subprocess.Popen:
+        process = subprocess.Popen([sys.executable, "-c", NODE_SNIPPET, self.path, node, str(ttl)],
+                                   cwd=ROOT, stdout=subprocess.PIPE, text=True)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        self.assertEqual(process.stdout.readline().strip(), "joined")
+        return process
+
+    def test_sites_fail_over_when_a_node_dies(self):
+        ttl = 0.6
+        other = self.start_process("node-b", ttl)
+        node = Cluster(self.path, "node-a", ttl).start()
+        self.addCleanup(node.leave)
+
+        self.wait_for(lambda: node.ring.nodes == ["node-a", "node-b"])
+        owned = node.select(SITES)
+        self.assertTrue(0 < len(owned) < len(SITES))
+
+        # Killed without leaving: its sites move once its lease expires
+        other.kill()
+        killed = time.monotonic()
+        self.wait_for(lambda: node.ring.nodes == ["node-a"])
+        self.assertGreaterEqual(time.monotonic() - killed, ttl / 3)
+        self.assertEqual(node.select(SITES), SITES)
+        self.assertEqual({member["node"]: member["live"] for member in node.members()},
+                         {"node-a": True, "node-b": False})
+
+    def test_leaving_moves_the_sites_at_once(self):
+        now = [1000.0]
+        first = Cluster(self.path, "node-a", 30, clock=lambda: now[0])
+        second = Cluster(self.path, "node-b", 30, clock=lambda: now[0])
+        first.heartbeat()
+        second.heartbeat()
+        first.heartbeat()
+        owned = set(first.select(SITES))
+        self.assertEqual(owned | set(second.select(SITES)), set(SITES))
+        self.assertFalse(owned & set(second.select(SITES)))
+
+        second.leave()
+        first.heartbeat()
+        self.assertEqual(first.select(SITES), SITES)
+        # The sites that stayed with the first node did not move
+        self.assertTrue(owned <= set(first.select(SITES)))
+
+    def test_cron_lease_outlives_the_period(self):
+        def run(*options):
+            return subprocess.run([sys.executable, "main.py", "--cluster", self.path, *options],
+                                  cwd=ROOT, capture_output=True, text=True)
+
+        self.assertIn("--period", run("ping", "--all").stderr)
+        refused = run("--cluster-ttl", "60", "ping", "--all", "--period", "60")
+        self.assertEqual(refused.returncode, 2)
+        self.assertIn("above the --period", refused.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import time
+import unittest
+
+from bench.standins import BotAPIStandIn
+from core.alerts import CHANGE_DOWN, STATE_DOWN, StateChange
+from core.result import ERROR_TIMEOUT, ProbeResult
+from reporters.dispatcher import AlertDispatcher
+
+
+def down(site: str) -> StateChange:
+    result = ProbeResult.failure(ERROR_TIMEOUT, "No answer")
+    return StateChange(CHANGE_DOWN, site, "http", STATE_DOWN, time.time(), result)
+
+
+class AlertDispatcherTest(unittest.TestCase):
+    """
+    The dispatcher against a local Bot API, see bench.standins.BotAPIStandIn.
+    """
+
+    def setUp(self):
+        self.api = BotAPIStandIn().start()
+        self.addCleanup(self.api.stop)
+
+    def dispatcher(self, **options) -> AlertDispatcher:
+        dispatcher = AlertDispatcher(**options)
+        self.addCleanup(dispatcher.close)
+        return dispatcher
+
+    def reporter(self, chat_id: str = "42") -> dict:
+        return {"type": "telegram", "bot_token": "123:abc", "chat_id": chat_id, "api_url": self.api.api_url}
+
+    def wait_for(self, condition, timeout: float = 5.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail(f"Timed out, the Bot API received {self.api.requests}")
+            time.sleep(0.01)
+
+    def test_coalesces_changes_of_a_chat(self):
+        dispatcher = self.dispatcher(coalesce_window=0.3, min_interval=0)
+        for site in ("alpha", "beta", "gamma"):
+            self.assertTrue(dispatcher.submit(self.reporter(), down(site)))
+        dispatcher.submit(self.reporter("7"), down("delta"))
+        self.wait_for(lambda: len(self.api.messages) == 2)
+
+        by_chat = {message["chat_id"]: message["text"] for message in self.api.messages}
+        self.assertIn("3 sites changed state, 3 went down", by_chat["42"])
+        for site in ("alpha", "beta", "gamma"):
+            self.assertIn(site, by_chat["42"])
+        self.assertIn("delta", by_chat["7"])
+        self.assertEqual(dispatcher.stats()["messages_sent"], 2)
+
+    def test_min_interval_per_chat(self):
+        dispatcher = self.dispatcher(coalesce_window=0, min_interval=0.5)
+        dispatcher.submit(self.reporter(), down("alpha"))
+        self.wait_for(lambda: len(self.api.messages) == 1)
+        dispatcher.submit(self.reporter(), down("beta"))
+        dispatcher.submit(self.reporter("7"), down("gamma"))
+        self.wait_for(lambda: len(self.api.messages) == 3)
+
+        arrivals = {}
+        for arrival, _, body, _ in self.api.requests:
+            arrivals.setdefault(body["chat_id"], []).append(arrival)
+        first, second = arrivals["42"]
+        self.assertGreaterEqual(second - first, 0.5)
+        # Another chat is not held back by the interval of the first one
+        self.assertLess(arrivals["7"][0] - first, 0.5)
+
+    def test_retries_after_rate_limit(self):
+        self.api.rate_limited, self.api.retry_after = 1, 1
+        dispatcher = self.dispatcher(coalesce_window=0, min_interval=0, backoff=0.05)
+        dispatcher.submit(self.reporter(), down("alpha"))
+        self.wait_for(lambda: len(self.api.messages) == 1)
+
+        (refused, _, _, status), (accepted, _, body, _) = self.api.requests
+        self.assertEqual(status, 429)
+        self.assertIn("alpha", body["text"])
+        # The retry waits for retry_after, not for the much shorter backoff
+        self.assertGreaterEqual(accepted - refused, 1.0)
+        stats = dispatcher.stats()
+        self.assertEqual((stats["retries"], stats["messages_sent"], stats["messages_failed"]), (1, 1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from core.result import ERROR_TIMEOUT, ProbeResult
+from data.models.db import PingMonitorDB
+from data.writer import BatchWriter
+
+# Out of the range of datetime, the database rejects such a result
+BAD_TIMESTAMP = 1e20
+
+
+class BatchWriterTest(unittest.TestCase):
+    """
+    The writer against a temporary database file, flushed by hand.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db = PingMonitorDB(os.path.join(directory.name, "pings.db"))
+        self.addCleanup(self.db.close)
+        self.writer = BatchWriter(self.db, max_batch=10 ** 6, max_delay=3600, max_attempts=2)
+        self.addCleanup(self.writer.close)
+
+    def stored(self) -> int:
+        return self.db.PingResultV2.select().count()
+
+    def add(self, count: int, timestamp: float = None) -> None:
+        for index in range(count):
+            self.writer.add(f"site{index}", "http", ProbeResult(True, 12.5, timestamp=timestamp))
+
+    def test_rejected_results_do_not_block_the_batch(self):
+        self.add(5)
+        bad = ProbeResult(False, error_class=ERROR_TIMEOUT, error="No answer", timestamp=BAD_TIMESTAMP)
+        self.writer.add("bad", "http", bad)
+        self.add(4)
+
+        self.assertEqual(self.writer.flush(), 9)
+        self.assertEqual(self.stored(), 9)
+        self.assertEqual(self.writer.rows_dropped, 0)
+
+        # Retried alone with the next flush, then dropped after max_attempts writes
+        self.add(3)
+        self.assertEqual(self.writer.flush(), 3)
+        self.assertEqual(self.stored(), 12)
+        self.assertEqual(self.writer.rows_dropped, 1)
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(self.writer.rows_dropped, 1)
+
+    def test_reads_close_the_connection_of_the_caller(self):
+        self.add(1)
+        self.writer.flush()
+
+        def check():
+            self.writer.get_site_state("site0", "http")
+            self.writer.outage_start("site0", "http", 0)
+            self.closed = self.db.db.is_closed()
+
+        thread = threading.Thread(target=check)
+        thread.start()
+        thread.join()
+        self.assertTrue(self.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
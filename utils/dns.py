@@ -1,23 +1,449 @@
+import asyncio
+import ipaddress
+import random
 import socket
+import struct
+import threading
 import time
 
+from core.result import ERROR_ASSERTION, ERROR_DNS, ERROR_STATUS, ERROR_TIMEOUT, ProbeResult, classify_error
+
 
 class DNSPing:
     def __init__(self, host):
         self.host = host
-        self.result = self.ping()
 
     def ping(self):
         start_time = time.perf_counter()
         try:
             ip = socket.gethostbyname(self.host)
-            success = True
-        except socket.gaierror:
-            ip = None
-            success = False
-        response_time = (time.perf_counter() - start_time) * 1000
-        return {
-            "success": success,
-            "ip": ip,
-            "response_time_ms": response_time
-        }
+        except socket.gaierror as e:
+            return ProbeResult.failure(ERROR_DNS, str(e), payload={"ip": None})
+        response_time = round((time.perf_counter() - start_time) * 1000, 3)
+        return ProbeResult(True, response_time, output=f"{self.host} resolves to {ip}", payload={"ip": ip})
+
+
+RECORD_TYPES = {
+    "A": 1,
+    "NS": 2,
+    "CNAME": 5,
+    "SOA": 6,
+    "PTR": 12,
+    "MX": 15,
+    "TXT": 16,
+    "AAAA": 28,
+    "SRV": 33,
+}
+RECORD_NAMES = {value: key for key, value in RECORD_TYPES.items()}
+RCODES = {0: "NOERROR", 1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP", 5: "REFUSED"}
+RCODE_NUMBERS = {value: key for key, value in RCODES.items()}
+
+
+def system_nameserver():
+    """
+    Return the first nameserver of /etc/resolv.conf, None if there is none.
+    """
+    try:
+        with open("/etc/resolv.conf", "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    return parts[1]
+    except OSError:
+        pass
+    return None
+
+
+def build_query(name, record_type, query_id):
+    """
+    Encode a recursive DNS query for one name and record type.
+    """
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    question = b"".join(
+        bytes([len(label)]) + label for label in name.rstrip(".").encode("idna").split(b".") if label
+    )
+    return header + question + b"\x00" + struct.pack("!HH", RECORD_TYPES[record_type], 1)
+
+
+def _read_name(data, offset):
+    labels = []
+    end = None
+    for _ in range(128):  # Bound the number of labels and compression jumps
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            return ".".join(labels), end if end is not None else offset
+        labels.append(data[offset:offset + length].decode("ascii", "replace"))
+        offset += length
+    raise ValueError("Invalid DNS name compression")
+
+
+def _decode_rdata(data, offset, length, record_type):
+    rdata = data[offset:offset + length]
+    if record_type == RECORD_TYPES["A"]:
+        return socket.inet_ntop(socket.AF_INET, rdata)
+    if record_type == RECORD_TYPES["AAAA"]:
+        return socket.inet_ntop(socket.AF_INET6, rdata)
+    if record_type in (RECORD_TYPES["CNAME"], RECORD_TYPES["NS"], RECORD_TYPES["PTR"]):
+        return _read_name(data, offset)[0]
+    if record_type == RECORD_TYPES["MX"]:
+        return f"{struct.unpack('!H', rdata[:2])[0]} {_read_name(data, offset + 2)[0]}"
+    if record_type == RECORD_TYPES["SRV"]:
+        priority, weight, port = struct.unpack("!HHH", rdata[:6])
+        return f"{priority} {weight} {port} {_read_name(data, offset + 6)[0]}"
+    if record_type == RECORD_TYPES["TXT"]:
+        strings = []
+        position = 0
+        while position < len(rdata):
+            size = rdata[position]
+            strings.append(rdata[position + 1:position + 1 + size].decode("utf-8", "replace"))
+            position += 1 + size
+        return "".join(strings)
+    if record_type == RECORD_TYPES["SOA"]:
+        mname, position = _read_name(data, offset)
+        rname, position = _read_name(data, position)
+        serial = struct.unpack("!I", data[position:position + 4])[0]
+        return f"{mname} {rname} {serial}"
+    return rdata.hex()
+
+
+def parse_response(data):
+    """
+    Decode a DNS response.
+
+    Returns:
+        dict: 'id', 'rcode' name, 'truncated' flag and 'answers' as
+              (name, record type, ttl, value) tuples
+    """
+    query_id, flags, qdcount, ancount, _, _ = struct.unpack("!HHHHHH", data[:12])
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = _read_name(data, offset)
+        offset += 4
+
+    answers = []
+    for _ in range(ancount):
+        name, offset = _read_name(data, offset)
+        record_type, _, ttl, length = struct.unpack("!HHIH", data[offset:offset + 10])
+        offset += 10
+        value = _decode_rdata(data, offset, length, record_type)
+        answers.append((name, RECORD_NAMES.get(record_type, str(record_type)), ttl, value))
+        offset += length
+
+    rcode = flags & 0x000F
+    return {
+        "id": query_id,
+        "rcode": RCODES.get(rcode, str(rcode)),
+        "truncated": bool(flags & 0x0200),
+        "answers": answers,
+    }
+
+
+class _DNSClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, query_id):
+        self.query_id = query_id
+        self.response = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        # Ignore stray datagrams that do not answer our query
+        if len(data) >= 12 and struct.unpack("!H", data[:2])[0] == self.query_id and not self.response.done():
+            self.response.set_result(data)
+
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+
+async def query(name, record_type="A", server=None, port=53, timeout=2.0):
+    """
+    Send one DNS query, over UDP with a TCP retry when the answer is truncated.
+
+    Parameters:
+        name (str): Name to look up
+        record_type (str): Record type such as A, AAAA, MX or TXT
+        server (str): Nameserver address, the system one by default
+        port (int): Nameserver port
+        timeout (float): Timeout in seconds for each attempt
+
+    Returns:
+        dict: Response as returned by parse_response
+    """
+    server = server or system_nameserver()
+    if not server:
+        raise OSError("No DNS server configured")
+    record_type = record_type.upper()
+    if record_type not in RECORD_TYPES:
+        raise ValueError(f"Unsupported record type: {record_type}")
+
+    loop = asyncio.get_running_loop()
+    query_id = random.getrandbits(16)
+    packet = build_query(name, record_type, query_id)
+
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: _DNSClientProtocol(query_id), remote_addr=(server, port)
+    )
+    try:
+        transport.sendto(packet)
+        data = await asyncio.wait_for(protocol.response, timeout)
+    finally:
+        transport.close()
+
+    response = parse_response(data)
+    if not response["truncated"]:
+        return response
+
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(server, port), timeout)
+    try:
+        writer.write(struct.pack("!H", len(packet)) + packet)
+        await writer.drain()
+        length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), timeout))[0]
+        return parse_response(await asyncio.wait_for(reader.readexactly(length), timeout))
+    finally:
+        writer.close()
+
+
+class AsyncDNSPing:
+    def __init__(self, server=None, record_type="A", timeout=2.0, port=53):
+        """
+        DNS prober querying a chosen server directly, never through the resolver cache.
+
+        Parameters:
+            server (str): Nameserver address, the system one by default
+            record_type (str): Record type to query (default A)
+            timeout (float): Timeout in seconds (default 2)
+            port (int): Nameserver port (default 53)
+        """
+        self.server = server or system_nameserver()
+        self.record_type = record_type.upper()
+        self.timeout = timeout
+        self.port = port
+
+    async def ping(self, name, expected=None):
+        """
+        Query a name and measure the response time.
+
+        Parameters:
+            name (str): Name to look up
+            expected (str): Value that must be among the answers, if given
+
+        Returns:
+            ProbeResult: Successful on a NOERROR answer of the requested type (containing
+                         the expected value, if any), with the response time and the
+                         numeric response code. The payload holds 'rcode' (its name,
+                         None if no response was received), 'answers' (values of the
+                         answers of the requested type), 'ttl' (lowest TTL among them)
+                         and 'server' (nameserver queried); the output lists the
+                         answers in zone-file like form.
+        """
+        start = time.perf_counter()
+        try:
+            response = await query(name, self.record_type, self.server, self.port, self.timeout)
+        except asyncio.TimeoutError:
+            error_class, error = ERROR_TIMEOUT, f"No answer from {self.server} after {self.timeout}s"
+        except (OSError, ValueError, struct.error, IndexError, asyncio.IncompleteReadError) as e:
+            error_class, error = classify_error(e), str(e) or e.__class__.__name__
+        else:
+            elapsed = round((time.perf_counter() - start) * 1000, 3)
+            records = [answer for answer in response["answers"] if answer[1] == self.record_type]
+            values = [answer[3] for answer in records]
+            rcode = response["rcode"]
+            error_class = error = None
+            if rcode != "NOERROR" or not values:
+                error_class, error = ERROR_STATUS, f"{rcode}: no {self.record_type} records for {name}"
+            elif expected is not None and expected not in values:
+                error_class, error = ERROR_ASSERTION, f"Expected {expected} not found in {', '.join(values)}"
+            return ProbeResult(
+                error is None, elapsed, RCODE_NUMBERS.get(rcode, int(rcode) if rcode.isdigit() else None),
+                error_class, error,
+                "\n".join(f"{n} {ttl} IN {t} {v}" for n, t, ttl, v in response["answers"])
+                or f"{rcode}: no {self.record_type} records for {name}",
+                {
+                    "rcode": rcode,
+                    "answers": values,
+                    "ttl": min((answer[2] for answer in records), default=None),
+                    "server": self.server,
+                },
+            )
+
+        return ProbeResult.failure(error_class, error, payload={
+            "rcode": None, "answers": [], "ttl": None, "server": self.server
+        })
+
+
+class ResolverCache:
+    def __init__(self, default_ttl=60, min_ttl=5, max_ttl=3600, negative_ttl=30, nameserver=None, port=53):
+        """
+        Process-wide address cache honouring DNS record TTLs.
+
+        Names are resolved by the system resolver, so the hosts file, search
+        domains and IPv6 addresses behave as for any other program. The
+        nameserver is then asked for the same records only to learn their TTL;
+        when its answer differs (hosts file entries, split horizon, no
+        nameserver) the addresses are kept for `default_ttl` seconds.
+
+        Parameters:
+            default_ttl (int): Seconds to keep addresses whose TTL is unknown
+            min_ttl (int): Lower bound applied to record TTLs
+            max_ttl (int): Upper bound applied to record TTLs
+            negative_ttl (int): Seconds to remember names that failed to resolve
+            nameserver (str): Nameserver asked for TTLs, the system one by default
+            port (int): Nameserver port
+        """
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.nameserver = nameserver
+        self.port = port
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # name -> (expires_at, addresses or OSError)
+        self._inflight = {}
+        self._nameserver_retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def _cached(self, host):
+        entry = self._entries.get(host)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        if isinstance(entry[1], OSError):
+            raise entry[1]
+        return entry[1]
+
+    def _store(self, host, addresses, ttl):
+        with self._lock:
+            self._entries[host] = (time.monotonic() + ttl, addresses)
+
+    async def _lookup(self, host):
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except OSError as e:
+            self._store(host, e, self.negative_ttl)
+            raise
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+
+        ttl = self.default_ttl
+        # Single-label names belong to the hosts file or search domains
+        if "." in host.rstrip(".") and time.monotonic() >= self._nameserver_retry_at:
+            record_types = sorted({"AAAA" if ":" in address else "A" for address in addresses})
+            try:
+                responses = await asyncio.gather(*(
+                    query(host, record_type, self.nameserver, self.port, timeout=1.0) for record_type in record_types
+                ))
+                records = [answer for response, record_type in zip(responses, record_types)
+                           for answer in response["answers"] if answer[1] == record_type]
+                # The TTL only applies when the nameserver gave the addresses the system resolver did
+                if records and {answer[3] for answer in records} == set(addresses):
+                    ttl = min(max(min(answer[2] for answer in records), self.min_ttl), self.max_ttl)
+            except (asyncio.TimeoutError, OSError):
+                # Do not pay the timeout on every miss while the nameserver is unreachable
+                self._nameserver_retry_at = time.monotonic() + self.negative_ttl
+            except (ValueError, struct.error, IndexError):
+                pass
+        self._store(host, addresses, ttl)
+        return addresses
+
+    async def resolve(self, host):
+        """
+        Return the addresses of a host, from the cache while its TTL lasts.
+
+        Raises:
+            OSError: If the host cannot be resolved
+        """
+        if _is_ip(host):
+            return [host]
+        addresses = self._cached(host)
+        if addresses is not None:
+            return addresses
+
+        # Concurrent lookups of the same name on the same loop share one query
+        loop = asyncio.get_running_loop()
+        pending = self._inflight.get(host)
+        if pending is not None and pending.get_loop() is loop:
+            return await asyncio.shield(pending)
+        task = loop.create_task(self._lookup(host))
+        self._inflight[host] = task
+        try:
+            return await task
+        finally:
+            if self._inflight.get(host) is task:
+                del self._inflight[host]
+
+    def resolve_blocking(self, host):
+        """
+        Blocking variant of resolve for synchronous probers.
+        """
+        if _is_ip(host):
+            return [host]
+        addresses = self._cached(host)
+        if addresses is not None:
+            return addresses
+        try:
+            infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except OSError as e:
+            self._store(host, e, self.negative_ttl)
+            raise
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        self._store(host, addresses, self.default_ttl)
+        return addresses
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _is_ip(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+# Shared by every prober of the process; DNS probes never use it
+resolver_cache = ResolverCache()
+
+
+class DNSProber:
+    """
+    Prober of the `dns` protocol, bypassing the resolver cache.
+    """
+
+    def __init__(self, config):
+        """
+        Parameters:
+            config (dict): Site configuration; `site`, `dns_server`, `dns_port`,
+                           `record_type`, `expected` and `timeout` in seconds are used
+        """
+        self.config = config
+
+    def ping(self):
+        """
+        Returns:
+            ProbeResult: Result as returned by AsyncDNSPing.ping
+        """
+        from core.loop import run_coroutine
+
+        config = self.config
+        prober = AsyncDNSPing(
+            server=config.get("dns_server"),
+            record_type=config.get("record_type", "A"),
+            timeout=float(config.get("timeout", 2)),
+            port=int(config.get("dns_port", 53)),
+        )
+        return run_coroutine(prober.ping(config["site"], config.get("expected")))
+
+
+def ping(config):
+    """
+    Probe the DNS resolution of a site, see DNSProber.
+    """
+    return DNSProber(config).ping()
@@ -1,27 +1,506 @@
-import requests
+import asyncio
+import re
+import ssl
 import time
+from urllib.parse import urlsplit
 
+from core.result import ERROR_ASSERTION, ERROR_STATUS, ERROR_TIMEOUT, ProbeResult, classify_error
+from utils.dns import resolver_cache
 
-class HTTPPing:
-    def __init__(self, target):
-        if target.startswith("http://") or target.startswith("https://"):
-            self.target = target
+
+def _normalize_url(target):
+    if target.startswith("http://") or target.startswith("https://"):
+        return target
+    return "http://" + target
+
+
+def _elapsed_ms(start, end):
+    return round((end - start) * 1000, 3)
+
+
+class HTTPConnectionPool:
+    def __init__(self, max_idle_per_origin=4, idle_timeout=30):
+        """
+        Keep-alive connections reused across requests to the same origin.
+
+        Parameters:
+            max_idle_per_origin (int): Idle connections kept per (scheme, host, port)
+            idle_timeout (float): Seconds after which an idle connection is discarded
+        """
+        self.max_idle_per_origin = max_idle_per_origin
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl.create_default_context()
+        self._idle = {}
+
+    def acquire(self, origin):
+        """
+        Take an idle connection to the origin, if one is still usable.
+
+        Returns:
+            tuple: (reader, writer), or None when a new connection is needed
+        """
+        idle = self._idle.get(origin)
+        now = time.monotonic()
+        while idle:
+            reader, writer, released_at = idle.pop()
+            if now - released_at > self.idle_timeout or writer.is_closing() or reader.at_eof():
+                writer.close()
+                continue
+            return reader, writer
+        return None
+
+    def release(self, origin, reader, writer):
+        """
+        Give a connection back to the pool once its response was fully read.
+        """
+        idle = self._idle.setdefault(origin, [])
+        if writer.is_closing() or len(idle) >= self.max_idle_per_origin:
+            writer.close()
+            return
+        idle.append((reader, writer, time.monotonic()))
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        for idle in self._idle.values():
+            for _, writer, _ in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class BodyCheck:
+    def __init__(self, contains=(), not_contains=(), regex=(), not_regex=(), max_size=None,
+                 read_limit=1048576, regex_window=1024):
+        """
+        Content assertions evaluated incrementally over a streamed response body.
+
+        Parameters:
+            contains (list): Keywords that must appear in the body
+            not_contains (list): Keywords that must not appear in the body
+            regex (list): Regular expressions that must match the body
+            not_regex (list): Regular expressions that must not match the body
+            max_size (int): Maximum body size in bytes, larger bodies fail
+            read_limit (int): Bytes read at most, assertions only cover this prefix
+            regex_window (int): Bytes kept between chunks so regex matches may span them
+        """
+        self.rules = []
+        for keyword in contains:
+            self.rules.append((re.compile(re.escape(keyword.encode())), True, f"keyword '{keyword}'"))
+        for keyword in not_contains:
+            self.rules.append((re.compile(re.escape(keyword.encode())), False, f"keyword '{keyword}'"))
+        for pattern in regex:
+            self.rules.append((re.compile(pattern.encode()), True, f"pattern '{pattern}'"))
+        for pattern in not_regex:
+            self.rules.append((re.compile(pattern.encode()), False, f"pattern '{pattern}'"))
+        self.max_size = max_size
+        self.read_limit = read_limit
+
+        overlaps = [len(keyword.encode()) - 1 for keyword in list(contains) + list(not_contains)]
+        if regex or not_regex:
+            overlaps.append(regex_window)
+        self.overlap = max(overlaps, default=0)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build the assertions of a site configuration, None if it defines none.
+
+        Parameters:
+            config (dict): Site configuration; `body_contains`, `body_not_contains`,
+                           `body_regex`, `body_not_regex`, `max_body_size` and
+                           `body_read_limit` are used
+        """
+        keys = ("body_contains", "body_not_contains", "body_regex", "body_not_regex")
+        if not any(config.get(key) for key in keys + ("max_body_size",)):
+            return None
+        values = {key: [config[key]] if config.get(key) else [] for key in keys}
+        return cls(
+            contains=values["body_contains"],
+            not_contains=values["body_not_contains"],
+            regex=values["body_regex"],
+            not_regex=values["body_not_regex"],
+            max_size=int(config["max_body_size"]) if config.get("max_body_size") else None,
+            read_limit=int(config.get("body_read_limit", 1048576)),
+        )
+
+    def start(self):
+        """
+        Create the evaluation state for one response.
+        """
+        return _BodyScan(self)
+
+
+class _BodyScan:
+    def __init__(self, check):
+        self.check = check
+        self.size = 0
+        self.found = set()
+        self.failure = None
+        self.size_ok = check.max_size is None
+        self._tail = b""
+
+    def expect_length(self, length):
+        """
+        Apply the size limit to a length announced by the Content-Length header.
+        """
+        if self.check.max_size is None:
+            return
+        if length > self.check.max_size:
+            self.failure = f"Body of {length} bytes exceeds {self.check.max_size} bytes"
         else:
-            self.target = "http://" + target
+            self.size_ok = True
 
-    def ping(self):
-        success = False
-        response_time = None
-        http_code = None
+    @property
+    def decided(self):
+        """
+        Whether the outcome is known without reading more of the body.
+        """
+        if self.failure is not None:
+            return True
+        return self.size_ok and all(
+            index in self.found for index, (_, must_match, _) in enumerate(self.check.rules) if must_match
+        ) and all(must_match for _, must_match, _ in self.check.rules)
+
+    def feed(self, chunk):
+        """
+        Evaluate the next chunk of the body.
+
+        Returns:
+            bool: True once the outcome is decided and reading can stop
+        """
+        self.size += len(chunk)
+        if self.check.max_size is not None and self.size > self.check.max_size:
+            self.failure = f"Body exceeds {self.check.max_size} bytes"
+            return True
+
+        buffer = self._tail + chunk
+        for index, (pattern, must_match, label) in enumerate(self.check.rules):
+            if index in self.found or not pattern.search(buffer):
+                continue
+            self.found.add(index)
+            if not must_match:
+                self.failure = f"Unexpected {label} found in body"
+                return True
+        self._tail = buffer[-self.check.overlap:] if self.check.overlap else b""
+        return self.decided
+
+    def finish(self, truncated=False):
+        """
+        Conclude once the body ended or the read limit was reached.
+
+        Returns:
+            str: Failure message, None if every assertion passed
+        """
+        if self.failure is None:
+            for index, (_, must_match, label) in enumerate(self.check.rules):
+                if must_match and index not in self.found:
+                    scope = f"first {self.size} bytes" if truncated else "body"
+                    self.failure = f"Expected {label} not found in {scope}"
+                    break
+        return self.failure
+
+
+class _StaleConnection(Exception):
+    """A pooled connection was closed by the server before answering."""
+
+
+class AsyncHTTPPing:
+    def __init__(self, pool=None, timeout=10, method="GET", cold=False, expected_status=(200,), body_check=None):
+        """
+        Asynchronous HTTP prober with per-phase timing.
+
+        Parameters:
+            pool (HTTPConnectionPool): Pool shared between probes, a private one by default
+            timeout (float): Timeout in seconds for the whole request
+            method (str): HTTP method of the request
+            cold (bool): Always open a new connection and close it afterwards
+            expected_status (tuple): HTTP codes considered a success
+            body_check (BodyCheck): Assertions on the streamed body; reading stops,
+                                    and the connection is closed, once they are decided
+        """
+        self.pool = pool if pool is not None else HTTPConnectionPool()
+        self.timeout = timeout
+        self.method = method.upper()
+        self.cold = cold
+        self.expected_status = tuple(expected_status)
+        self.body_check = body_check
+
+    async def _connect(self, scheme, host, port, timings):
+        start = time.perf_counter()
+        address = (await resolver_cache.resolve(host))[0]
+        resolved = time.perf_counter()
+        timings["dns_ms"] = _elapsed_ms(start, resolved)
+
+        if scheme == "https" and not hasattr(asyncio.StreamWriter, "start_tls"):
+            # Before Python 3.11 the handshake cannot be timed apart from the TCP connect
+            reader, writer = await asyncio.open_connection(
+                address, port, ssl=self.pool.ssl_context, server_hostname=host
+            )
+            timings["connect_ms"] = _elapsed_ms(resolved, time.perf_counter())
+            return reader, writer
+
+        reader, writer = await asyncio.open_connection(address, port)
+        connected = time.perf_counter()
+        timings["connect_ms"] = _elapsed_ms(resolved, connected)
+
+        if scheme == "https":
+            await writer.start_tls(self.pool.ssl_context, server_hostname=host)
+            timings["tls_ms"] = _elapsed_ms(connected, time.perf_counter())
+        return reader, writer
+
+    async def _read_head(self, reader, reused):
+        status_line = await reader.readline()
+        if not status_line:
+            if reused:
+                raise _StaleConnection()
+            raise ConnectionError("Connection closed before any response")
+        first_byte = time.perf_counter()
 
+        parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ValueError(f"Invalid HTTP status line: {status_line!r}")
+        version, status = parts[0], int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return first_byte, status, reason, headers, keep_alive
+
+    async def _iter_body(self, reader, status, headers):
+        """
+        Yield the response body in chunks as it arrives.
+        """
+        if self.method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    # Skip trailers up to the empty line closing the message
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+        elif "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining > 0:
+                chunk = await reader.read(min(remaining, 65536))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            # Body delimited by the end of the connection
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                yield chunk
+
+    async def _request(self, url, timings):
+        parts = urlsplit(url)
+        scheme = parts.scheme
+        host = parts.hostname
+        if not host:
+            raise ValueError(f"Invalid URL: {url}")
+        port = parts.port or (443 if scheme == "https" else 80)
+        origin = (scheme, host, port)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        host_header = f"[{host}]" if ":" in host else host
+        if parts.port:
+            host_header += f":{parts.port}"
+
+        request = (
+            f"{self.method} {path} HTTP/1.1\r\n"
+            f"Host: {host_header}\r\n"
+            "User-Agent: PingMonitor\r\n"
+            "Accept: */*\r\n"
+            f"Connection: {'close' if self.cold else 'keep-alive'}\r\n"
+            "\r\n"
+        ).encode("latin-1")
+
+        pooled = None if self.cold else self.pool.acquire(origin)
+        while True:
+            reused = pooled is not None
+            if reused:
+                reader, writer = pooled
+            else:
+                reader, writer = await self._connect(scheme, host, port, timings)
+
+            sent = time.perf_counter()
+            try:
+                writer.write(request)
+                await writer.drain()
+                first_byte, status, reason, headers, keep_alive = await self._read_head(reader, reused)
+            except (_StaleConnection, ConnectionResetError, BrokenPipeError):
+                writer.close()
+                if not reused:
+                    raise
+                # The server dropped the idle connection, retry once on a new one
+                pooled = None
+                continue
+            except BaseException:
+                # Timeouts cancel the request here too, never leave the socket open
+                writer.close()
+                raise
+            break
+
+        timings["ttfb_ms"] = _elapsed_ms(sent, first_byte)
+
+        scan = self.body_check.start() if self.body_check is not None else None
+        if scan is not None and "content-length" in headers:
+            scan.expect_length(int(headers["content-length"]))
+
+        body_size = 0
+        complete = True
+        try:
+            if scan is None or not scan.decided:
+                async for chunk in self._iter_body(reader, status, headers):
+                    if scan is not None:
+                        remaining = self.body_check.read_limit - body_size
+                        body_size += min(len(chunk), remaining)
+                        if scan.feed(chunk[:remaining]) or body_size >= self.body_check.read_limit:
+                            complete = False
+                            break
+                    else:
+                        body_size += len(chunk)
+            elif self.method != "HEAD":
+                complete = False
+        except BaseException:
+            writer.close()
+            raise
+        failure = scan.finish(truncated=not complete) if scan is not None else None
+
+        # Only a response whose end is known leaves the connection ready for the next request
+        delimited = (
+            self.method == "HEAD"
+            or status in (204, 304)
+            or "content-length" in headers
+            or "chunked" in headers.get("transfer-encoding", "").lower()
+        )
+        if keep_alive and delimited and complete and not self.cold:
+            self.pool.release(origin, reader, writer)
+        else:
+            writer.close()
+
+        return status, reason, reused, body_size, failure
+
+    async def ping(self, target):
+        """
+        Send one HTTP request and measure each phase.
+
+        Parameters:
+            target (str): URL or hostname, http:// is assumed when no scheme is given
+
+        Returns:
+            ProbeResult: Successful if the status code was expected and the body
+                         assertions passed, with the total request time and the HTTP
+                         status code. The payload holds 'timings' (dns_ms, connect_ms,
+                         tls_ms, ttfb_ms and total_ms; phases skipped on a reused
+                         connection are None, dns_ms is close to zero when the name
+                         was cached) and 'reused_connection'.
+        """
+        url = _normalize_url(target)
+        timings = {"dns_ms": None, "connect_ms": None, "tls_ms": None, "ttfb_ms": None, "total_ms": None}
+        start = time.perf_counter()
         try:
-            start = time.time()
-            r = requests.get(self.target)
-            response_time = time.time() - start
-            http_code = r.status_code
-            # Se considera exitoso si el código HTTP es 200.
-            success = (http_code == 200)
-        except requests.RequestException:
-            success = False
-
-        return success, response_time, http_code
+            status, reason, reused, body_size, failure = await asyncio.wait_for(
+                self._request(url, timings), self.timeout
+            )
+        except asyncio.TimeoutError:
+            timings["total_ms"] = _elapsed_ms(start, time.perf_counter())
+            return ProbeResult.failure(ERROR_TIMEOUT, f"Timeout after {self.timeout}s",
+                                       payload={"timings": timings, "reused_connection": False})
+        except (OSError, ssl.SSLError, ValueError, asyncio.IncompleteReadError) as e:
+            timings["total_ms"] = _elapsed_ms(start, time.perf_counter())
+            return ProbeResult.failure(classify_error(e), str(e) or e.__class__.__name__,
+                                       payload={"timings": timings, "reused_connection": False})
+
+        timings["total_ms"] = _elapsed_ms(start, time.perf_counter())
+        error_class = error = None
+        if status not in self.expected_status:
+            error_class, error = ERROR_STATUS, f"Unexpected HTTP status {status}"
+        elif failure is not None:
+            error_class, error = ERROR_ASSERTION, failure
+        return ProbeResult(
+            error is None, timings["total_ms"], status, error_class, error,
+            f"HTTP {status} {reason} from {url} ({body_size} bytes read)",
+            {"timings": timings, "reused_connection": reused},
+        )
+
+    async def ping_many(self, targets, concurrency=100):
+        """
+        Probe many URLs concurrently.
+
+        Parameters:
+            targets (list): URLs or hostnames
+            concurrency (int): Maximum number of requests in flight
+
+        Returns:
+            dict: ProbeResult per target
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe(target):
+            async with semaphore:
+                return target, await self.ping(target)
+
+        return dict(await asyncio.gather(*(probe(target) for target in dict.fromkeys(targets))))
+
+
+_shared_pool = None
+
+
+class HTTPProber:
+    """
+    Prober of the `http` protocol, reusing pooled connections between calls.
+    """
+
+    def __init__(self, config):
+        """
+        Parameters:
+            config (dict): Site configuration; `url` (or `site`), `timeout` in seconds,
+                           `method` (HEAD for availability only), `cold_connection` and
+                           the body assertions read by BodyCheck.from_config are used
+        """
+        self.config = config
+
+    def ping(self):
+        """
+        Returns:
+            ProbeResult: Result as returned by AsyncHTTPPing.ping
+        """
+        from core.loop import run_coroutine
+
+        global _shared_pool
+        if _shared_pool is None:
+            _shared_pool = HTTPConnectionPool()
+
+        config = self.config
+        prober = AsyncHTTPPing(
+            pool=_shared_pool,
+            timeout=float(config.get("timeout", 10)),
+            method=config.get("method", "GET"),
+            cold=config.get("cold_connection", "false").lower() in ("1", "true", "yes"),
+            body_check=BodyCheck.from_config(config),
+        )
+        return run_coroutine(prober.ping(config.get("url") or config["site"]))
+
+
+def ping(config):
+    """
+    Probe the URL of a site configuration, see HTTPProber.
+    """
+    return HTTPProber(config).ping()
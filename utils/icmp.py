@@ -1,66 +1,283 @@
-from pythonping import ping as python_ping
+import os
+import select
+import socket
+import struct
+import time
 
+from core.result import ERROR_DNS, ERROR_TIMEOUT, ProbeResult, latency_stats
+from utils.dns import resolver_cache
 
-class ICMPPing:
-    def __init__(self, host):
-        self.host = host
 
-    def ping(self, count=1, timeout=1000):
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+
+def format_stats(host, stats):
+    """
+    Summarize the statistics of a ping the way the ping command does.
+
+    Parameters:
+        host (str): Host pinged
+        stats (dict): Statistics returned by core.result.latency_stats
+
+    Returns:
+        list: Summary lines
+    """
+    lines = [f"--- {host} ping statistics ---",
+             f"{stats['sent']} packets transmitted, {stats['received']} received, {stats['loss_pct']:g}% packet loss"]
+    if stats["received"]:
+        lines.append(f"rtt min/avg/max/stddev = {stats['min_ms']:.3f}/{stats['avg_ms']:.3f}/{stats['max_ms']:.3f}/"
+                     f"{stats['stddev_ms']:.3f} ms, jitter {stats['jitter_ms']:.3f} ms")
+    return lines
+
+
+def _checksum(data: bytes) -> int:
+    """Compute the RFC 1071 internet checksum of an ICMP packet."""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class ICMPBatch:
+    def __init__(self, count=1, timeout=1000, interval=0, privileged=None, payload_size=56):
+        """
+        ICMP echo engine probing many hosts over a single socket.
+
+        Parameters:
+            count (int): Number of echo requests sent to each host (default 1)
+            timeout (int): Time to wait for each reply in milliseconds (default 1000)
+            interval (int): Delay between two rounds of requests in milliseconds (default 0)
+            privileged (bool): Force a raw socket (True) or a datagram socket (False).
+                               By default a datagram socket is tried first, which works
+                               unprivileged where net.ipv4.ping_group_range allows it.
+            payload_size (int): Size in bytes of the echo payload (default 56)
+        """
+        self.count = max(1, int(count))
+        self.timeout = timeout / 1000.0
+        self.interval = interval / 1000.0
+        self.privileged = privileged
+        self.payload_size = max(8, payload_size)
+        self.identifier = os.getpid() & 0xFFFF
+
+    def _open_socket(self):
+        """
+        Open the ICMP socket.
+
+        Returns:
+            tuple: (socket, raw) where raw tells whether replies carry an IP header
+        """
+        if self.privileged is not True:
+            try:
+                return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+            except OSError:
+                if self.privileged is False:
+                    raise
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+
+    def _build_request(self, sequence: int) -> bytes:
+        payload = struct.pack("!d", time.perf_counter()).ljust(self.payload_size, b"Q")
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.identifier, sequence)
+        checksum = _checksum(header + payload)
+        return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, self.identifier, sequence) + payload
+
+    def ping(self, hosts):
+        """
+        Send echo requests to every host and collect the replies.
+
+        Parameters:
+            hosts (list): Hostnames or IPv4 addresses
+
+        Returns:
+            dict: ProbeResult per host, with the average round trip time as response time, the
+                  loss and latency statistics in the payload and, when several echoes were
+                  sent, the round trip time of each one (None when lost) as samples
         """
-        Sends an ICMP echo request ping multiple times using pythonping.
+        results = {}
+        addresses = {}
+        for host in dict.fromkeys(hosts):
+            try:
+                ipv4 = [ip for ip in resolver_cache.resolve_blocking(host) if ":" not in ip]
+                if not ipv4:
+                    raise OSError(f"No IPv4 address for {host}")
+                addresses[host] = ipv4[0]
+            except OSError as e:
+                results[host] = ProbeResult.failure(ERROR_DNS, str(e))
+        # Sequence numbers have 16 bits, one per echo of each target: larger batches take turns
+        targets = list(addresses)
+        per_turn = 0x10000 // self.count
+        for first in range(0, len(targets), per_turn):
+            results.update(self._ping_addresses(targets[first:first + per_turn], addresses))
+        return results
+
+    def _ping_addresses(self, targets, addresses):
+        """
+        Send every echo to hosts whose sequence numbers all fit in 16 bits, see ping.
 
         Parameters:
-            count (int): Number of pings to send (default 1)
-            timeout (int): Timeout in milliseconds (default 1000)
+            targets (list): Hosts to probe, at most 65536 // count
+            addresses (dict): IPv4 address of each host
 
         Returns:
-            dict: Contains:
-              - 'success': Boolean indicating success if at least one ping replies.
-              - 'response_time_ms': Minimum response time among received pings, otherwise None.
-              - 'output': Execution details with each ping result.
-              - 'error': Error message in case of exception.
+            dict: ProbeResult per host
         """
+        results = {}
         try:
-            # Convert timeout from milliseconds to seconds
-            timeout_sec = timeout / 1000.0
+            sock, raw = self._open_socket()
+        except OSError as e:
+            for host in targets:
+                results[host] = ProbeResult.from_exception(e)
+            return results
+
+        rtts = {host: [None] * self.count for host in targets}
+        errors = {}
+        # (address, sequence) -> (host, round, send time)
+        pending = {}
 
-            # Perform the ping
-            result = python_ping(
-                self.host,
-                count=count,
-                timeout=timeout_sec,
-                verbose=False
-            )
+        try:
+            sock.setblocking(False)
+            start = time.perf_counter()
+            next_round = 0
+            deadline = start
 
+            while next_round < self.count or pending:
+                now = time.perf_counter()
+                if next_round < self.count and now >= start + next_round * self.interval:
+                    for index, host in enumerate(targets):
+                        sequence = index * self.count + next_round
+                        try:
+                            sent_at = time.perf_counter()
+                            sock.sendto(self._build_request(sequence), (addresses[host], 0))
+                            pending[(addresses[host], sequence)] = (host, next_round, sent_at)
+                        except OSError as e:
+                            errors[host] = e
+                    deadline = time.perf_counter() + self.timeout
+                    next_round += 1
+                    continue
+
+                if now >= deadline and next_round >= self.count:
+                    break
+
+                wake = deadline
+                if next_round < self.count:
+                    wake = min(wake, start + next_round * self.interval)
+                readable, _, _ = select.select([sock], [], [], max(0.0, wake - now))
+                if not readable:
+                    continue
+
+                while True:
+                    try:
+                        packet, (address, _) = sock.recvfrom(65535)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    received_at = time.perf_counter()
+                    if raw:
+                        packet = packet[(packet[0] & 0x0F) * 4:]
+                    if len(packet) < 8:
+                        continue
+                    icmp_type, _, _, identifier, sequence = struct.unpack("!BBHHH", packet[:8])
+                    # Datagram sockets rewrite the identifier, the kernel already filters them
+                    if icmp_type != ICMP_ECHO_REPLY or (raw and identifier != self.identifier):
+                        continue
+                    match = pending.pop((address, sequence), None)
+                    if match is None:
+                        continue
+                    host, round_index, sent_at = match
+                    if received_at - sent_at <= self.timeout:
+                        rtts[host][round_index] = (received_at - sent_at) * 1000
+        finally:
+            sock.close()
+
+        for host in targets:
             responses = []
-            min_rtt = None
-
-            # Process results
-            for response in result:
-                if response.success:
-                    rtt_ms = response.time_elapsed * 1000  # Convert to milliseconds
-                    responses.append(f"Reply from {self.host} in {int(rtt_ms)}ms")
-                    if min_rtt is None or rtt_ms < min_rtt:
-                        min_rtt = rtt_ms
+            for rtt in rtts[host]:
+                if rtt is None:
+                    responses.append("Request timed out")
                 else:
-                    responses.append(f"Request failed: {response.error_message}")
-
-            if responses and min_rtt is not None:
-                return {
-                    "success": True,
-                    "response_time_ms": int(min_rtt),
-                    "output": "\n".join(responses),
-                }
+                    responses.append(f"Reply from {host} in {rtt:.2f}ms")
+            stats = latency_stats(rtts[host])
+            responses.extend(format_stats(host, stats))
+            payload = {"address": addresses[host], **stats}
+            # A single echo is already the response time, only series are worth a blob
+            samples = rtts[host] if self.count > 1 else None
+            if stats["received"]:
+                results[host] = ProbeResult(True, stats["avg_ms"], output="\n".join(responses),
+                                            payload=payload, samples=samples)
+            elif host in errors:
+                results[host] = ProbeResult.from_exception(errors[host], payload=payload)
             else:
-                return {
-                    "success": False,
-                    "response_time_ms": None,
-                    "output": "\n".join(responses) if responses else "No responses received.",
-                }
-        except Exception as e:
-            return {
-                "success": False,
-                "response_time_ms": None,
-                "output": f"Error: {str(e)}",
-                "error": str(e)
-            }
+                results[host] = ProbeResult(False, error_class=ERROR_TIMEOUT,
+                                            error=f"No reply after {self.timeout}s",
+                                            output="\n".join(responses), payload=payload, samples=samples)
+
+        return results
+
+
+# Echoes a site may send per check, and the default delay between two of them in seconds
+MAX_COUNT = 100
+DEFAULT_PING_INTERVAL = 0.2
+
+
+class ICMPProber:
+    """
+    Prober of the `icmp` protocol, built on ICMPBatch.
+
+    Its `timeout` is in seconds, like the other protocols, unlike the
+    milliseconds of ICMPBatch.
+    """
+
+    def __init__(self, config):
+        """
+        Parameters:
+            config (dict): Site configuration; `site`, `count` (echoes sent, default 1),
+                           `ping_interval` (seconds between two echoes, default 0.2) and
+                           `timeout` (seconds to wait for each reply, default 1) are used
+        """
+        self.config = config
+
+    def _engine(self):
+        count = int(self.config.get("count", 1))
+        if not 1 <= count <= MAX_COUNT:
+            raise ValueError(f"Invalid count {count}, between 1 and {MAX_COUNT} echoes can be sent")
+        return ICMPBatch(count=count, timeout=float(self.config.get("timeout", 1)) * 1000,
+                         interval=float(self.config.get("ping_interval", DEFAULT_PING_INTERVAL)) * 1000)
+
+    def ping(self):
+        """
+        Returns:
+            ProbeResult: Result of the probe
+        """
+        host = self.config["site"]
+        return self._engine().ping([host])[host]
+
+    @classmethod
+    def ping_many(cls, configs):
+        """
+        Probe several sites over a single socket per set of settings.
+
+        Parameters:
+            configs (list): Site configurations
+
+        Returns:
+            list: One result per configuration, in the same order
+        """
+        engines = {}
+        keys = []
+        for config in configs:
+            try:
+                engine = cls(config)._engine()
+            except ValueError as e:
+                keys.append(ProbeResult.from_exception(e))
+                continue
+            settings = (engine.count, engine.interval, engine.timeout)
+            engines.setdefault(settings, engine)
+            keys.append((settings, config["site"]))
+
+        replies = {}
+        for settings, engine in engines.items():
+            hosts = [key[1] for key in keys if isinstance(key, tuple) and key[0] == settings]
+            for host, reply in engine.ping(hosts).items():
+                replies[(settings, host)] = reply
+        return [replies[key] if isinstance(key, tuple) else key for key in keys]
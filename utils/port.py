@@ -1,6 +1,11 @@
+import asyncio
+import errno
 import socket
 import time
 
+from core.result import ERROR_DNS, ERROR_OTHER, ERROR_REFUSED, ERROR_TIMEOUT, ERROR_UNREACHABLE, ProbeResult
+from utils.dns import resolver_cache
+
 
 class PortPing:
     def __init__(self, host, port=80, timeout=3):
@@ -9,19 +14,236 @@ class PortPing:
         self.timeout = timeout
 
     def ping(self):
-        start_time = time.time()
+        start_time = time.perf_counter()
         try:
             with socket.create_connection((self.host, self.port), self.timeout) as conn:
-                response_time = time.time() - start_time  # Tiempo en segundos
+                response_time = (time.perf_counter() - start_time) * 1000
                 ip = conn.getpeername()[0]
-                return {
-                    "success": True,
-                    "ip": ip,
-                    "response_time_sec": response_time
-                }
-        except (socket.timeout, socket.error):
-            return {
-                "success": False,
-                "ip": None,
-                "response_time_sec": None
-            }
+                return ProbeResult(True, round(response_time, 3), payload={"ip": ip, "port": self.port})
+        except (socket.timeout, socket.error) as e:
+            return ProbeResult.from_exception(e, payload={"ip": None, "port": self.port})
+
+
+# Connect outcomes reported by AsyncPortPing
+PORT_OPEN = "open"
+PORT_REFUSED = "refused"
+PORT_FILTERED = "filtered"
+PORT_UNREACHABLE = "unreachable"
+PORT_ERROR = "error"
+
+_UNREACHABLE_ERRNOS = {errno.EHOSTUNREACH, errno.ENETUNREACH}
+
+_ERROR_CLASSES = {
+    PORT_REFUSED: ERROR_REFUSED,
+    PORT_FILTERED: ERROR_TIMEOUT,
+    PORT_UNREACHABLE: ERROR_UNREACHABLE,
+    PORT_ERROR: ERROR_OTHER,
+}
+
+
+def parse_target(target, default_port=80):
+    """
+    Split a "host:port" target, "[v6]:port" for IPv6 addresses.
+
+    Returns:
+        tuple: (host, port)
+    """
+    if isinstance(target, tuple):
+        return target[0], int(target[1])
+    if target.startswith("["):
+        host, _, rest = target[1:].partition("]")
+        return host, int(rest[1:]) if rest.startswith(":") else default_port
+    if target.count(":") == 1:
+        host, port = target.split(":")
+        return host, int(port)
+    return target, default_port
+
+
+class AsyncPortPing:
+    def __init__(self, timeout=3, concurrency=500):
+        """
+        Non-blocking TCP connect prober for many host/port targets.
+
+        Parameters:
+            timeout (float): Connect timeout in seconds (default 3)
+            concurrency (int): Maximum number of connects in flight (default 500)
+        """
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+    async def ping(self, host, port):
+        """
+        Open a TCP connection and close it right away.
+
+        Returns:
+            ProbeResult: Successful if the port accepted the connection, with the
+                         connect latency. The payload holds 'status' (open, refused,
+                         filtered when there was no answer before the timeout,
+                         unreachable or error), 'ip' (None if the host could not be
+                         resolved) and 'port'.
+        """
+        loop = asyncio.get_running_loop()
+        payload = {"status": PORT_ERROR, "ip": None, "port": port}
+
+        try:
+            ip = (await resolver_cache.resolve(host))[0]
+        except OSError as e:
+            return ProbeResult.failure(ERROR_DNS, str(e), payload=payload)
+        payload["ip"] = ip
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        address = (ip, port, 0, 0) if family == socket.AF_INET6 else (ip, port)
+
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, address), self.timeout)
+            payload["status"] = PORT_OPEN
+            return ProbeResult(True, round((time.perf_counter() - start) * 1000, 3), payload=payload)
+        except asyncio.TimeoutError:
+            payload["status"] = PORT_FILTERED
+            error = f"No answer after {self.timeout}s"
+        except ConnectionRefusedError as e:
+            payload["status"] = PORT_REFUSED
+            error = str(e)
+        except OSError as e:
+            payload["status"] = PORT_UNREACHABLE if e.errno in _UNREACHABLE_ERRNOS else PORT_ERROR
+            error = str(e)
+        finally:
+            sock.close()
+        return ProbeResult.failure(_ERROR_CLASSES[payload["status"]], error, payload=payload)
+
+    async def ping_many(self, targets, default_port=80):
+        """
+        Probe many targets concurrently.
+
+        Parameters:
+            targets (list): "host:port" strings or (host, port) tuples
+            default_port (int): Port used for targets without one
+
+        Returns:
+            dict: ProbeResult per (host, port)
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def probe(host, port):
+            async with semaphore:
+                return (host, port), await self.ping(host, port)
+
+        pairs = dict.fromkeys(parse_target(target, default_port) for target in targets)
+        return dict(await asyncio.gather(*(probe(host, port) for host, port in pairs)))
+
+
+class PortProber:
+    """
+    Prober of the `port` protocol.
+    """
+
+    def __init__(self, config):
+        """
+        Parameters:
+            config (dict): Site configuration; `site`, `ports` (comma separated)
+                           or `port`, and `timeout` in seconds are used
+        """
+        self.config = config
+
+    def _targets(self):
+        """
+        Returns:
+            tuple: (host, ports, timeout in seconds) of the site
+        """
+        config = self.config
+        ports = [int(port) for port in config.get("ports", config.get("port", "80")).split(",") if port.strip()]
+        return config["site"], ports, float(config.get("timeout", 3))
+
+    def ping(self):
+        """
+        Probe every port configured for the site.
+
+        Returns:
+            ProbeResult: Aggregated result, successful only if every port is open,
+                         with the slowest connect as response time; the payload
+                         'ports' holds the status and latency of each port
+        """
+        from core.loop import run_coroutine
+
+        host, ports, timeout = self._targets()
+        results = run_coroutine(AsyncPortPing(timeout=timeout).ping_many([(host, port) for port in ports]))
+        return self._aggregate({port: result for (_, port), result in results.items()})
+
+    @classmethod
+    def ping_many(cls, configs):
+        """
+        Probe the ports of several sites in a single asyncio batch.
+
+        Sites sharing a timeout share one AsyncPortPing, and a host and port
+        configured for several sites is only connected to once.
+
+        Parameters:
+            configs (list): Site configurations
+
+        Returns:
+            list: One result per configuration, in the same order
+        """
+        from core.loop import run_coroutine
+
+        probers = {}
+        sites = []
+        for config in configs:
+            try:
+                host, ports, timeout = cls(config)._targets()
+            except ValueError as e:
+                sites.append(ProbeResult.from_exception(e))
+                continue
+            probers.setdefault(timeout, []).extend((host, port) for port in ports)
+            sites.append((host, ports, timeout))
+
+        async def probe_all():
+            timeouts = list(probers)
+            batches = await asyncio.gather(*(AsyncPortPing(timeout=timeout).ping_many(probers[timeout])
+                                             for timeout in timeouts))
+            return dict(zip(timeouts, batches))
+
+        replies = run_coroutine(probe_all()) if probers else {}
+        return [
+            cls._aggregate({port: replies[site[2]][(site[0], port)] for port in site[1]})
+            if isinstance(site, tuple) else site
+            for site in sites
+        ]
+
+    @staticmethod
+    def _aggregate(by_port):
+        """
+        Merge the results of the ports of one site, see ping.
+
+        Parameters:
+            by_port (dict): ProbeResult per port
+
+        Returns:
+            ProbeResult: The result of the site
+        """
+        lines = []
+        for port, result in by_port.items():
+            latency = f" in {result.response_time_ms}ms" if result.success else ""
+            lines.append(f"{port}/tcp {result.payload['status']}{latency}")
+        failed = [(port, result) for port, result in by_port.items() if not result.success]
+        latencies = [result.response_time_ms for result in by_port.values() if result.success]
+
+        payload = {"ports": {
+            port: {"status": result.payload["status"], "response_time_ms": result.response_time_ms}
+            for port, result in by_port.items()
+        }}
+        if failed:
+            return ProbeResult.failure(
+                failed[0][1].error_class,
+                ", ".join(f"{port}/tcp {result.payload['status']}" for port, result in failed),
+                payload=payload, output="\n".join(lines)
+            )
+        return ProbeResult(True, max(latencies) if latencies else None, output="\n".join(lines), payload=payload)
+
+
+def ping(config):
+    """
+    Probe every port configured for a site, see PortProber.
+    """
+    return PortProber(config).ping()